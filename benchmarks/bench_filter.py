@@ -0,0 +1,110 @@
+# benchmarks/bench_filter.py
+"""Generated-text cleanup: current single-pass _filter_generated_text vs the previous recursive one.
+Checks identical output on a golden set (generated sentences plus random bracket/quote soup),
+then times both on typical replies and on long emoticon-heavy text.
+Usage: python benchmarks/bench_filter.py [messages]
+"""
+import os
+import re
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from markov_chains import MarkovChains, _filter_generated_text  # noqa: E402
+from benchmarks.synthetic_corpus import make_corpus  # noqa: E402
+
+# ---- previous implementation, kept verbatim for comparison ----
+def _legacy_filter_generated_text(text: str) -> str:
+    if not isinstance(text, str):
+        return ""
+
+    text = text.strip()
+
+    # remove unmatched pairs like (), [], {}
+    for a, b in [("(", ")"), ("[", "]"), ("{", "}")]:
+        text = _legacy_remove_unclosed_pairs(text, a, b)
+
+    # remove unmatched quotes / markdown markers
+    for ch in ('"', "'", "`", "*"):
+        text = _legacy_remove_unclosed_quotes(text, ch)
+
+    # remove stray punctuation at start/end while preserving words
+    if re.search(r"\w", text):
+        text = re.sub(r'^[\.,;: ]+', '', text)
+        text = re.sub(r'[, ]+$', '', text)
+
+    return text
+
+def _legacy_remove_unclosed_quotes(text: str, char: str) -> str:
+    c = text.count(char)
+    if c % 2 != 0:
+        # remove last unmatched
+        idx = text.rfind(char)
+        if idx >= 0:
+            text = text[:idx] + text[idx+1:]
+    return text
+
+def _legacy_remove_unclosed_pairs(text: str, open_ch: str, close_ch: str) -> str:
+    count = 0
+    for i, ch in enumerate(text):
+        if ch == open_ch:
+            count += 1
+        elif ch == close_ch:
+            count -= 1
+        if count < 0:
+            # remove this unmatched close and restart
+            text = text[:i] + text[i+1:]
+            return _legacy_remove_unclosed_pairs(text, open_ch, close_ch)
+    if count > 0:
+        # remove first unmatched open and restart
+        for i, ch in enumerate(text):
+            if ch == open_ch:
+                text = text[:i] + text[i+1:]
+                return _legacy_remove_unclosed_pairs(text, open_ch, close_ch)
+    return text
+# ---- end of previous implementation ----
+
+_SOUP = "()[]{}\"'`*.,;: abc:)(:"
+
+def golden_set(n: int, seed: int = 1234) -> list:
+    rng = random.Random(seed)
+    random.seed(seed)
+    model = MarkovChains()
+    model.generate_dictionary(make_corpus(n, seed))
+    out = [model.generate_chain(rng.randint(5, 40)) for _ in range(n)]
+    out += ["".join(rng.choice(_SOUP) for _ in range(rng.randint(0, 60))) for _ in range(n)]
+    out += ["", "   ", "(", ")", ":) :) (:", "*bold* `code", "..., hi ,,", None]
+    return out
+
+def run(fn, texts, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for t in texts:
+            fn(t)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    golden = golden_set(n)
+    for t in golden:
+        assert _filter_generated_text(t) == _legacy_filter_generated_text(t), repr(t)
+    print(f"golden set: {len(golden)} texts identical")
+
+    replies = [t for t in golden[:n] if t]
+    legacy, current = run(_legacy_filter_generated_text, replies), run(_filter_generated_text, replies)
+    print(f"replies  ({len(replies)}): legacy {legacy * 1e6 / len(replies):7.1f}us  "
+          f"current {current * 1e6 / len(replies):7.1f}us  ({legacy / current:.1f}x)")
+
+    # long emoticon-heavy text: the legacy version rescans once per unmatched bracket, recursively
+    sys.setrecursionlimit(100000)
+    for words in (100, 400, 1600):
+        text = [" ".join(random.Random(words).choice(["lol", ":)", "(ok", "yes", ":(", "*"]) for _ in range(words))]
+        assert _filter_generated_text(text[0]) == _legacy_filter_generated_text(text[0])
+        legacy, current = run(_legacy_filter_generated_text, text), run(_filter_generated_text, text)
+        print(f"{words:5d} words: legacy {legacy * 1e3:8.2f}ms  current {current * 1e3:6.2f}ms  ({legacy / current:.0f}x)")
+
+if __name__ == "__main__":
+    main()
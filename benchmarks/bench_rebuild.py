@@ -0,0 +1,47 @@
+# benchmarks/bench_rebuild.py
+"""Parallel model rebuild: wall time and speedup of model_builder.rebuild over 1..N worker processes,
+checked against a serial build.
+Usage: python benchmarks/bench_rebuild.py [messages] [max_workers] [order]
+"""
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import model_builder  # noqa: E402
+from markov_chains import MarkovChains  # noqa: E402
+from benchmarks.synthetic_corpus import make_corpus  # noqa: E402
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    max_workers = int(sys.argv[2]) if len(sys.argv) > 2 else (os.cpu_count() or 1)
+    order = int(sys.argv[3]) if len(sys.argv) > 3 else None
+    texts = [(t, 1) for t in make_corpus(n)]
+    model_builder.PARALLEL_MIN_TEXTS = 0
+
+    # best of two, so the token cache is warm as it is in the long-lived worker processes
+    base = float("inf")
+    for _ in range(2):
+        start = time.perf_counter()
+        serial = MarkovChains({}, order)
+        serial.generate_dictionary(texts)
+        base = min(base, time.perf_counter() - start)
+    expected = serial.dumps()
+    print(f"{n} messages, order {order or 2}, {len(serial)} keys; {os.cpu_count()} cpu(s)")
+    print(f"serial   : {base:6.2f}s")
+
+    workers = 1
+    while workers <= max_workers:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # warm the pool so process start-up is not timed
+            list(pool.map(abs, range(workers)))
+            start = time.perf_counter()
+            merged = model_builder.rebuild(texts, order, workers, pool)
+            took = time.perf_counter() - start
+        assert merged.dumps() == expected, "merged model differs from the serial build"
+        print(f"{workers:2d} worker(s): {took:6.2f}s  ({base / took:.2f}x)")
+        workers *= 2
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# benchmarks/bench_tokenizer.py
+"""Tokenizer throughput (tokens/sec): the tokenizer path of MarkovChains training vs the previous implementation.
+Usage: python benchmarks/bench_tokenizer.py [messages]
+"""
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from markov_chains import _sentence_split_re, _token_transitions, _clean_token_cached  # noqa: E402
+from benchmarks.synthetic_corpus import make_corpus  # noqa: E402
+
+# ---- previous implementation, kept verbatim for comparison ----
+_legacy_word_split_re = re.compile(r"\s+")
+
+def _legacy_clean_token(tok: str) -> str:
+    if not tok:
+        return ""
+    tok = tok.strip()
+    if re.match(r"^<a?:[A-Za-z0-9_~]+:\d+>$", tok):
+        return tok
+    if re.search(r"\w", tok):
+        tok = re.sub(r"^[<>()[\]{}:;,\.\"]+|[<>()[\]{}:;,\.\"]+$", "", tok)
+    return tok
+
+def _legacy_sentence_transitions(sentence: str):
+    raw_tokens = [t for t in _legacy_word_split_re.split(sentence.strip()) if t != ""]
+    if len(raw_tokens) < 3:
+        return
+    cleaned = [_legacy_clean_token(t) for t in raw_tokens]
+    usable_indices = [i for i, c in enumerate(cleaned) if c != ""]  # noqa: F841 (unused, as before)
+    for i in range(len(raw_tokens) - 2):
+        k1_clean = _legacy_clean_token(raw_tokens[i])
+        k2_clean = _legacy_clean_token(raw_tokens[i + 1])
+        if not k1_clean or not k2_clean:
+            continue
+        yield i, k1_clean, k2_clean, raw_tokens[i], raw_tokens[i + 2]
+
+def _sentence_transitions(sentence: str):
+    """Same steps as MarkovChains._pick_words_sentence: split, clean each token once, walk transitions."""
+    raw_tokens = sentence.split()
+    cleaned = [_clean_token_cached(t) for t in raw_tokens]
+    yield from _token_transitions(raw_tokens, cleaned)
+
+def _sentences(corpus):
+    for text in corpus:
+        for s in _sentence_split_re.split(text):
+            s = s.strip()
+            if s:
+                yield s
+
+def run(transitions, sentences, repeat: int = 3) -> float:
+    """Best-of-repeat seconds to drain transitions over all sentences."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for s in sentences:
+            for _t in transitions(s):
+                pass
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    sentences = list(_sentences(make_corpus(n)))
+    tokens = sum(len(s.split()) for s in sentences)
+    # both must produce identical transitions
+    for s in sentences:
+        assert list(_sentence_transitions(s)) == list(_legacy_sentence_transitions(s)), s
+    legacy = run(_legacy_sentence_transitions, sentences)
+    if hasattr(_clean_token_cached, "cache_clear"):
+        _clean_token_cached.cache_clear()
+    current = run(_sentence_transitions, sentences)
+    print(f"{n} messages, {len(sentences)} sentences, {tokens} tokens")
+    print(f"legacy : {tokens / legacy:12,.0f} tokens/sec")
+    print(f"current: {tokens / current:12,.0f} tokens/sec  ({legacy / current:.1f}x)")
+
+if __name__ == "__main__":
+    main()
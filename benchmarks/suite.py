@@ -0,0 +1,270 @@
+# benchmarks/suite.py
+"""Offline benchmark suite for the Markov engine and the storage layer.
+Every run uses the deterministic synthetic corpus and writes machine-readable JSON; with --compare the
+metrics of an earlier run are listed next to the new ones (quick runs are noisy, compare full runs).
+Usage:
+  python benchmarks/suite.py [--quick] [--out results.json] [--compare baseline.json]
+"""
+import os
+import sys
+import gc
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+from typing import Any, Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from markov_chains import MarkovChains, _filter_generated_text, _sentences, np  # noqa: E402
+from mapped_chains import MappedChains, export_map  # noqa: E402
+from benchmarks.synthetic_corpus import make_corpus  # noqa: E402
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """p50/p90/p99/max of per-call seconds, reported in microseconds."""
+    s = sorted(samples)
+    pick = lambda q: s[min(len(s) - 1, int(q * len(s)))] * 1e6
+    return {"p50_us": pick(0.50), "p90_us": pick(0.90), "p99_us": pick(0.99), "max_us": s[-1] * 1e6}
+
+def best_of(fn: Callable[[], Any], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def build(texts, order=None) -> MarkovChains:
+    markov = MarkovChains({}, order)
+    markov.generate_dictionary(texts)
+    return markov
+
+# ---------------- benchmarks ----------------
+def bench_ingest(corpus: List[str], repeat: int) -> Dict[str, Any]:
+    tokens = sum(len(s.split()) for t in corpus for s in _sentences(t))
+    def pick():
+        markov = MarkovChains()
+        for text in corpus:
+            markov._pick_sentence_words(text)
+    pick_s = best_of(pick, repeat)
+    dict_s = best_of(lambda: build(corpus), repeat)
+    dict3_s = best_of(lambda: build(corpus, 3), repeat)
+    return {
+        "messages": len(corpus),
+        "tokens": tokens,
+        "pick_sentence_words_tokens_per_s": tokens / pick_s,
+        "generate_dictionary_msgs_per_s": len(corpus) / dict_s,
+        "generate_dictionary_order3_msgs_per_s": len(corpus) / dict3_s,
+    }
+
+def bench_generate(sizes: List[int], calls: int) -> Dict[str, Any]:
+    out = {}
+    for n in sizes:
+        corpus = make_corpus(n)
+        for order in (None, 3):
+            markov = build(corpus, order)
+            random.seed(n)
+            samples = []
+            for _ in range(calls):
+                start = time.perf_counter()
+                markov.generate_chain(random.randint(5, 40))
+                samples.append(time.perf_counter() - start)
+            out[f"{n}_order{order or 2}"] = dict(percentiles(samples), keys=len(markov))
+    return out
+
+def bench_generate_many(corpus: List[str], n: int) -> Dict[str, Any]:
+    """Bulk generation per sentence: chains walked one by one vs NumPy lockstep (when installed)."""
+    markov = build(corpus)
+    limits = [random.Random(i).randint(5, 40) for i in range(n)]
+    walk = best_of(lambda: markov.generate_many(n, limits, seed=1, vectorized=False), 3)
+    out = {"python_us_per_sentence": walk * 1e6 / n}
+    if np is not None:
+        # build the flat tables outside the timing
+        markov.generate_many(1, 5, vectorized=True)
+        lockstep = best_of(lambda: markov.generate_many(n, limits, seed=1, vectorized=True), 3)
+        out["numpy_us_per_sentence"] = lockstep * 1e6 / n
+    return out
+
+def bench_memory(sizes: List[int]) -> Dict[str, Any]:
+    out = {}
+    for n in sizes:
+        corpus = make_corpus(n)
+        for order in (None, 3):
+            gc.collect()
+            tracemalloc.start()
+            markov = build(corpus, order)
+            current, _peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            out[f"{n}_order{order or 2}"] = {
+                "keys": len(markov),
+                "traced_bytes": current,
+                "bytes_per_key": current / max(1, len(markov)),
+                "approx_nbytes": markov.approx_nbytes(),
+                "snapshot_bytes": len(markov.dumps()),
+            }
+            del markov
+    return out
+
+def bench_mapped(n: int, calls: int) -> Dict[str, Any]:
+    """Memory-mapped model: map file size, resident bytes after opening it, generate_chain latency."""
+    scratch = tempfile.mkdtemp(prefix="markov-bench-")
+    try:
+        path = export_map(build(make_corpus(n)), scratch)
+        gc.collect()
+        tracemalloc.start()
+        mapped = MappedChains(path)
+        opened, _peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        random.seed(n)
+        samples = []
+        for _ in range(calls):
+            start = time.perf_counter()
+            mapped.generate_chain(random.randint(5, 40))
+            samples.append(time.perf_counter() - start)
+        return dict(percentiles(samples), keys=len(mapped), file_bytes=os.path.getsize(path), traced_bytes=opened)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+def bench_filter(corpus: List[str], calls: int) -> Dict[str, Any]:
+    markov = build(corpus)
+    random.seed(1)
+    replies = [markov.generate_chain(random.randint(5, 40)) for _ in range(calls)]
+    noisy = " ".join(random.Random(2).choice(["lol", ":)", "(ok", "yes", ":(", "*", '"']) for _ in range(2000))
+    samples = []
+    for text in replies:
+        start = time.perf_counter()
+        _filter_generated_text(text)
+        samples.append(time.perf_counter() - start)
+    long_ms = best_of(lambda: _filter_generated_text(noisy), 5) * 1e3
+    return dict(percentiles(samples), long_noisy_2000_words_ms=long_ms)
+
+def bench_storage(n: int, backend: str) -> Dict[str, Any]:
+    """GuildDB.add_text end to end in a scratch data dir: call latency, then time until it is persisted."""
+    code = f"""
+import os, sys, json, time
+sys.path.insert(0, {REPO_DIR!r})
+from benchmarks.synthetic_corpus import make_entries
+from benchmarks.suite import percentiles
+from db_json import db
+guild_db = db.fetch("1")
+entries = make_entries({n})
+samples = []
+start = time.perf_counter()
+for e in entries:
+    t = time.perf_counter()
+    guild_db.add_text(e["text"], e["authorId"], e["messageId"], e["weight"])
+    samples.append(time.perf_counter() - t)
+calls = time.perf_counter() - start
+t = time.perf_counter()
+db.flush(60)
+flush = time.perf_counter() - t
+t = time.perf_counter()
+guild_db.save_markov()
+db.flush(60)
+snapshot = time.perf_counter() - t
+print(json.dumps(dict(percentiles(samples), adds_per_s={n} / calls, flush_s=flush, full_snapshot_s=snapshot)))
+"""
+    scratch = tempfile.mkdtemp(prefix="markov-bench-")
+    try:
+        env = dict(os.environ, DB_BACKEND=backend, DB_FLUSH_LATENCY="0.05")
+        proc = subprocess.run([sys.executable, "-c", code], cwd=scratch, env=env,
+                              capture_output=True, text=True, check=True)
+        result = json.loads(proc.stdout.strip().splitlines()[-1])
+        reload = subprocess.run([sys.executable, "-c", f"""
+import sys, time
+sys.path.insert(0, {REPO_DIR!r})
+t = time.perf_counter()
+from db_json import db
+db.fetch("1")
+print(time.perf_counter() - t)
+"""], cwd=scratch, env=env, capture_output=True, text=True, check=True)
+        result["reload_s"] = float(reload.stdout.strip().splitlines()[-1])
+        return result
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+# ---------------- driver ----------------
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                              capture_output=True, text=True).stdout.strip()
+    except Exception:
+        return ""
+
+def run(quick: bool) -> Dict[str, Any]:
+    n = 5000 if quick else 20000
+    sizes = [1000, 5000] if quick else [1000, 10000, 50000]
+    repeat = 1 if quick else 3
+    corpus = make_corpus(n)
+    results = {}
+    for name, fn in (
+        ("ingest", lambda: bench_ingest(corpus, repeat)),
+        ("generate_chain", lambda: bench_generate(sizes, 500 if quick else 2000)),
+        ("generate_many", lambda: bench_generate_many(corpus, 1000 if quick else 5000)),
+        ("memory", lambda: bench_memory(sizes)),
+        ("mapped", lambda: bench_mapped(sizes[-1], 500 if quick else 2000)),
+        ("filter", lambda: bench_filter(corpus, 2000)),
+        ("add_text_json", lambda: bench_storage(2000 if quick else 10000, "json")),
+        ("add_text_sqlite", lambda: bench_storage(2000 if quick else 10000, "sqlite")),
+    ):
+        started = time.perf_counter()
+        results[name] = fn()
+        print(f"{name:16s} done in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "quick": quick,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+
+def _flatten(d: Dict[str, Any], prefix: str = "") -> Dict[str, float]:
+    out = {}
+    for k, v in d.items():
+        if isinstance(v, dict):
+            out.update(_flatten(v, f"{prefix}{k}."))
+        elif isinstance(v, (int, float)):
+            out[f"{prefix}{k}"] = v
+    return out
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any]):
+    """Print current/baseline ratios; for *_per_s metrics higher is better, for everything else lower."""
+    base, cur = _flatten(baseline["results"]), _flatten(current["results"])
+    print(f"\ncompared with {baseline['meta'].get('commit') or 'baseline'}:")
+    for key in sorted(base.keys() & cur.keys()):
+        if not base[key]:
+            continue
+        ratio = cur[key] / base[key]
+        better = ratio > 1 if key.endswith("_per_s") else ratio < 1
+        flag = "" if abs(ratio - 1) < 0.10 else ("  better" if better else "  WORSE")
+        print(f"  {key:55s} {base[key]:14.2f} -> {cur[key]:14.2f}  x{ratio:.2f}{flag}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quick", action="store_true", help="smaller corpora and fewer repeats")
+    parser.add_argument("--out", help="write results JSON here (default: stdout)")
+    parser.add_argument("--compare", help="results JSON of an earlier run to compare against")
+    args = parser.parse_args()
+    report = run(args.quick)
+    data = json.dumps(report, indent=2, sort_keys=True)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(data + "\n")
+    else:
+        print(data)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(json.load(f), report)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+# benchmarks/synthetic_corpus.py
+"""Deterministic synthetic chat corpus for the benchmarks (same seed -> same messages)."""
+import random
+from typing import Dict, Any, List
+
+_WORDS = (
+    "the a to and i you it is that of in lol bro yeah no what this for me on so just like "
+    "was are do be not have but my can we u ok okay bhai hai kya nhi tha yaar haha lmao why "
+    "how who when game play server bot chat guys today tomorrow night good bad best worst "
+    "really very much more time people thing something nothing everyone anyone know think"
+).split()
+_PUNCT = ("", "", "", "", ",", ".", "!", "?", "...", ":")
+_EMOJI = ("<:kek:123456789012345678>", "<a:dance:234567890123456789>", "😂", "💀", "🔥")
+_MENTIONS = ("<@345678901234567890>", "<@!456789012345678901>", "<@&567890123456789012>")
+_WRAP = (("(", ")"), ('"', '"'), ("*", "*"), ("`", "`"))
+
+def _word(rng: random.Random) -> str:
+    # Zipf-like: a few words dominate, as in real chat
+    return _WORDS[min(int(rng.paretovariate(1.2)) - 1, len(_WORDS) - 1)]
+
+def make_message(rng: random.Random) -> str:
+    tokens = []
+    for _ in range(rng.randint(3, 24)):
+        r = rng.random()
+        if r < 0.04:
+            tokens.append(rng.choice(_EMOJI))
+        elif r < 0.055:
+            tokens.append(rng.choice(_MENTIONS))
+        elif r < 0.085:
+            open_ch, close_ch = rng.choice(_WRAP)
+            tokens.append(f"{open_ch}{_word(rng)}{close_ch}")
+        else:
+            tokens.append(_word(rng) + rng.choice(_PUNCT))
+    return " ".join(tokens)
+
+def make_corpus(n: int = 20000, seed: int = 1234) -> List[str]:
+    rng = random.Random(seed)
+    return [make_message(rng) for _ in range(n)]
+
+def make_entries(n: int = 20000, seed: int = 1234, authors: int = 50) -> List[Dict[str, Any]]:
+    """Stored-entry dicts (as in GuildDB texts) for the same corpus."""
+    rng = random.Random(seed + 1)
+    return [
+        {"text": text, "authorId": str(10 ** 17 + rng.randrange(authors)), "messageId": str(10 ** 18 + i),
+         "weight": 1 if rng.random() < 0.9 else 3, "source": "channel"}
+        for i, text in enumerate(make_corpus(n, seed))
+    ]
@@ -5,9 +5,11 @@ import time
 import aiohttp
 import logging
 import re
+import discord
 from discord.ext import commands
-from db_json import db
-from markov_chains import MarkovChains
+from db_json import db, EVICTION_POLICIES, DUPLICATE_POLICIES
+from markov_chains import MAX_ORDER
+from sentence_pool import SentencePool, MIN_WORDS, MAX_WORDS
 
 # mention sanitizer
 MENTION_PATTERN = re.compile(r"<@!?(?P<id>\d+)>")
@@ -23,10 +25,33 @@ def sanitize_mentions(text: str, disabled_ids: list):
     out = re.sub(r"\s{2,}", " ", out).strip()
     return out
 
+# ?markov-scan: messages per ingested batch, and how many scanned messages between durable checkpoints
+SCAN_BATCH_SIZE = 1000
+SCAN_CHECKPOINT_EVERY = 20000
+
 logger = logging.getLogger("chatbot_cog")
 if not logging.getLogger().handlers:
     logging.basicConfig(level=logging.INFO)
 
+class _ScanState:
+    """Progress of one running ?markov-scan, for ?markov-scan-status and ?markov-scan-cancel."""
+    __slots__ = ("mode", "limit", "channel_id", "started", "scanned", "scanned_before", "stored", "duplicates",
+                 "last_id", "cancelled")
+
+    def __init__(self, mode: str, limit=None):
+        self.mode = mode
+        self.limit = limit
+        self.channel_id = None
+        self.started = time.time()
+        self.scanned = 0
+        # messages the scans this one resumes had already read; the cursor keeps the running total
+        self.scanned_before = 0
+        self.stored = 0
+        self.duplicates = 0
+        # id of the last message read; the cursor is saved at it once the texts before it are stored
+        self.last_id = None
+        self.cancelled = False
+
 class ChatbotCog(commands.Cog, name="chatbot"):
     def __init__(self, bot):
         self.bot = bot
@@ -43,6 +68,18 @@ class ChatbotCog(commands.Cog, name="chatbot"):
         except Exception:
             self.cmd_prefixes = None
         self._last_setchannel = {}
+        # pre-generated replies, refilled in the background
+        self.sentence_pool = SentencePool()
+        # guild id -> the ?markov-scan in progress
+        self._scans = {}
+        # guild id -> {channel id: whether the bot may send there}, from guild.me; see _can_send
+        self._send_perms = {}
+
+    async def cog_load(self):
+        self.sentence_pool.start()
+
+    async def cog_unload(self):
+        self.sentence_pool.stop()
 
     def _is_command(self, content: str) -> bool:
         if not content or self.cmd_prefixes is None:
@@ -60,17 +97,14 @@ class ChatbotCog(commands.Cog, name="chatbot"):
         if message.guild is None:
             user_id = str(message.author.id)
             try:
-                all_raw = db._raw
+                targets = db.dm_learn_guilds(user_id)
             except Exception:
-                all_raw = {}
-            for gid, graw in list(all_raw.items()):
+                targets = []
+            for gid, weight in targets:
                 try:
-                    dm_learn = graw.get("dm_learn_users", {})
-                    if user_id in dm_learn:
-                        weight = int(dm_learn.get(user_id, 1))
-                        gd = db.fetch(gid)
-                        gd.add_text(message.content, user_id, str(message.id), weight=weight, source="dm")
-                        logger.info(f"[DM] Added DM from {user_id} -> guild {gid} (w={weight})")
+                    gd = db.fetch(gid)
+                    gd.add_text(message.content, user_id, str(message.id), weight=weight, source="dm")
+                    logger.info(f"[DM] Added DM from {user_id} -> guild {gid} (w={weight})")
                 except Exception:
                     logger.exception("Error processing DM learn")
                     continue
@@ -87,19 +121,12 @@ class ChatbotCog(commands.Cog, name="chatbot"):
             await self.bot.process_commands(message)
             return
 
+        # only the Markov channel gets further; permissions are checked for it alone
         channel = message.channel
-        channel_id = guild_db.get_channel()
-        webhook_url = guild_db.get_webhook()
-
-        try:
-            me = await message.guild.fetch_member(self.bot.user.id)
-            can_send = channel.permissions_for(me).send_messages
-        except Exception:
-            can_send = False
-
-        if not (channel and channel.id == channel_id and can_send):
+        if not (channel and channel.id == guild_db.get_channel() and await self._can_send(channel)):
             await self.bot.process_commands(message)
             return
+        webhook_url = guild_db.get_webhook()
 
         has_mention = any(u.id == self.bot.user.id for u in message.mentions)
         texts_len = guild_db.get_texts_length()
@@ -137,8 +164,10 @@ class ChatbotCog(commands.Cog, name="chatbot"):
         self.bot.cooldown[guild_id] = now_ms
 
         try:
-            maxw = random.randint(5, 40)
-            generated = guild_db.markov.generate_chain(maxw)
+            generated = self.sentence_pool.pop(guild_db)
+            if generated is None:
+                # pool still filling; generate inline this once
+                generated = guild_db.markov.generate_chain(random.randint(MIN_WORDS, MAX_WORDS))
         except Exception:
             logger.exception("Generation error")
             generated = ""
@@ -149,9 +178,7 @@ class ChatbotCog(commands.Cog, name="chatbot"):
 
         # sanitize mentions
         try:
-            disabled_list = guild_db._raw.get("disabledMentionUserIds", [])
-            disabled_list_str = [str(x) for x in disabled_list]
-            generated = sanitize_mentions(generated, disabled_list_str)
+            generated = sanitize_mentions(generated, guild_db.get_disabled_mentions())
         except Exception:
             logger.exception("Sanitization failed")
 
@@ -179,6 +206,106 @@ class ChatbotCog(commands.Cog, name="chatbot"):
 
         await self.bot.process_commands(message)
 
+    # ---------------- cached send permissions ----------------
+    async def _can_send(self, channel) -> bool:
+        """Whether the bot may send in channel, computed from the cached guild.me once per channel.
+        Entries are dropped when the channel, a role, the bot's member or the guild goes away or changes.
+        """
+        perms = self._send_perms.setdefault(channel.guild.id, {})
+        can_send = perms.get(channel.id)
+        if can_send is None:
+            try:
+                me = channel.guild.me
+                if me is None:
+                    # not in the member cache yet; ask the API and cache the answer like any other
+                    me = await channel.guild.fetch_member(self.bot.user.id)
+                can_send = perms[channel.id] = channel.permissions_for(me).send_messages
+            except Exception:
+                can_send = False
+        return can_send
+
+    def _forget_perms(self, guild_id):
+        self._send_perms.pop(guild_id, None)
+
+    @commands.Cog.listener()
+    async def on_guild_channel_update(self, before, after):
+        # also fires for overwrite changes; a category's overwrites reach its channels and their threads,
+        # so the whole guild is recomputed (rare, and only channels the bot talks in are cached)
+        self._forget_perms(after.guild.id)
+
+    @commands.Cog.listener()
+    async def on_guild_channel_delete(self, channel):
+        self._forget_perms(channel.guild.id)
+
+    @commands.Cog.listener()
+    async def on_guild_role_update(self, before, after):
+        # role permissions and channel overwrites for the role apply everywhere in the guild
+        self._forget_perms(after.guild.id)
+
+    @commands.Cog.listener()
+    async def on_guild_role_delete(self, role):
+        self._forget_perms(role.guild.id)
+
+    @commands.Cog.listener()
+    async def on_member_update(self, before, after):
+        # the bot gained or lost roles (or timeout)
+        if after.id == self.bot.user.id:
+            self._forget_perms(after.guild.id)
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild):
+        self._forget_perms(guild.id)
+
+    # ---------------- unlearning deleted / edited messages ----------------
+    def _learned_in(self, guild_id, channel_id, author_id=None) -> list:
+        """Guild DBs that may hold a message: its guild if it is in the Markov channel, or for DMs the
+        guilds learning that author's DMs. Other channels are ruled out without loading the guild.
+        """
+        if guild_id is not None:
+            if channel_id is None or db.markov_channel(str(guild_id)) != channel_id:
+                return []
+            return [db.fetch(str(guild_id))]
+        if author_id is None:
+            return []
+        return [db.fetch(gid) for gid, _ in db.dm_learn_guilds(str(author_id))]
+
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload):
+        cached = payload.cached_message
+        try:
+            for guild_db in self._learned_in(payload.guild_id, payload.channel_id,
+                                             cached.author.id if cached else None):
+                if guild_db.remove_message(str(payload.message_id)):
+                    logger.debug(f"[{guild_db.guild_id}] unlearned deleted message {payload.message_id}")
+        except Exception:
+            logger.exception("Error unlearning deleted message")
+
+    @commands.Cog.listener()
+    async def on_raw_bulk_message_delete(self, payload):
+        try:
+            for guild_db in self._learned_in(payload.guild_id, payload.channel_id):
+                removed = sum(guild_db.remove_message(str(mid)) for mid in payload.message_ids)
+                if removed:
+                    logger.info(f"[{guild_db.guild_id}] unlearned {removed} bulk-deleted messages")
+        except Exception:
+            logger.exception("Error unlearning bulk-deleted messages")
+
+    @commands.Cog.listener()
+    async def on_raw_message_edit(self, payload):
+        # embed-only updates carry no content
+        content = payload.data.get("content")
+        if content is None:
+            return
+        author_id = (payload.data.get("author") or {}).get("id")
+        try:
+            for guild_db in self._learned_in(payload.guild_id, payload.channel_id, author_id):
+                if content.strip():
+                    guild_db.edit_message(str(payload.message_id), content)
+                else:
+                    guild_db.remove_message(str(payload.message_id))
+        except Exception:
+            logger.exception("Error retraining edited message")
+
     # ---------------- admin commands ----------------
     @commands.command(name="markov-setchannel")
     @commands.has_guild_permissions(administrator=True)
@@ -196,14 +323,33 @@ class ChatbotCog(commands.Cog, name="chatbot"):
 
     @commands.command(name="markov-scan")
     @commands.has_guild_permissions(administrator=True)
-    async def markov_scan(self, ctx, limit: int = None):
-        """Scan channel history (batch flushes + progress).
+    async def markov_scan(self, ctx, *args: str):
+        """Scan channel history (batch flushes + progress, checkpointed and resumable).
         Usage:
-          ?markov-scan           -> full history
+          ?markov-scan           -> continue after the last scan, otherwise the full history
           ?markov-scan 500      -> up to 500 messages
+          ?markov-scan new      -> same as the plain form
+          ?markov-scan full     -> the full history again (stored messages are skipped)
+        ?markov-scan-status shows progress, ?markov-scan-cancel stops it at the next message.
         """
-        await ctx.send(f"📥 Starting scan (limit={limit or 'ALL'}) — this may take a while for large channels...")
+        limit, mode = None, "auto"
+        for arg in args:
+            if arg.isdigit():
+                limit = int(arg) or None
+            elif arg.lower() in ("new", "full"):
+                mode = arg.lower()
+            else:
+                return await ctx.send("❌ Usage: ?markov-scan [limit] [new|full]")
+        gid = str(ctx.guild.id)
+        if gid in self._scans:
+            return await ctx.send("⏳ A scan is already running for this server.")
+        state = self._scans[gid] = _ScanState(mode, limit)
+        try:
+            await self._scan(ctx, state)
+        finally:
+            self._scans.pop(gid, None)
 
+    async def _scan(self, ctx, state):
         guild_db = db.fetch(str(ctx.guild.id))
         channel_id = guild_db.get_channel()
         if channel_id is None:
@@ -212,103 +358,268 @@ class ChatbotCog(commands.Cog, name="chatbot"):
         channel = ctx.guild.get_channel(channel_id)
         if channel is None:
             return await ctx.send("❌ Could not find configured channel.")
+        state.channel_id = channel_id
+
+        # continue after the saved cursor (finished or not) unless the full history was asked for
+        cursor = guild_db.get_scan_cursor(channel_id)
+        after = None
+        if cursor and state.mode != "full":
+            after = int(cursor["last"])
+            state.last_id = after
+            state.scanned_before = int(cursor.get("scanned", 0) or 0)
+        if after:
+            await ctx.send(f"📥 Resuming scan after message {after} (limit={state.limit or 'ALL'})...")
+        else:
+            await ctx.send(f"📥 Starting scan (limit={state.limit or 'ALL'}) — this may take a while for large channels...")
 
-        batch_size = 1000
+        # a fresh scan at least as large as the stored corpus stores batches untrained and rebuilds the
+        # model once at the end (in parallel); resumed and smaller top-up scans train batch by batch
+        rebuild = after is None and (state.limit is None or state.limit >= guild_db.get_texts_length())
         progress_every = 500
-        added = 0
+        checkpoint_at = SCAN_CHECKPOINT_EVERY
+        train_seconds = 0.0
         buffer_texts = []
-        idx = 0
+        error = None
 
         try:
-            async for msg in channel.history(limit=limit, oldest_first=True):
-                idx += 1
+            history = channel.history(limit=state.limit, after=discord.Object(id=after) if after else None,
+                                      oldest_first=True)
+            async for msg in history:
+                if state.cancelled:
+                    break
+                state.scanned += 1
+                # every message up to here is stored or filtered once the buffer is
+                state.last_id = msg.id
+                # progress update
+                if state.scanned % progress_every == 0:
+                    await ctx.send(f"🔁 Scanned {state.scanned} messages so far...")
                 # filters
-                if msg.author.bot:
-                    continue
-                if not msg.content or not msg.content.strip():
-                    continue
-
-                buffer_texts.append({
-                    "text": msg.content,
-                    "authorId": str(msg.author.id),
-                    "messageId": str(msg.id),
-                    "weight": 1,
-                    "source": "scan"
-                })
-                added += 1
-
-                # flush batch to DB
-                if len(buffer_texts) >= batch_size:
-                    guild_raw = guild_db._raw
-                    guild_raw.setdefault("texts", []).extend(buffer_texts)
+                if msg.author.bot or not msg.content or not msg.content.strip():
+                    pass
+                # already stored by an earlier scan or collected live; identical content per the guild's policy
+                elif guild_db.is_duplicate(msg.content, str(msg.id)):
+                    state.duplicates += 1
+                else:
+                    buffer_texts.append({
+                        "text": msg.content,
+                        "authorId": str(msg.author.id),
+                        "messageId": str(msg.id),
+                        "weight": 1,
+                        "source": "scan"
+                    })
+
+                # train on the batch only; the cursor advances with every stored batch
+                if len(buffer_texts) >= SCAN_BATCH_SIZE:
+                    train_seconds += self._scan_store(guild_db, state, buffer_texts, rebuild)
+                    buffer_texts = []
+                # durable checkpoint: texts and cursor are on disk before the scan goes on
+                if state.scanned >= checkpoint_at:
+                    train_seconds += self._scan_store(guild_db, state, buffer_texts, rebuild)
                     buffer_texts = []
-                    texts = guild_raw.get("texts", [])
-                    guild_db.markov.generate_dictionary(texts)
                     guild_db.save_markov()
-
-                # progress update
-                if added % progress_every == 0:
-                    await ctx.send(f"🔁 Scanned {added} messages so far...")
-
+                    await asyncio.to_thread(db.flush, 60)
+                    checkpoint_at = state.scanned + SCAN_CHECKPOINT_EVERY
         except Exception as e:
             logger.exception("Scan error")
-            return await ctx.send(f"❌ Scan failed: {e}")
-
-        # append any remaining buffer
-        if buffer_texts:
-            guild_raw = guild_db._raw
-            guild_raw.setdefault("texts", []).extend(buffer_texts)
-            texts = guild_raw.get("texts", [])
-            guild_db.markov.generate_dictionary(texts)
+            error = e
+
+        # keep what was read before a failure or cancel; the cursor lets the next scan resume there
+        complete = error is None and not state.cancelled and (state.limit is None or state.scanned < state.limit)
+        train_seconds += self._scan_store(guild_db, state, buffer_texts, rebuild, complete)
+        try:
+            if rebuild and state.stored:
+                train_seconds += await guild_db.rebuild_markov()
+        finally:
             guild_db.save_markov()
 
-        await ctx.send(f"✅ Scan complete — added {added} messages.")
+        summary = (f"added {state.stored} messages, skipped {state.duplicates} duplicates "
+                   f"(model training took {train_seconds:.1f}s)")
+        if error is not None:
+            return await ctx.send(f"❌ Scan failed: {error} — {summary}. Run ?markov-scan to resume.")
+        if state.cancelled:
+            return await ctx.send(f"⏹️ Scan cancelled — {summary}. Run ?markov-scan to resume.")
+        await ctx.send(f"✅ Scan complete — {summary}.")
+
+    @staticmethod
+    def _scan_store(guild_db, state, entries, rebuild: bool, complete: bool = False) -> float:
+        """Store a scanned batch and move the channel's cursor past it. Returns the seconds it took."""
+        started = time.perf_counter()
+        if entries:
+            skipped = guild_db.duplicates_skipped
+            state.stored += guild_db.extend_texts(entries, persist=False, train=not rebuild)
+            # repeats within the batch itself are only caught as it is stored
+            state.duplicates += guild_db.duplicates_skipped - skipped
+        if state.last_id:
+            guild_db.set_scan_cursor(state.channel_id, state.last_id, complete, state.scanned_before + state.scanned)
+        return time.perf_counter() - started
+
+    @commands.command(name="markov-scan-status")
+    @commands.has_guild_permissions(administrator=True)
+    async def markov_scan_status(self, ctx):
+        guild_db = db.fetch(str(ctx.guild.id))
+        state = self._scans.get(str(ctx.guild.id))
+        if state is not None:
+            elapsed = time.time() - state.started
+            return await ctx.send(
+                f"🔁 Scan running for {elapsed:.0f}s ({state.mode}, limit={state.limit or 'ALL'}): "
+                f"{state.scanned} scanned ({state.scanned / max(elapsed, 1):.0f}/s), {state.stored} added, "
+                f"{state.duplicates} duplicates, at message {state.last_id or '-'}"
+                f"{' — cancelling' if state.cancelled else ''}.")
+        channel_id = guild_db.get_channel()
+        cursor = guild_db.get_scan_cursor(channel_id) if channel_id is not None else None
+        if cursor is None:
+            return await ctx.send("No scan running; the Markov channel has not been scanned yet.")
+        when = time.strftime("%Y-%m-%d %H:%M UTC", time.gmtime(cursor.get("time", 0)))
+        await ctx.send(
+            f"No scan running. Last scan of <#{channel_id}> {'finished' if cursor.get('complete') else 'stopped'} "
+            f"at message {cursor['last']} ({cursor.get('scanned', 0)} scanned, {when}).")
+
+    @commands.command(name="markov-scan-cancel")
+    @commands.has_guild_permissions(administrator=True)
+    async def markov_scan_cancel(self, ctx):
+        state = self._scans.get(str(ctx.guild.id))
+        if state is None:
+            return await ctx.send("No scan is running.")
+        state.cancelled = True
+        await ctx.send("⏹️ Stopping the scan after the current message...")
 
     @commands.command(name="markov-stats")
     @commands.has_guild_permissions(administrator=True)
     async def markov_stats(self, ctx):
         guild_db = db.fetch(str(ctx.guild.id))
-        texts = guild_db.get_texts()
-        wl_size = len(guild_db.markov.word_list) if hasattr(guild_db, "markov") else 0
+        texts_len = guild_db.get_texts_length()
+        wl_size = len(guild_db.markov) if hasattr(guild_db, "markov") else 0
+        cache = db.cache_stats()
         await ctx.send(
-            f"Texts stored: {len(texts)}\n"
+            f"Texts stored: {texts_len}\n"
             f"Markov keys: {wl_size}\n"
             f"collectionPercentage: {guild_db.get_collection_percentage()}\n"
             f"sendingPercentage: {guild_db.get_sending_percentage()}\n"
             f"replyPercentage: {guild_db.get_reply_percentage()}\n"
             f"channelId: {guild_db.get_channel()}\n"
+            f"corpusLimit: {self._format_limit(guild_db)}\n"
+            f"markovOrder: {guild_db.get_markov_order() or '2 (strict)'}\n"
+            f"duplicatePolicy: {guild_db.get_duplicate_policy()} ({guild_db.duplicates_skipped} skipped)\n"
+            f"guildCache: {cache['resident']} resident, {cache['hits']} hits, "
+            f"{cache['misses']} misses, {cache['evictions']} evictions\n"
         )
 
+    @staticmethod
+    def _format_limit(guild_db) -> str:
+        max_texts, max_bytes, policy = guild_db.get_corpus_limit()
+        if not max_texts and not max_bytes:
+            return "unlimited"
+        caps = []
+        if max_texts:
+            caps.append(f"{max_texts} texts")
+        if max_bytes:
+            caps.append(f"{max_bytes} bytes")
+        return f"{' / '.join(caps)} ({policy})"
+
+    @commands.command(name="markov-limit")
+    @commands.has_guild_permissions(administrator=True)
+    async def markov_limit(self, ctx, max_texts: int = 0, policy: str = "oldest", max_bytes: int = 0):
+        """Cap the stored corpus; 0 means unlimited.
+        Usage:
+          ?markov-limit 50000                -> keep the newest 50000 texts
+          ?markov-limit 50000 reservoir      -> keep a uniform sample of 50000 texts
+          ?markov-limit 50000 fair           -> evict from the most prolific author first
+          ?markov-limit 0 oldest 5000000     -> cap by text size (bytes) instead
+        """
+        if policy not in EVICTION_POLICIES:
+            return await ctx.send(f"❌ Unknown policy. Use one of: {', '.join(EVICTION_POLICIES)}")
+        guild_db = db.fetch(str(ctx.guild.id))
+        evicted = guild_db.set_corpus_limit(max_texts, max_bytes, policy)
+        await ctx.send(f"Corpus limit set to {self._format_limit(guild_db)}; evicted {evicted} texts.")
+
+    @commands.command(name="markov-dedup")
+    @commands.has_guild_permissions(administrator=True)
+    async def markov_dedup(self, ctx, policy: str = "skip"):
+        """Choose what happens to messages whose content is already stored (ignoring case and spacing).
+        Messages whose id is already stored are always skipped.
+        Usage:
+          ?markov-dedup skip   -> drop repeated content (copypasta, spam)
+          ?markov-dedup keep   -> store repeats (default)
+        """
+        if policy not in DUPLICATE_POLICIES:
+            return await ctx.send(f"❌ Unknown policy. Use one of: {', '.join(DUPLICATE_POLICIES)}")
+        guild_db = db.fetch(str(ctx.guild.id))
+        guild_db.set_duplicate_policy(policy)
+        await ctx.send(f"Duplicate policy set to {policy}.")
+
+    @commands.command(name="markov-order")
+    @commands.has_guild_permissions(administrator=True)
+    async def markov_order(self, ctx, order: str = "off"):
+        """Set the n-gram order used for generation, backing off to shorter contexts on dead ends.
+        Usage:
+          ?markov-order 3     -> contexts of up to 3 words
+          ?markov-order off   -> strict 2-gram (default)
+        """
+        if order.lower() in ("off", "none", "strict"):
+            value = None
+        elif order.isdigit() and 1 <= int(order) <= MAX_ORDER:
+            value = int(order)
+        else:
+            return await ctx.send(f"❌ Order must be 1-{MAX_ORDER} or 'off'.")
+        guild_db = db.fetch(str(ctx.guild.id))
+        guild_db.set_markov_order(value, retrain=False)
+        await ctx.send(f"Markov order set to {value or '2 (strict)'}; rebuilding the model...")
+        try:
+            seconds = await guild_db.rebuild_markov()
+        except Exception as e:
+            logger.exception("Rebuild error")
+            return await ctx.send(f"❌ Rebuild failed: {e}")
+        await ctx.send(f"✅ Model rebuilt in {seconds:.1f}s.")
+
+    @commands.command(name="markov-rebuild")
+    @commands.has_guild_permissions(administrator=True)
+    async def markov_rebuild(self, ctx):
+        """Retrain the model from all stored texts in a background process; replies keep working meanwhile."""
+        guild_db = db.fetch(str(ctx.guild.id))
+        await ctx.send(f"🔧 Rebuilding the model from {guild_db.get_texts_length()} texts...")
+        try:
+            seconds = await guild_db.rebuild_markov()
+        except Exception as e:
+            logger.exception("Rebuild error")
+            return await ctx.send(f"❌ Rebuild failed: {e}")
+        await ctx.send(f"✅ Model rebuilt in {seconds:.1f}s ({len(guild_db.markov)} keys).")
+
     @commands.command(name="markov-clear")
     @commands.has_guild_permissions(administrator=True)
     async def markov_clear(self, ctx):
         guild_db = db.fetch(str(ctx.guild.id))
-        guild_db._raw["texts"] = []
-        guild_db.markov = MarkovChains({})
-        guild_db.save_markov()
+        guild_db.clear_texts()
         await ctx.send("Cleared stored texts and model.")
 
+    @commands.command(name="markov-purge-author")
+    @commands.has_guild_permissions(administrator=True)
+    async def markov_purge_author(self, ctx, user_id: int):
+        """Forget every stored message from one user and remove them from the model."""
+        guild_db = db.fetch(str(ctx.guild.id))
+        removed = guild_db.remove_author(str(user_id))
+        await ctx.send(f"Removed {removed} stored messages from {user_id}.")
+
     @commands.command(name="markov-disable-mention")
     @commands.has_guild_permissions(administrator=True)
     async def disable_mention(self, ctx, user_id: int):
         guild_db = db.fetch(str(ctx.guild.id))
-        lst = guild_db._raw.setdefault("disabledMentionUserIds", [])
+        lst = guild_db.get_disabled_mentions()
         sid = str(user_id)
         if sid in lst:
             return await ctx.send("User already disabled.")
         lst.append(sid)
-        guild_db.save_markov()
+        guild_db.set_disabled_mentions(lst)
         await ctx.send(f"Disabled mentions for {user_id}")
 
     @commands.command(name="markov-enable-mention")
     @commands.has_guild_permissions(administrator=True)
     async def enable_mention(self, ctx, user_id: int):
         guild_db = db.fetch(str(ctx.guild.id))
-        lst = guild_db._raw.setdefault("disabledMentionUserIds", [])
+        lst = guild_db.get_disabled_mentions()
         sid = str(user_id)
         if sid in lst:
             lst.remove(sid)
-            guild_db.save_markov()
+            guild_db.set_disabled_mentions(lst)
             await ctx.send(f"Enabled mentions for {user_id}")
         else:
             await ctx.send("That user id was not in the disabled list.")
@@ -317,19 +628,19 @@ class ChatbotCog(commands.Cog, name="chatbot"):
     @commands.has_guild_permissions(administrator=True)
     async def markov_dm_learn(self, ctx, user_id: int, weight: int = 3):
         guild_db = db.fetch(str(ctx.guild.id))
-        mg = guild_db._raw.setdefault("dm_learn_users", {})
+        mg = guild_db.get_dm_learn_users()
         mg[str(user_id)] = int(weight)
-        guild_db.save_markov()
+        guild_db.set_dm_learn_users(mg)
         await ctx.send(f"Enabled DM learning for {user_id} with weight {weight}.")
 
     @commands.command(name="markov-dm-unlearn")
     @commands.has_guild_permissions(administrator=True)
     async def markov_dm_unlearn(self, ctx, user_id: int):
         guild_db = db.fetch(str(ctx.guild.id))
-        mg = guild_db._raw.setdefault("dm_learn_users", {})
+        mg = guild_db.get_dm_learn_users()
         if str(user_id) in mg:
             del mg[str(user_id)]
-            guild_db.save_markov()
+            guild_db.set_dm_learn_users(mg)
             await ctx.send(f"Disabled DM learning for {user_id}.")
         else:
             await ctx.send("User not enabled for DM learning.")
@@ -1,13 +1,61 @@
 # db_json.py
 import os
+import re
 import json
+import atexit
+import asyncio
+import random
 import threading
 import time
-from typing import Dict, Any, List, Optional
-from markov_chains import MarkovChains
+import logging
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Iterable, Iterator, Tuple, Set, Union
+from markov_chains import MarkovChains, corpus_fingerprint, MAX_ORDER
+from text_store import TextStore, TextRow
+from model_builder import build_model, build_mapped, rebuild
+from mapped_chains import MMAP_MERGE_TEXTS, maybe_map, wants_map
+
+logger = logging.getLogger("db_json")
 
 DATA_DIR = "data"
+# legacy monolithic layout, only read by the one-time migration to shards
 DB_PATH = os.path.join(DATA_DIR, "db.json")
+LEGACY_BACKUP_PATH = os.path.join(DATA_DIR, "db_backup.json")
+LEGACY_JOURNAL_PATH = os.path.join(DATA_DIR, "db.journal")
+# sharded layout: data/guilds/<guild_id>/guild.json (+ journal), loaded on first fetch
+GUILDS_DIR = os.path.join(DATA_DIR, "guilds")
+INDEX_PATH = os.path.join(GUILDS_DIR, "index.json")
+# journaled mode: every change is appended as one compact line to the guild's journal and
+# folded into its guild.json by a background compaction once the journal grows too large
+JOURNAL_ENABLED = os.getenv("DB_JOURNAL", "1") != "0"
+JOURNAL_COMPACT_BYTES = int(os.getenv("DB_JOURNAL_COMPACT_BYTES", str(4 * 1024 * 1024)))
+JOURNAL_FSYNC = os.getenv("DB_JOURNAL_FSYNC", "0") == "1"
+# the writer thread coalesces changes and persists them at most this many seconds later
+FLUSH_LATENCY = float(os.getenv("DB_FLUSH_LATENCY", "2.0"))
+# resident guild cache: unload least recently used guilds beyond this many (0 = no limit),
+# beyond this estimated memory, or after this many idle seconds; unloaded guilds reload on fetch
+CACHE_MAX_GUILDS = int(os.getenv("DB_CACHE_MAX_GUILDS", "0"))
+CACHE_MEMORY_BUDGET = int(float(os.getenv("DB_CACHE_MEMORY_MB", "0")) * 1024 * 1024)
+CACHE_IDLE_SECONDS = float(os.getenv("DB_CACHE_IDLE_SECONDS", "0"))
+# "json" (sharded files above) or "sqlite" (see db_sqlite.py)
+STORAGE_BACKEND = os.getenv("DB_BACKEND", "json").strip().lower()
+# snapshot key recording the last rotated journal segment already folded into it
+_SNAPSHOT_SEQ_KEY = "__journal__"
+_segment_re = re.compile(r"^journal\.(\d+)$")
+_legacy_segment_re = re.compile(r"^db\.journal\.(\d+)$")
+# guild fields mirrored into the index so they can be answered without loading the guild
+_INDEX_KEYS = ("banned", "dm_learn_users", "channelId")
+# what to drop once a guild's corpus is over its cap:
+#   oldest    - the oldest stored text
+#   reservoir - keep a uniform sample of every text ever collected (new texts may be skipped)
+#   fair      - the oldest text of the author with the most stored texts
+EVICTION_POLICIES = ("oldest", "reservoir", "fair")
+# what add_text / extend_texts do with a text whose content (ignoring case and whitespace) is already
+# stored; a messageId that is already stored is always skipped
+#   keep - store it anyway
+#   skip - drop it, so repeated copypasta does not skew transition counts
+DUPLICATE_POLICIES = ("keep", "skip")
+_FINGERPRINT_MASK = 0xFFFFFFFFFFFFFFFF
 os.makedirs(DATA_DIR, exist_ok=True)
 _lock = threading.RLock()
 
@@ -20,32 +68,54 @@ DEFAULT_GUILD = {
     "replyPercentage": 0.80,
     # stored entries: {"text","authorId","messageId","weight","source"}
     "texts": [],
-    "markov_wordlist": {},
     "banned": False,
     "trackedUsers": {},
     "disabledMentionUserIds": [],
-    "dm_learn_users": {}
+    "dm_learn_users": {},
+    # corpus cap (0 = unlimited) and eviction policy, see EVICTION_POLICIES
+    "maxTexts": 0,
+    "maxTextBytes": 0,
+    "evictionPolicy": "oldest",
+    # texts ever offered to the corpus, for reservoir sampling
+    "textsSeen": 0,
+    # n-gram order 1..MAX_ORDER generated with backoff; None = strict 2-gram
+    "markovOrder": None,
+    # see DUPLICATE_POLICIES
+    "duplicatePolicy": "keep",
+    # ?markov-scan position per channel id: {"last": message id, "complete": bool, "scanned": n, "time": ts}
+    "scanCursors": {}
 }
 
-def _load_all() -> Dict[str, Any]:
-    if not os.path.exists(DB_PATH):
-        return {}
+def _read_json(path: str) -> Optional[Any]:
+    if not os.path.exists(path):
+        return None
     with _lock:
         try:
-            with open(DB_PATH, "r", encoding="utf-8") as f:
+            with open(path, "r", encoding="utf-8") as f:
                 return json.load(f)
         except Exception:
-            return {}
+            return None
+
+def _in_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
 
-def _atomic_write_with_retries(raw: Dict[str, Any], attempts: int = 6, base_delay: float = 0.05):
-    tmp = DB_PATH + ".tmp"
+def _dumps(raw: Any) -> str:
+    return json.dumps(raw, ensure_ascii=False, separators=(",", ":"))
+
+def _atomic_write_with_retries(path: str, data: Union[str, bytes], attempts: int = 6, base_delay: float = 0.05):
+    tmp = path + ".tmp"
+    binary = isinstance(data, bytes)
     for attempt in range(attempts):
         try:
-            with open(tmp, "w", encoding="utf-8") as f:
-                json.dump(raw, f, ensure_ascii=False, indent=2)
+            with open(tmp, "wb" if binary else "w", encoding=None if binary else "utf-8") as f:
+                f.write(data)
                 f.flush()
                 os.fsync(f.fileno())
-            os.replace(tmp, DB_PATH)
+            os.replace(tmp, path)
             return True
         except PermissionError:
             time.sleep(base_delay * (2 ** attempt))
@@ -55,28 +125,374 @@ def _atomic_write_with_retries(raw: Dict[str, Any], attempts: int = 6, base_dela
             except Exception:
                 pass
     try:
-        os.replace(tmp, DB_PATH)
+        os.replace(tmp, path)
         return True
     except Exception:
         return False
 
-def _save_all_bg(raw: Dict[str, Any]):
-    try:
-        copy_raw = json.loads(json.dumps(raw))
-    except Exception:
-        copy_raw = raw
-    t = threading.Thread(target=_atomic_write_with_retries, args=(copy_raw,), daemon=True)
-    t.start()
+def _read_journal(path: str) -> Iterator[Dict[str, Any]]:
+    if not os.path.exists(path):
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except Exception:
+                # torn write from a crash; the record never completed
+                continue
+
+def _journal_line(rec: Dict[str, Any]) -> str:
+    return _dumps(rec) + "\n"
+
+def _list_segments(directory: str, pattern) -> List[int]:
+    """Sequence numbers of rotated journal segments in directory, ascending."""
+    if not os.path.isdir(directory):
+        return []
+    out = []
+    for name in os.listdir(directory):
+        m = pattern.match(name)
+        if m:
+            out.append(int(m.group(1)))
+    return sorted(out)
+
+def _default_guild() -> Dict[str, Any]:
+    return json.loads(json.dumps(DEFAULT_GUILD))
+
+def _index_entry(raw: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: json.loads(json.dumps(raw.get(k, DEFAULT_GUILD[k]))) for k in _INDEX_KEYS}
+
+def _apply_record(raw: Dict[str, Any], rec: Dict[str, Any]):
+    """Apply one journal record to a plain guild dict (no model training)."""
+    op = rec.get("op")
+    if op == "text":
+        raw.setdefault("texts", []).append(rec.get("v") or {})
+    elif op == "set":
+        raw[rec["k"]] = rec.get("v")
+    elif op == "clear":
+        raw["texts"] = []
+    elif op == "evict":
+        texts = raw.get("texts", [])
+        i = rec.get("i", -1)
+        if not (0 <= i < len(texts) and texts[i].get("messageId") == rec.get("m")):
+            i = next((j for j, e in enumerate(texts) if e.get("messageId") == rec.get("m")), -1)
+        if i >= 0:
+            texts.pop(i)
+    elif op == "edit":
+        for e in raw.get("texts", []):
+            if e.get("messageId") == rec.get("m"):
+                e["text"] = rec.get("v") or ""
+    elif op == "purge":
+        raw["texts"] = [e for e in raw.get("texts", []) if e.get("authorId") != rec.get("a")]
+    if op in ("text", "seen"):
+        raw["textsSeen"] = int(raw.get("textsSeen", 0) or 0) + 1
+
+def iter_stored_guilds() -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Yield (guild_id, guild dict) for every guild in the JSON store, journals applied.
+    Reads the sharded layout if present, otherwise the legacy db.json / data/db_backup.json.
+    """
+    if os.path.exists(INDEX_PATH) or _shard_ids():
+        for gid in _load_index():
+            yield gid, _read_shard(gid)
+        return
+    legacy = _read_json(DB_PATH if os.path.exists(DB_PATH) else LEGACY_BACKUP_PATH)
+    if not isinstance(legacy, dict):
+        return
+    legacy.pop(_SNAPSHOT_SEQ_KEY, None)
+    for gid, raw in legacy.items():
+        if isinstance(raw, dict):
+            yield gid, raw
+
+def _read_shard(gid: str) -> Dict[str, Any]:
+    """A guild's stored dict with its journal applied (no model, no GuildDB)."""
+    raw, records = _Shard(gid).load()
+    raw = raw if raw is not None else _default_guild()
+    for rec in records:
+        _apply_record(raw, rec)
+    return raw
+
+def _shard_ids() -> List[str]:
+    """Guild ids that have a shard directory."""
+    if not os.path.isdir(GUILDS_DIR):
+        return []
+    return sorted(name for name in os.listdir(GUILDS_DIR) if os.path.isdir(os.path.join(GUILDS_DIR, name)))
+
+def _load_index() -> Dict[str, Dict[str, Any]]:
+    """Read the guild index. Without index.json it is rebuilt from the shard directories; the legacy
+    migration only runs when there are no shards at all. An index.json that cannot be read raises,
+    so a damaged file never sends the store back to the legacy db.json / db_backup.json.
+    """
+    if os.path.exists(INDEX_PATH):
+        try:
+            with _lock, open(INDEX_PATH, "r", encoding="utf-8") as f:
+                index = json.load(f)
+        except Exception:
+            logger.exception(f"cannot read {INDEX_PATH}; fix or delete it to rebuild it from the shards")
+            raise
+        if not isinstance(index, dict):
+            raise ValueError(f"{INDEX_PATH} does not hold a guild index")
+        # entries written before a field was mirrored into the index are filled in from their shards once
+        outdated = [gid for gid, entry in index.items() if any(k not in entry for k in _INDEX_KEYS)]
+        if outdated:
+            for gid in outdated:
+                index[gid] = _index_entry(_read_shard(gid))
+            _atomic_write_with_retries(INDEX_PATH, _dumps(index))
+        return index
+    gids = _shard_ids()
+    if not gids:
+        return _migrate_legacy()
+    logger.warning(f"{INDEX_PATH} is missing; rebuilding it from {len(gids)} guild shards")
+    index = {gid: _index_entry(_read_shard(gid)) for gid in gids}
+    _atomic_write_with_retries(INDEX_PATH, _dumps(index))
+    return index
+
+def _migrate_legacy() -> Dict[str, Dict[str, Any]]:
+    """One-time split of the monolithic db.json (or data/db_backup.json) into per-guild shards.
+    Records still pending in the old global journal are moved into the matching guild journals.
+    Returns the new index.
+    """
+    src = DB_PATH if os.path.exists(DB_PATH) else LEGACY_BACKUP_PATH
+    legacy = _read_json(src)
+    if not isinstance(legacy, dict):
+        legacy = {}
+    covered = int(legacy.pop(_SNAPSHOT_SEQ_KEY, 0) or 0)
+
+    legacy_journals = [f"{LEGACY_JOURNAL_PATH}.{seq}" for seq in _list_segments(DATA_DIR, _legacy_segment_re)
+                       if seq > covered]
+    legacy_journals.append(LEGACY_JOURNAL_PATH)
+    pending: Dict[str, List[Dict[str, Any]]] = {}
+    for path in legacy_journals:
+        for rec in _read_journal(path):
+            gid = rec.pop("g", None)
+            if gid is not None:
+                pending.setdefault(str(gid), []).append(rec)
+
+    index = {}
+    for gid, raw in legacy.items():
+        if not isinstance(raw, dict):
+            continue
+        shard = _Shard(gid)
+        os.makedirs(shard.dir, exist_ok=True)
+        _atomic_write_with_retries(shard.snapshot_path, _dumps(raw))
+        index[gid] = _index_entry(raw)
+    for gid, recs in pending.items():
+        shard = _Shard(gid)
+        os.makedirs(shard.dir, exist_ok=True)
+        with open(shard.journal_path, "w", encoding="utf-8") as f:
+            f.writelines(_journal_line(rec) for rec in recs)
+        entry = index.setdefault(gid, _index_entry(DEFAULT_GUILD))
+        for rec in recs:
+            if rec.get("op") == "set" and rec.get("k") in _INDEX_KEYS:
+                entry[rec["k"]] = rec.get("v")
+
+    os.makedirs(GUILDS_DIR, exist_ok=True)
+    _atomic_write_with_retries(INDEX_PATH, _dumps(index))
+    if os.path.exists(DB_PATH):
+        try:
+            os.replace(DB_PATH, DB_PATH + ".migrated")
+        except Exception:
+            pass
+    for seq in _list_segments(DATA_DIR, _legacy_segment_re):
+        legacy_journals.append(f"{LEGACY_JOURNAL_PATH}.{seq}")
+    for path in legacy_journals:
+        try:
+            os.remove(path)
+        except Exception:
+            pass
+    return index
+
+class _Shard:
+    """Files of one guild: guild.json snapshot plus its journal and rotated journal segments.
+    Journal lines are queued by the event loop and written out by the writer thread.
+    """
+    def __init__(self, guild_id: str):
+        self.dir = os.path.join(GUILDS_DIR, guild_id)
+        self.snapshot_path = os.path.join(self.dir, "guild.json")
+        self.journal_path = os.path.join(self.dir, "journal")
+        self.model_path = os.path.join(self.dir, "model.bin")
+        # corpus fingerprint of the last model.bin written, to skip rewriting an unchanged model
+        self.model_fingerprint = None
+        self.journal_bytes = 0
+        self.compact_requested = False
+        self._pending: List[str] = []
+        self._journal = None
+        self._seq = 0
+
+    def _segment_path(self, seq: int) -> str:
+        return f"{self.journal_path}.{seq}"
+
+    def load(self) -> Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]]]:
+        """Return the snapshot (None for a new guild) and the journal records to replay on top of it."""
+        raw = _read_json(self.snapshot_path)
+        if not isinstance(raw, dict):
+            raw = None
+        covered = int(raw.pop(_SNAPSHOT_SEQ_KEY, 0) or 0) if raw else 0
+        segments = _list_segments(self.dir, _segment_re)
+        self._seq = max([covered] + segments)
+        records = []
+        for seq in segments:
+            if seq <= covered:
+                try:
+                    os.remove(self._segment_path(seq))
+                except Exception:
+                    pass
+            else:
+                records.extend(_read_journal(self._segment_path(seq)))
+        records.extend(_read_journal(self.journal_path))
+        if os.path.exists(self.journal_path):
+            self.journal_bytes = os.path.getsize(self.journal_path)
+        return raw, records
+
+    def append(self, rec: Dict[str, Any]):
+        line = _journal_line(rec)
+        self._pending.append(line)
+        self.journal_bytes += len(line.encode("utf-8"))
+
+    def write_pending(self):
+        """Write queued journal lines in one go (writer thread, guild lock held)."""
+        if not self._pending:
+            return
+        lines, self._pending = self._pending, []
+        if self._journal is None:
+            self._open_journal()
+        self._journal.writelines(lines)
+        self._journal.flush()
+        if JOURNAL_FSYNC:
+            os.fsync(self._journal.fileno())
+
+    def rotate(self) -> int:
+        """Move the active journal aside as the next segment; returns that segment's sequence."""
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        self._seq += 1
+        if os.path.exists(self.journal_path):
+            os.replace(self.journal_path, self._segment_path(self._seq))
+        self.journal_bytes = sum(len(line.encode("utf-8")) for line in self._pending)
+        return self._seq
+
+    def write_snapshot(self, data: str, seq: int):
+        if not _atomic_write_with_retries(self.snapshot_path, data):
+            return
+        for old in _list_segments(self.dir, _segment_re):
+            if old <= seq:
+                try:
+                    os.remove(self._segment_path(old))
+                except Exception:
+                    pass
+
+    def close(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    def _open_journal(self):
+        os.makedirs(self.dir, exist_ok=True)
+        # terminate a torn last line so the next record starts cleanly
+        if os.path.exists(self.journal_path) and os.path.getsize(self.journal_path) > 0:
+            with open(self.journal_path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                torn = f.read(1) != b"\n"
+            if torn:
+                with open(self.journal_path, "ab") as f:
+                    f.write(b"\n")
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+
+class _Writer:
+    """Single persistent thread that persists dirty guilds (and the index) in coalesced batches.
+    A change is written at most FLUSH_LATENCY seconds after the first unflushed change.
+    """
+    def __init__(self, manager: "DBManager", latency: float = FLUSH_LATENCY):
+        self._manager = manager
+        self._latency = max(0.0, latency)
+        self._cond = threading.Condition()
+        self._dirty: Set[str] = set()
+        self._index_dirty = False
+        self._first_dirty: Optional[float] = None
+        self._requested = 0
+        self._done = 0
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._thread.start()
+
+    def mark(self, guild_id: Optional[str] = None):
+        """Flag a guild (or the index when guild_id is None) for the next write batch."""
+        with self._cond:
+            if guild_id is None:
+                self._index_dirty = True
+            else:
+                self._dirty.add(guild_id)
+            if self._first_dirty is None:
+                self._first_dirty = time.monotonic()
+                self._cond.notify()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Write everything marked so far right away and wait for it. Returns False on timeout."""
+        with self._cond:
+            self._requested += 1
+            target = self._requested
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: self._done >= target, timeout)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._requested <= self._done:
+                    if self._first_dirty is None:
+                        self._cond.wait()
+                        continue
+                    remaining = self._first_dirty + self._latency - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                dirty, self._dirty = self._dirty, set()
+                index_dirty, self._index_dirty = self._index_dirty, False
+                self._first_dirty = None
+                target = self._requested
+            for gid in dirty:
+                try:
+                    self._manager._flush_guild(gid)
+                except Exception:
+                    pass
+            if index_dirty:
+                try:
+                    self._manager._write_index()
+                except Exception:
+                    pass
+            with self._cond:
+                self._done = max(self._done, target)
+                self._cond.notify_all()
 
 class GuildDB:
-    def __init__(self, guild_id: str, raw: Dict[str, Any], manager_raw: Dict[str, Any]):
+    def __init__(self, guild_id: str, raw: Dict[str, Any], manager: "DBManager"):
         self.guild_id = guild_id
         self._raw = raw
-        self._manager_raw = manager_raw
+        self._manager = manager
+        # held while mutating; the writer thread holds it while serializing this guild
+        self._lock = threading.RLock()
         for k, v in DEFAULT_GUILD.items():
             if k not in self._raw:
                 self._raw[k] = json.loads(json.dumps(v)) if isinstance(v, (dict, list)) else v
-        self.markov = MarkovChains(self._raw.get("markov_wordlist", {}))
+        # the model lives in its own binary snapshot; older guild.json files embed it
+        legacy_model = self._raw.pop("markov_wordlist", None)
+        # texts are held columnar; the JSON entry list only exists in files and journal records
+        self._texts = TextStore(self._raw.pop("texts", None) or [])
+        # trailing entries appended by extend_texts that the model has not been trained on yet
+        self._untrained = 0
+        # texts were stored untrained (extend_texts(train=False)): the model is not saved until a rebuild
+        self._model_stale = False
+        # in-flight rebuild_markov() and the (text, weight, sign) changes it must replay on the new model
+        self._rebuild: Optional[asyncio.Future] = None
+        self._deltas: Optional[List[Tuple[str, int, int]]] = None
+        # texts add_text / extend_texts skipped as duplicates since the guild was loaded
+        self.duplicates_skipped = 0
+        # bumped by remove_message / edit_message / remove_author so sentences generated before are dropped
+        self.unlearn_generation = 0
+        self._fingerprint = corpus_fingerprint(self._texts.iter_weighted())
+        self._raw["textsSeen"] = max(int(self._raw.get("textsSeen", 0) or 0), len(self._texts))
+        self.markov = self._load_markov(legacy_model)
+        self._sync_order()
 
     # getters
     def toggled_activity(self) -> bool:
@@ -89,7 +505,7 @@ class GuildDB:
         return self._raw.get("webhook")
 
     def get_texts_length(self) -> int:
-        return len(self._raw.get("texts", []))
+        return len(self._texts)
 
     def get_sending_percentage(self) -> float:
         return float(self._raw.get("sendingPercentage", 0.10))
@@ -101,7 +517,23 @@ class GuildDB:
         return float(self._raw.get("replyPercentage", 0.80))
 
     def get_texts(self) -> List[Dict[str, Any]]:
-        return self._raw.get("texts", [])
+        """Stored entries as dicts (materialized; prefer iter_texts for large guilds)."""
+        return self._texts.to_list()
+
+    def iter_texts(self) -> Iterator[TextRow]:
+        """Stored entries as lightweight row views supporting row["text"] / row.get(...)."""
+        return iter(self._texts)
+
+    def get_disabled_mentions(self) -> List[str]:
+        return [str(x) for x in self._raw.get("disabledMentionUserIds", [])]
+
+    def get_dm_learn_users(self) -> Dict[str, int]:
+        return dict(self._raw.get("dm_learn_users", {}))
+
+    def get_scan_cursor(self, channel_id: int) -> Optional[Dict[str, Any]]:
+        """Where the last ?markov-scan of a channel stopped, or None if it was never scanned."""
+        cursor = (self._raw.get("scanCursors") or {}).get(str(channel_id))
+        return dict(cursor) if isinstance(cursor, dict) and cursor.get("last") else None
 
     # actions
     def add_text(self, text: str, author_id: str, message_id: str, weight: int = 1, source: str = "channel"):
@@ -112,38 +544,169 @@ class GuildDB:
             "weight": int(weight),
             "source": source
         }
-        self._raw.setdefault("texts", []).append(entry)
+        with self._lock:
+            if self.is_duplicate(text, message_id):
+                self.duplicates_skipped += 1
+                return
+            if not self._admit():
+                self._raw["textsSeen"] += 1
+                self._manager._record(self, {"op": "seen"})
+                return
+            self._apply_text(entry)
+            self._manager._record(self, {"op": "text", "v": entry})
+            self._enforce_limit()
 
-        # update markov in-memory quickly according to weight
-        try:
-            w = max(1, int(weight))
-        except Exception:
-            w = 1
-        for _ in range(w):
-            try:
-                self.markov._pick_sentence_words(text)
-            except Exception:
-                pass
+    def extend_texts(self, entries: List[Dict[str, Any]], persist: bool = True, train: bool = True) -> int:
+        """Append many stored entries and train the model on just this batch.
+        Entries are journaled like add_text; with persist=False the caller checkpoints via save_markov().
+        With train=False the batch is only stored and the caller is expected to rebuild_markov() afterwards.
+        Entries already stored (see is_duplicate) are skipped. Returns how many entries were stored.
+        """
+        stored = 0
+        with self._lock:
+            for entry in entries:
+                if self.is_duplicate(entry.get("text", ""), entry.get("messageId")):
+                    self.duplicates_skipped += 1
+                    continue
+                if not self._admit():
+                    self._raw["textsSeen"] += 1
+                    self._manager._record(self, {"op": "seen"})
+                    continue
+                self._apply_text(entry, train=False)
+                self._untrained += 1
+                self._manager._record(self, {"op": "text", "v": entry})
+                stored += 1
+                self._enforce_limit()
+            if train:
+                self._ingest(self._texts.iter_weighted(len(self._texts) - self._untrained))
+            elif stored:
+                self._model_stale = True
+            self._untrained = 0
+            if persist:
+                self.save_markov()
+        return stored
 
-        self._raw["markov_wordlist"] = self.markov.word_list
-        _save_all_bg(self._manager_raw)
+    async def rebuild_markov(self) -> float:
+        """Retrain the model from the stored texts in a worker process while the current model keeps
+        serving, then swap it in. Concurrent calls share one build. Returns the build time in seconds.
+        """
+        return await asyncio.shield(self._start_rebuild())
 
     def save_markov(self):
-        self._raw["markov_wordlist"] = self.markov.word_list
-        _save_all_bg(self._manager_raw)
+        """Persist the whole guild, including changes made directly on _raw / markov."""
+        self._manager._adopt(self)
+        self._manager.compact(self.guild_id)
+
+    def clear_texts(self):
+        """Drop all stored texts and the trained model, and forget how far channels were scanned."""
+        with self._lock:
+            self._apply_clear()
+            self._manager._record(self, {"op": "clear"})
+            self._set("scanCursors", {})
+
+    def remove_message(self, message_id: str) -> int:
+        """Unlearn a deleted message: drop its entries and subtract them from the model in O(tokens).
+        Returns how many entries were removed.
+        """
+        removed = 0
+        with self._lock:
+            for i in reversed(self._texts.indexes_of_message(message_id)):
+                self._apply_evict(i)
+                self._manager._record(self, {"op": "evict", "i": i, "m": message_id})
+                removed += 1
+            if removed:
+                self.unlearn_generation += 1
+        return removed
+
+    def edit_message(self, message_id: str, text: str) -> int:
+        """Retrain an edited message: the old text is subtracted from the model and the new one added.
+        Returns how many entries were updated (entries already holding text are not).
+        """
+        with self._lock:
+            updated = self._apply_edit(message_id, text)
+            if updated:
+                self._manager._record(self, {"op": "edit", "m": message_id, "v": text})
+                self.unlearn_generation += 1
+        return updated
+
+    def remove_author(self, author_id: str) -> int:
+        """Unlearn everything stored from one author. Returns how many entries were removed."""
+        with self._lock:
+            removed = self._apply_purge(author_id)
+            if removed:
+                self._manager._record(self, {"op": "purge", "a": author_id})
+                self.unlearn_generation += 1
+        return removed
 
     # setters
     def set_channel(self, channel_id: Optional[int]):
-        self._raw["channelId"] = channel_id
-        _save_all_bg(self._manager_raw)
+        self._set("channelId", channel_id)
 
     def set_webhook(self, webhook_url: Optional[str]):
-        self._raw["webhook"] = webhook_url
-        _save_all_bg(self._manager_raw)
+        self._set("webhook", webhook_url)
 
     def set_toggled_activity(self, v: bool):
-        self._raw["toggledActivity"] = bool(v)
-        _save_all_bg(self._manager_raw)
+        self._set("toggledActivity", bool(v))
+
+    def set_disabled_mentions(self, user_ids: List[str]):
+        self._set("disabledMentionUserIds", [str(x) for x in user_ids])
+
+    def set_dm_learn_users(self, users: Dict[str, int]):
+        self._set("dm_learn_users", {str(k): int(v) for k, v in users.items()})
+
+    def set_scan_cursor(self, channel_id: int, last_message_id: int, complete: bool, scanned: int):
+        """Record that every message of a channel up to last_message_id was scanned and stored.
+        complete marks that the scan reached the end of the history rather than a limit, cancel or error.
+        """
+        cursors = dict(self._raw.get("scanCursors") or {})
+        cursors[str(channel_id)] = {"last": str(last_message_id), "complete": bool(complete),
+                                    "scanned": int(scanned), "time": int(time.time())}
+        self._set("scanCursors", cursors)
+
+    def get_corpus_limit(self) -> Tuple[int, int, str]:
+        """(max texts, max text bytes, eviction policy); a cap of 0 means unlimited."""
+        policy = self._raw.get("evictionPolicy", "oldest")
+        return (int(self._raw.get("maxTexts", 0) or 0), int(self._raw.get("maxTextBytes", 0) or 0),
+                policy if policy in EVICTION_POLICIES else "oldest")
+
+    def set_corpus_limit(self, max_texts: int = 0, max_bytes: int = 0, policy: str = "oldest") -> int:
+        """Set the corpus cap and evict down to it right away. Returns how many texts were evicted."""
+        if policy not in EVICTION_POLICIES:
+            raise ValueError(f"unknown eviction policy {policy!r}")
+        with self._lock:
+            self._set("maxTexts", max(0, int(max_texts)))
+            self._set("maxTextBytes", max(0, int(max_bytes)))
+            self._set("evictionPolicy", policy)
+            return self._enforce_limit()
+
+    def get_duplicate_policy(self) -> str:
+        policy = self._raw.get("duplicatePolicy", "keep")
+        return policy if policy in DUPLICATE_POLICIES else "keep"
+
+    def set_duplicate_policy(self, policy: str):
+        if policy not in DUPLICATE_POLICIES:
+            raise ValueError(f"unknown duplicate policy {policy!r}")
+        self._set("duplicatePolicy", policy)
+
+    def memory_estimate(self) -> int:
+        """Rough resident size in bytes (texts plus model), used by the guild cache budget."""
+        return self._texts.nbytes + 80 * len(self._texts) + self.markov.approx_nbytes()
+
+    def get_markov_order(self) -> Optional[int]:
+        order = self._raw.get("markovOrder")
+        return int(order) if isinstance(order, int) and 1 <= order <= MAX_ORDER else None
+
+    def set_markov_order(self, order: Optional[int], retrain: bool = True):
+        """Set the n-gram order (1..MAX_ORDER, or None for strict 2-gram) and retrain the n-gram trie.
+        With retrain=False the model is left as is for a following rebuild_markov().
+        """
+        if order is not None and not 1 <= int(order) <= MAX_ORDER:
+            raise ValueError(f"order must be between 1 and {MAX_ORDER}")
+        with self._lock:
+            self._set("markovOrder", int(order) if order is not None else None)
+            if retrain:
+                self._sync_order()
+                self.save_markov()
 
     # checks
     def is_banned(self) -> bool:
@@ -152,22 +715,556 @@ class GuildDB:
     def is_track_allowed(self, user_id: str) -> bool:
         return bool(self._raw.get("trackedUsers", {}).get(user_id, True))
 
-class DBManager:
+    def is_duplicate(self, text: str, message_id: Optional[str]) -> bool:
+        """Whether this message is already stored: by messageId, or with the skip duplicate policy
+        by content (ignoring case and whitespace). O(1).
+        """
+        if message_id is not None and self._texts.has_message(message_id):
+            return True
+        return self.get_duplicate_policy() == "skip" and self._texts.has_content(text)
+
+    # ---------------- internal helpers ----------------
+    def _set(self, key: str, value: Any):
+        with self._lock:
+            self._raw[key] = value
+            self._manager._record(self, {"op": "set", "k": key, "v": value})
+
+    def _sync_order(self):
+        """Retrain the model's n-gram trie if its order differs from the guild setting."""
+        order = self.get_markov_order()
+        if self.markov.order != order:
+            if getattr(self.markov, "mapped", False):
+                # mapped models are strict 2-gram; bring it back into memory for the trie
+                self.markov = self.markov.to_chains()
+            self.markov.set_order(order, self.iter_texts())
+
+    def _apply_text(self, entry: Dict[str, Any], train: bool = True):
+        self._texts.append(entry)
+        self._raw["textsSeen"] = int(self._raw.get("textsSeen", 0) or 0) + 1
+        self._count_text(entry)
+        if train:
+            self._train(entry)
+
+    def _count_text(self, entry: Dict[str, Any], sign: int = 1):
+        count, total = self._fingerprint
+        n, h = corpus_fingerprint((entry,))
+        self._fingerprint = (count + sign * n, (total + sign * h) & _FINGERPRINT_MASK)
+
+    def _train(self, entry: Dict[str, Any]):
+        # update markov in-memory quickly according to weight
+        try:
+            w = max(1, int(entry.get("weight", 1)))
+        except Exception:
+            w = 1
+        try:
+            self.markov.add_text(entry.get("text", ""), w)
+        except Exception:
+            return
+        if self._deltas is not None:
+            self._deltas.append((entry.get("text", ""), w, 1))
+        self._maybe_remap()
+
+    def _untrain(self, entry: Dict[str, Any]):
+        try:
+            w = max(1, int(entry.get("weight", 1)))
+        except Exception:
+            w = 1
+        try:
+            self.markov.remove_text(entry.get("text", ""), w)
+        except Exception:
+            return
+        if self._deltas is not None:
+            self._deltas.append((entry.get("text", ""), w, -1))
+        self._maybe_remap()
+
+    def _ingest(self, pairs: Iterable[Tuple[str, int]]) -> int:
+        """Train the model on a batch of (text, weight) pairs, noting them for an in-flight rebuild."""
+        if self._deltas is None:
+            n = self.markov.ingest(pairs)
+        else:
+            pairs = list(pairs)
+            self._deltas.extend((text, weight, 1) for text, weight in pairs)
+            n = self.markov.ingest(pairs)
+        self._maybe_remap()
+        return n
+
+    def _training_texts(self) -> List[Tuple[str, int]]:
+        return list(self._texts.iter_weighted())
+
+    def _swap_model(self, markov: MarkovChains):
+        """Install a model rebuilt from _training_texts() (caller holds the lock)."""
+        if getattr(markov, "mapped", False):
+            # rewrite the snapshot even for an unchanged corpus: it must name the new map file
+            self._manager._shard(self.guild_id).model_fingerprint = None
+        self.markov = markov
+
+    def _start_rebuild(self) -> asyncio.Future:
+        if self._rebuild is None:
+            self._rebuild = asyncio.ensure_future(self._run_rebuild())
+        return self._rebuild
+
+    def _wants_map(self) -> bool:
+        """Whether rebuilds should produce a memory-mapped model (see mapped_chains.MMAP_MIN_KEYS)."""
+        return (self.get_markov_order() is None and
+                (getattr(self.markov, "mapped", False) or wants_map(None, len(self.markov))))
+
+    def _maybe_remap(self):
+        """Start a rebuild once a mapped model's delta reaches MMAP_MERGE_TEXTS texts (folding it into a
+        new map file), or once an in-memory model outgrows MMAP_MIN_KEYS. Needs a running event loop.
+        """
+        markov = self.markov
+        if self._rebuild is not None:
+            return
+        if getattr(markov, "mapped", False):
+            due = markov.delta_texts >= MMAP_MERGE_TEXTS
+        else:
+            due = self._wants_map()
+        if due and _in_event_loop():
+            self._start_rebuild().add_done_callback(self._rebuilt)
+
+    def _rebuilt(self, future: asyncio.Future):
+        """Done-callback of rebuilds nobody awaits: log a failure instead of leaving it unretrieved."""
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(f"[{self.guild_id}] background model rebuild failed", exc_info=future.exception())
+
+    async def _run_rebuild(self) -> float:
+        start = time.perf_counter()
+        stale = False
+        try:
+            while True:
+                with self._lock:
+                    texts = self._training_texts()
+                    markov = self.markov
+                    order, mapped = self.get_markov_order(), self._wants_map()
+                    # the new model covers every stored text; later untrained batches mark it stale again
+                    stale, self._model_stale = stale or self._model_stale, False
+                    self._deltas = []
+                try:
+                    if mapped:
+                        new = await build_mapped(texts, self._manager._model_dir(self.guild_id))
+                    else:
+                        new = await build_model(texts, order)
+                        # the corpus may have outgrown MMAP_MIN_KEYS since the rebuild was started
+                        new = await asyncio.to_thread(maybe_map, new, self._manager._model_dir(self.guild_id))
+                except BaseException:
+                    self._model_stale = self._model_stale or stale
+                    raise
+                with self._lock:
+                    # a clear or reload replaced the model meanwhile: the build is obsolete
+                    if self.markov is not markov:
+                        return time.perf_counter() - start
+                    # set_markov_order() ran meanwhile: build again so awaiters get the new order
+                    if self.get_markov_order() != order:
+                        continue
+                    for text, weight, sign in self._deltas:
+                        if sign > 0:
+                            new.add_text(text, weight)
+                        else:
+                            new.remove_text(text, weight)
+                    new.version = markov.version + 1
+                    self._swap_model(new)
+                    break
+            self.save_markov()
+            return time.perf_counter() - start
+        finally:
+            self._deltas = None
+            self._rebuild = None
+
+    # ---------------- corpus limit ----------------
+    def _corpus_size(self) -> Tuple[int, int]:
+        return len(self._texts), self._texts.nbytes
+
+    def _is_full(self) -> bool:
+        max_texts, max_bytes, _ = self.get_corpus_limit()
+        count, nbytes = self._corpus_size()
+        return bool((max_texts and count >= max_texts) or (max_bytes and nbytes >= max_bytes))
+
+    def _over_limit(self) -> bool:
+        max_texts, max_bytes, _ = self.get_corpus_limit()
+        count, nbytes = self._corpus_size()
+        return count > 0 and bool((max_texts and count > max_texts) or (max_bytes and nbytes > max_bytes))
+
+    def _admit(self) -> bool:
+        """Reservoir sampling: once full, a new text is kept with probability size / texts seen."""
+        if self.get_corpus_limit()[2] != "reservoir" or not self._is_full():
+            return True
+        seen = int(self._raw.get("textsSeen", 0) or 0) + 1
+        return random.random() < self._corpus_size()[0] / max(1, seen)
+
+    def _enforce_limit(self, train: bool = True, record: bool = True) -> int:
+        """Evict until the corpus is within its cap; evicted texts are subtracted from the model."""
+        evicted = 0
+        while self._over_limit():
+            if not self._evict_one(train, record):
+                break
+            evicted += 1
+        return evicted
+
+    def _evict_one(self, train: bool, record: bool) -> bool:
+        i = self._pick_victim()
+        if i < 0:
+            return False
+        message_id = self._texts[i].message_id
+        self._apply_evict(i, train)
+        if record:
+            self._manager._record(self, {"op": "evict", "i": i, "m": message_id})
+        return True
+
+    def _pick_victim(self) -> int:
+        n = len(self._texts)
+        if n == 0:
+            return -1
+        policy = self.get_corpus_limit()[2]
+        if policy == "reservoir":
+            # a uniformly random earlier entry; the newest one was just admitted
+            return random.randrange(n - 1) if n > 1 else 0
+        if policy == "fair":
+            return self._texts.first_index_of_author(self._texts.top_author())
+        return 0
+
+    def _apply_evict(self, i: int, train: bool = True):
+        if i >= len(self._texts) - self._untrained:
+            # still waiting in extend_texts' batch, so never trained
+            self._untrained -= 1
+            train = False
+        entry = self._texts.pop(i)
+        self._count_text(entry, -1)
+        # a stale model may never have seen the entry; the pending rebuild drops it anyway
+        if train and not self._model_stale:
+            self._untrain(entry)
+
+    def _apply_edit(self, message_id: str, text: str) -> int:
+        # link-embed updates resend unchanged content; those entries are left alone
+        hits = [i for i in self._texts.indexes_of_message(message_id) if self._texts[i].text != text]
+        for i in hits:
+            old = self._texts[i].to_dict()
+            self._texts.set_text(i, text)
+            self._count_text(old, -1)
+            self._count_text(dict(old, text=text))
+            if not self._model_stale:
+                self._untrain(old)
+                self._train(dict(old, text=text))
+        return len(hits)
+
+    def _apply_purge(self, author_id: str) -> int:
+        removed = self._texts.pop_many(self._texts.indexes_of_author(author_id))
+        for entry in removed:
+            self._count_text(entry, -1)
+            if not self._model_stale:
+                self._untrain(entry)
+        return len(removed)
+
+    def _apply_clear(self):
+        self._texts.clear()
+        self._fingerprint = (0, 0)
+        self._model_stale = False
+        self.markov = MarkovChains({}, self.get_markov_order())
+
+    def _load_markov(self, legacy_model: Optional[Dict[str, Any]]) -> MarkovChains:
+        """Load the model snapshot if it was trained on exactly the stored texts, else rebuild it.
+        Inside a running event loop the rebuild runs in the background and an empty model serves meanwhile.
+        """
+        try:
+            markov, fingerprint = MarkovChains.load(self._manager._shard(self.guild_id).model_path)
+            if fingerprint == self._fingerprint:
+                mapped = maybe_map(markov, self._manager._model_dir(self.guild_id))
+                if mapped is not markov:
+                    # MMAP_MIN_KEYS was reached while stopped: replace the full snapshot by a delta one
+                    self._manager._shard(self.guild_id).model_fingerprint = None
+                    self._manager.compact(self.guild_id)
+                return mapped
+        except Exception:
+            pass
+        if self._fingerprint == (0, 0) and not legacy_model:
+            return MarkovChains({}, self.get_markov_order())
+        markov = MarkovChains(legacy_model) if isinstance(legacy_model, dict) else MarkovChains({})
+        if not len(markov):
+            # no usable legacy model (absent, or keyed by single words); large corpora build in parallel
+            if _in_event_loop():
+                self._model_stale = True
+                self._start_rebuild().add_done_callback(self._rebuilt)
+                return MarkovChains({}, self.get_markov_order())
+            markov = rebuild(self._texts.iter_weighted(), self.get_markov_order())
+        markov = maybe_map(markov, self._manager._model_dir(self.guild_id))
+        # write a fresh snapshot so the next start can skip this
+        self._manager.compact(self.guild_id)
+        return markov
+
+    def _apply(self, rec: Dict[str, Any]):
+        """Re-apply one journal record during replay."""
+        op = rec.get("op")
+        if op == "text":
+            self._apply_text(rec.get("v") or {})
+        elif op == "set":
+            self._raw[rec["k"]] = rec.get("v")
+            if rec["k"] == "markovOrder":
+                self._sync_order()
+        elif op == "clear":
+            self._apply_clear()
+        elif op == "evict":
+            i = rec.get("i", -1)
+            if not (0 <= i < len(self._texts) and self._texts[i].message_id == rec.get("m")):
+                i = self._texts.index_of_message(rec.get("m"))
+            if i >= 0:
+                self._apply_evict(i)
+        elif op == "seen":
+            self._raw["textsSeen"] = int(self._raw.get("textsSeen", 0) or 0) + 1
+        elif op == "edit":
+            self._apply_edit(rec.get("m"), rec.get("v") or "")
+        elif op == "purge":
+            self._apply_purge(rec.get("a"))
+
+class _GuildCache:
+    """LRU bookkeeping for resident guilds, shared by the storage managers.
+    Guilds beyond CACHE_MAX_GUILDS / CACHE_MEMORY_BUDGET, or idle for CACHE_IDLE_SECONDS, are handed
+    to the writer to be flushed and dropped; fetching a guild that is still being unloaded revives it.
+    """
+    # how often fetch() looks for idle guilds
+    _SWEEP_INTERVAL = 30.0
+
+    def _init_cache(self):
+        self._cache: "OrderedDict[str, GuildDB]" = OrderedDict()
+        self._unloading: Dict[str, GuildDB] = {}
+        self._last_used: Dict[str, float] = {}
+        self._last_sweep = time.monotonic()
+        self._cache_hits = 0
+        self._cache_misses = 0
+        self._cache_evictions = 0
+
+    def cache_stats(self) -> Dict[str, int]:
+        return {
+            "resident": len(self._cache),
+            "hits": self._cache_hits,
+            "misses": self._cache_misses,
+            "evictions": self._cache_evictions,
+        }
+
+    def _cached(self, gid: str) -> Optional[GuildDB]:
+        guild_db = self._cache.get(gid)
+        if guild_db is None:
+            with _lock:
+                guild_db = self._unloading.pop(gid, None)
+            if guild_db is not None:
+                self._readmit(gid, guild_db)
+        if guild_db is None:
+            return None
+        self._cache.move_to_end(gid)
+        self._last_used[gid] = time.monotonic()
+        self._cache_hits += 1
+        return guild_db
+
+    def _admit(self, gid: str, guild_db: GuildDB):
+        self._cache_misses += 1
+        self._readmit(gid, guild_db)
+        self._last_used[gid] = time.monotonic()
+
+    def _readmit(self, gid: str, guild_db: GuildDB):
+        self._cache[gid] = guild_db
+
+    def _adopt(self, guild_db: GuildDB) -> GuildDB:
+        """The resident instance of guild_db's guild. A GuildDB still in use after it was
+        unloaded (e.g. held by a running scan) is taken back in rather than losing its writes."""
+        gid = guild_db.guild_id
+        current = self._cache.get(gid)
+        if current is None:
+            with _lock:
+                current = self._unloading.pop(gid, None)
+            current = current or guild_db
+            self._readmit(gid, current)
+            self._last_used[gid] = time.monotonic()
+        return current
+
+    def _evict_guilds(self):
+        now = time.monotonic()
+        victims = []
+        if CACHE_MAX_GUILDS > 0:
+            while len(self._cache) > CACHE_MAX_GUILDS:
+                victims.append(self._cache.popitem(last=False))
+        if CACHE_MEMORY_BUDGET > 0 and len(self._cache) > 1:
+            total = sum(g.memory_estimate() for g in self._cache.values())
+            while total > CACHE_MEMORY_BUDGET and len(self._cache) > 1:
+                gid, guild_db = self._cache.popitem(last=False)
+                total -= guild_db.memory_estimate()
+                victims.append((gid, guild_db))
+        if CACHE_IDLE_SECONDS > 0 and now - self._last_sweep >= self._SWEEP_INTERVAL:
+            self._last_sweep = now
+            for gid in list(self._cache.keys())[:-1]:
+                if now - self._last_used.get(gid, now) < CACHE_IDLE_SECONDS:
+                    break
+                victims.append((gid, self._cache.pop(gid)))
+        for gid, guild_db in victims:
+            self._last_used.pop(gid, None)
+            self._cache_evictions += 1
+            with _lock:
+                self._unloading[gid] = guild_db
+            self._release(gid, guild_db)
+            self._writer.mark(gid)
+
+    def _release(self, gid: str, guild_db: GuildDB):
+        """Backend hook: drop per-guild state other than _cache before the writer flushes it."""
+        pass
+
+    def _finish_unload(self, gid: str, guild_db: GuildDB):
+        """Writer thread, after the final flush of an unloading guild."""
+        with _lock:
+            if self._unloading.get(gid) is guild_db:
+                del self._unloading[gid]
+
+class DBManager(_GuildCache):
     def __init__(self):
-        self._raw = _load_all()
-        self._cache: Dict[str, GuildDB] = {}
+        # only guilds that have been fetched are resident
+        self._raw: Dict[str, Dict[str, Any]] = {}
+        self._init_cache()
+        # shard objects outlive unloads so journal sequence numbers stay consistent
+        self._shards: Dict[str, _Shard] = {}
+        self._index: Dict[str, Dict[str, Any]] = _load_index()
+        self._writer = _Writer(self)
 
     def fetch(self, guild_id: str) -> GuildDB:
         gid = str(guild_id)
-        if gid not in self._raw:
-            self._raw[gid] = json.loads(json.dumps(DEFAULT_GUILD))
-            _save_all_bg(self._raw)
-        if gid not in self._cache:
-            self._cache[gid] = GuildDB(gid, self._raw[gid], self._raw)
-        return self._cache[gid]
+        guild_db = self._cached(gid)
+        if guild_db is None:
+            raw, records = self._shard(gid).load()
+            if raw is None:
+                raw = _default_guild()
+            self._raw[gid] = raw
+            guild_db = GuildDB(gid, raw, self)
+            for rec in records:
+                try:
+                    guild_db._apply(rec)
+                except Exception:
+                    continue
+            self._admit(gid, guild_db)
+            self._sync_index(gid)
+        self._evict_guilds()
+        return guild_db
 
     def is_banned(self, guild_id: str) -> bool:
         gid = str(guild_id)
-        return bool(self._raw.get(gid, {}).get("banned", False))
+        return bool(self._index.get(gid, {}).get("banned", False))
+
+    def markov_channel(self, guild_id: str) -> Optional[int]:
+        """The guild's Markov channel id, answered from the index without loading the guild."""
+        return self._index.get(str(guild_id), {}).get("channelId")
+
+    def guild_ids(self) -> List[str]:
+        """Every known guild, loaded or not."""
+        return list(self._index.keys())
+
+    def dm_learn_guilds(self, user_id: str) -> List[Tuple[str, int]]:
+        """(guild_id, weight) pairs of guilds that learn from this user's DMs."""
+        uid = str(user_id)
+        out = []
+        for gid, entry in self._index.items():
+            users = entry.get("dm_learn_users") or {}
+            if uid in users:
+                try:
+                    out.append((gid, int(users[uid])))
+                except Exception:
+                    out.append((gid, 1))
+        return out
+
+    def compact(self, guild_id: str):
+        """Ask the writer to fold a guild's journal into a fresh guild.json on its next batch."""
+        gid = str(guild_id)
+        if gid not in self._raw and gid not in self._unloading:
+            return
+        self._shard(gid).compact_requested = True
+        self._writer.mark(gid)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Persist every pending change now and wait for it (call before shutting down)."""
+        return self._writer.flush(timeout)
+
+    # ---------------- internals ----------------
+    def _model_dir(self, gid: str) -> str:
+        """Where the guild's map files go (see mapped_chains)."""
+        return self._shard(gid).dir
+
+    def _shard(self, gid: str) -> _Shard:
+        if gid not in self._shards:
+            self._shards[gid] = _Shard(gid)
+        return self._shards[gid]
+
+    def _readmit(self, gid: str, guild_db: GuildDB):
+        self._cache[gid] = guild_db
+        self._raw[gid] = guild_db._raw
+
+    def _release(self, gid: str, guild_db: GuildDB):
+        self._raw.pop(gid, None)
+
+    def _record(self, guild_db: GuildDB, rec: Dict[str, Any]):
+        """Queue one change: a journal line in journaled mode, otherwise a guild rewrite."""
+        gid = guild_db.guild_id
+        current = self._adopt(guild_db)
+        if current is not guild_db:
+            # stale instance; the guild was reloaded since, so carry the change over
+            current._apply(rec)
+        if rec.get("op") == "set" and rec.get("k") in _INDEX_KEYS:
+            self._sync_index(gid)
+        if JOURNAL_ENABLED:
+            self._shard(gid).append(rec)
+        self._writer.mark(gid)
+
+    def _sync_index(self, gid: str):
+        if gid not in self._raw:
+            return
+        entry = _index_entry(self._raw[gid])
+        if self._index.get(gid) == entry:
+            return
+        with _lock:
+            self._index[gid] = entry
+        self._writer.mark()
+
+    def _write_index(self):
+        with _lock:
+            data = _dumps(self._index)
+        os.makedirs(GUILDS_DIR, exist_ok=True)
+        _atomic_write_with_retries(INDEX_PATH, data)
+
+    def _flush_guild(self, gid: str):
+        """Writer thread: append queued journal lines and, when due, write a new snapshot.
+        Under the guild lock only cheap copies are taken (config, text columns, the model's table walk);
+        JSON encoding, compression and file writes run after it is released, so add_text never waits on them.
+        """
+        guild_db = self._cache.get(gid) or self._unloading.get(gid)
+        shard = self._shards.get(gid)
+        if guild_db is None or shard is None:
+            return
+        with guild_db._lock:
+            shard.write_pending()
+            due = (not JOURNAL_ENABLED or shard.compact_requested
+                   or shard.journal_bytes >= JOURNAL_COMPACT_BYTES)
+            if due:
+                shard.compact_requested = False
+                seq = shard.rotate()
+                raw, texts = dict(guild_db._raw), guild_db._texts.copy()
+                fingerprint = guild_db._fingerprint
+                model = body = None
+                if fingerprint != shard.model_fingerprint and not guild_db._model_stale:
+                    if getattr(guild_db.markov, "mapped", False):
+                        # only the small delta is serialized
+                        model = guild_db.markov.dumps(fingerprint)
+                    else:
+                        body = guild_db.markov._dump_body()
+        if due:
+            data = _dumps(dict(raw, texts=texts.to_list(), **{_SNAPSHOT_SEQ_KEY: seq}))
+            if body is not None:
+                model = MarkovChains._seal(*body, fingerprint)
+            if model is not None and _atomic_write_with_retries(shard.model_path, model):
+                shard.model_fingerprint = fingerprint
+            shard.write_snapshot(data, seq)
+        if self._unloading.get(gid) is guild_db:
+            with guild_db._lock:
+                shard.write_pending()
+                shard.close()
+            self._finish_unload(gid, guild_db)
+
+def _create_manager():
+    if STORAGE_BACKEND == "sqlite":
+        from db_sqlite import SQLiteDBManager
+        return SQLiteDBManager()
+    return DBManager()
 
-db = DBManager()
+db = _create_manager()
+atexit.register(db.flush, 10.0)
@@ -0,0 +1,562 @@
+# db_sqlite.py
+import os
+import asyncio
+import sys
+import json
+import random
+import sqlite3
+import threading
+from typing import Dict, Any, List, Optional, Iterator, Tuple
+from markov_chains import MarkovChains, corpus_fingerprint
+from text_store import content_key
+from model_builder import rebuild
+from mapped_chains import maybe_map
+from db_json import (GuildDB, DEFAULT_GUILD, DATA_DIR, _FINGERPRINT_MASK, _Writer, _GuildCache, _in_event_loop,
+                     iter_stored_guilds)
+
+SQLITE_PATH = os.getenv("DB_SQLITE_PATH", os.path.join(DATA_DIR, "db.sqlite3"))
+# the writer persists a guild's model once this many texts were trained since the last save
+MODEL_SAVE_EVERY = int(os.getenv("DB_SQLITE_MODEL_SAVE_EVERY", "1000"))
+# per-guild settings; texts and the model have their own tables
+_CONFIG_KEYS = [k for k in DEFAULT_GUILD if k != "texts"]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS texts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    guild_id TEXT NOT NULL,
+    text TEXT NOT NULL,
+    author_id TEXT,
+    message_id TEXT,
+    weight INTEGER NOT NULL DEFAULT 1,
+    source TEXT,
+    content_hash INTEGER
+);
+CREATE INDEX IF NOT EXISTS texts_guild ON texts (guild_id);
+CREATE INDEX IF NOT EXISTS texts_guild_author ON texts (guild_id, author_id);
+CREATE INDEX IF NOT EXISTS texts_guild_message ON texts (guild_id, message_id);
+CREATE INDEX IF NOT EXISTS texts_guild_source ON texts (guild_id, source);
+CREATE INDEX IF NOT EXISTS texts_guild_content ON texts (guild_id, content_hash);
+CREATE TABLE IF NOT EXISTS guild_config (
+    guild_id TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT,
+    PRIMARY KEY (guild_id, key)
+);
+CREATE INDEX IF NOT EXISTS guild_config_key ON guild_config (key);
+CREATE TABLE IF NOT EXISTS models (
+    guild_id TEXT PRIMARY KEY,
+    last_text_id INTEGER NOT NULL,
+    data BLOB NOT NULL
+);
+"""
+
+def _connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(texts)")]
+    if columns and "content_hash" not in columns:
+        # databases from before duplicate detection: add and backfill the content hash once
+        with conn:
+            conn.execute("ALTER TABLE texts ADD COLUMN content_hash INTEGER")
+            rows = conn.execute("SELECT id, text FROM texts").fetchall()
+            conn.executemany("UPDATE texts SET content_hash = ? WHERE id = ?",
+                             ((content_key(text), row_id) for row_id, text in rows))
+    conn.executescript(_SCHEMA)
+    return conn
+
+def _row_to_entry(row: Tuple) -> Dict[str, Any]:
+    return {"text": row[0], "authorId": row[1], "messageId": row[2], "weight": row[3], "source": row[4]}
+
+def _entry_to_row(guild_id: str, entry: Dict[str, Any]) -> Tuple:
+    try:
+        weight = int(entry.get("weight", 1))
+    except Exception:
+        weight = 1
+    text = entry.get("text", "") or ""
+    return (guild_id, text, entry.get("authorId"), entry.get("messageId"),
+            weight, entry.get("source", "channel"), content_key(text))
+
+def import_json(conn: sqlite3.Connection) -> int:
+    """Copy every guild of the JSON store into SQLite, replacing rows of guilds already present.
+    Models are not copied; each guild's model is rebuilt from its texts on first fetch. Returns guilds imported.
+    """
+    count = 0
+    for gid, raw in iter_stored_guilds():
+        with conn:
+            conn.execute("DELETE FROM texts WHERE guild_id = ?", (gid,))
+            conn.execute("DELETE FROM guild_config WHERE guild_id = ?", (gid,))
+            conn.execute("DELETE FROM models WHERE guild_id = ?", (gid,))
+            conn.executemany(
+                "INSERT INTO texts (guild_id, text, author_id, message_id, weight, source, content_hash) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (_entry_to_row(gid, e) for e in raw.get("texts", []) if isinstance(e, dict))
+            )
+            conn.executemany(
+                "INSERT INTO guild_config (guild_id, key, value) VALUES (?, ?, ?)",
+                ((gid, k, json.dumps(raw.get(k, DEFAULT_GUILD[k]))) for k in _CONFIG_KEYS)
+            )
+        count += 1
+    return count
+
+class SQLiteGuildDB(GuildDB):
+    """GuildDB backed by SQLite: texts stay on disk, only the config and the model are resident."""
+    def __init__(self, guild_id: str, config: Dict[str, Any], manager: "SQLiteDBManager"):
+        self.guild_id = guild_id
+        self._raw = config
+        self._manager = manager
+        self._lock = threading.RLock()
+        self._rebuild = None
+        self._deltas = None
+        self._model_stale = False
+        # last row id covered by the texts handed to an in-flight rebuild, those texts and their fingerprint
+        self._rebuild_upto = 0
+        self._rebuild_texts = self._rebuild_hash = None
+        self.duplicates_skipped = 0
+        self.unlearn_generation = 0
+        # (count, hash) of the rows self.markov is trained on, as corpus_fingerprint computes it
+        markov, self._last_text_id, self._fingerprint = manager._load_model(guild_id, self.get_markov_order())
+        if markov is None:
+            # serve an empty model until the background rebuild swaps the full one in
+            markov, self._model_stale = MarkovChains({}, self.get_markov_order()), True
+            self._start_rebuild().add_done_callback(self._rebuilt)
+        self.markov = markov
+        # texts trained into (or evicted from) self.markov since it was last written to the models table
+        self._unsaved = 0
+        self._nbytes = manager._query_one(
+            "SELECT COALESCE(SUM(LENGTH(CAST(text AS BLOB))), 0) FROM texts WHERE guild_id = ?", (guild_id,)) or 0
+        self._raw["textsSeen"] = max(int(self._raw.get("textsSeen", 0) or 0), self.get_texts_length())
+        self._sync_order()
+
+    def get_texts_length(self) -> int:
+        return self._manager._query_one("SELECT COUNT(*) FROM texts WHERE guild_id = ?", (self.guild_id,))
+
+    def get_texts(self) -> List[Dict[str, Any]]:
+        return list(self.iter_texts())
+
+    def memory_estimate(self) -> int:
+        # texts stay in the database; only the model is resident
+        return self.markov.approx_nbytes()
+
+    def iter_texts(self, after_id: int = 0) -> Iterator[Dict[str, Any]]:
+        """Stream stored entries in insertion order without materializing the whole corpus."""
+        for row in self._manager._iter_rows(
+                "SELECT text, author_id, message_id, weight, source, id FROM texts "
+                "WHERE guild_id = ? AND id > ? ORDER BY id", (self.guild_id, after_id)):
+            yield _row_to_entry(row)
+
+    # actions
+    def add_text(self, text: str, author_id: str, message_id: str, weight: int = 1, source: str = "channel"):
+        entry = {
+            "text": text,
+            "authorId": author_id,
+            "messageId": message_id,
+            "weight": int(weight),
+            "source": source
+        }
+        with self._lock:
+            if self.is_duplicate(text, message_id):
+                self.duplicates_skipped += 1
+                return
+            admitted = self._admit()
+            self._count_seen(1)
+            if not admitted:
+                return
+            self._last_text_id = self._manager._insert_texts(self.guild_id, [entry])
+            self._nbytes += len((entry["text"] or "").encode("utf-8", "surrogatepass"))
+            self._train(entry)
+            self._unsaved += 1
+            self._enforce_limit()
+            if self._unsaved >= MODEL_SAVE_EVERY:
+                self._manager.compact(self.guild_id)
+
+    def extend_texts(self, entries: List[Dict[str, Any]], persist: bool = True, train: bool = True) -> int:
+        stored = 0
+        with self._lock:
+            for entry in entries:
+                if self.is_duplicate(entry.get("text", ""), entry.get("messageId")):
+                    self.duplicates_skipped += 1
+                    continue
+                admitted = self._admit()
+                self._count_seen(1)
+                if not admitted:
+                    continue
+                self._manager._insert_texts(self.guild_id, [entry])
+                self._nbytes += len((entry.get("text", "") or "").encode("utf-8", "surrogatepass"))
+                stored += 1
+                self._enforce_limit()
+            # rows after _last_text_id are the batch; train on them only
+            if train:
+                self._unsaved += self._ingest((e["text"], e["weight"]) for e in self.iter_texts(self._last_text_id))
+                self._last_text_id = self._manager._last_text_id(self.guild_id)
+            elif stored:
+                self._model_stale = True
+            if persist or self._unsaved >= MODEL_SAVE_EVERY:
+                self.save_markov()
+        return stored
+
+    def save_markov(self):
+        self._manager.compact(self.guild_id)
+
+    def clear_texts(self):
+        with self._lock:
+            self._manager._execute("DELETE FROM texts WHERE guild_id = ?", (self.guild_id,))
+            self._manager._execute("DELETE FROM models WHERE guild_id = ?", (self.guild_id,))
+            self.markov = MarkovChains({}, self.get_markov_order())
+            self._last_text_id = 0
+            self._fingerprint = (0, 0)
+            self._unsaved = 0
+            self._nbytes = 0
+            self._model_stale = False
+            self._set("scanCursors", {})
+
+    def is_duplicate(self, text: str, message_id: Optional[str]) -> bool:
+        gid = self.guild_id
+        if message_id is not None and self._manager._query_one(
+                "SELECT 1 FROM texts WHERE guild_id = ? AND message_id = ? LIMIT 1", (gid, str(message_id))):
+            return True
+        return self.get_duplicate_policy() == "skip" and bool(self._manager._query_one(
+            "SELECT 1 FROM texts WHERE guild_id = ? AND content_hash = ? LIMIT 1", (gid, content_key(text))))
+
+    def remove_message(self, message_id: str) -> int:
+        with self._lock:
+            return self._forget("message_id = ?", str(message_id))
+
+    def edit_message(self, message_id: str, text: str) -> int:
+        with self._lock:
+            rows = [row for row in self._manager._iter_rows(
+                "SELECT id, text, weight FROM texts WHERE guild_id = ? AND message_id = ?",
+                (self.guild_id, str(message_id))) if row[1] != text]
+            for row_id, old, weight in rows:
+                self._manager._execute("UPDATE texts SET text = ?, content_hash = ? WHERE id = ?",
+                                       (text, content_key(text), row_id))
+                self._nbytes += (len(text.encode("utf-8", "surrogatepass"))
+                                 - len((old or "").encode("utf-8", "surrogatepass")))
+                if self._covers(row_id):
+                    self._untrain({"text": old, "weight": weight})
+                    self._train({"text": text, "weight": weight})
+                    self._unsaved += 1
+            if rows:
+                self.unlearn_generation += 1
+            return len(rows)
+
+    def remove_author(self, author_id: str) -> int:
+        with self._lock:
+            return self._forget("author_id = ?", str(author_id))
+
+    def _forget(self, where: str, value: str) -> int:
+        """Delete this guild's rows matching where and untrain the ones the model has seen."""
+        rows = list(self._manager._iter_rows(
+            f"SELECT id, text, weight FROM texts WHERE guild_id = ? AND {where}", (self.guild_id, value)))
+        if not rows:
+            return 0
+        self._manager._execute(f"DELETE FROM texts WHERE guild_id = ? AND {where}", (self.guild_id, value))
+        for row_id, text, weight in rows:
+            self._nbytes -= len((text or "").encode("utf-8", "surrogatepass"))
+            if self._covers(row_id):
+                self._untrain({"text": text, "weight": weight})
+                self._unsaved += 1
+        self.unlearn_generation += 1
+        return len(rows)
+
+    def _covers(self, row_id: int) -> bool:
+        """Whether the model was trained on this row (rows past _last_text_id await an extend_texts batch)."""
+        return row_id <= self._last_text_id and not self._model_stale
+
+    def _train(self, entry: Dict[str, Any]):
+        super()._train(entry)
+        self._count_text(entry)
+
+    def _untrain(self, entry: Dict[str, Any]):
+        super()._untrain(entry)
+        self._count_text(entry, -1)
+
+    def _ingest(self, pairs) -> int:
+        pairs = list(pairs)
+        n = super()._ingest(pairs)
+        count, total = corpus_fingerprint(pairs)
+        self._fingerprint = (self._fingerprint[0] + count, (self._fingerprint[1] + total) & _FINGERPRINT_MASK)
+        return n
+
+    def _training_texts(self) -> List[Tuple[str, int]]:
+        rows = list(self._manager._iter_rows(
+            "SELECT text, weight, id FROM texts WHERE guild_id = ? ORDER BY id", (self.guild_id,)))
+        self._rebuild_upto = rows[-1][2] if rows else 0
+        texts = [(row[0], row[1]) for row in rows]
+        # hashed in a thread while the model builds; _swap_model fingerprints the new model with it
+        self._rebuild_texts = texts
+        self._rebuild_hash = asyncio.ensure_future(asyncio.to_thread(corpus_fingerprint, texts))
+        return texts
+
+    def _swap_model(self, markov: MarkovChains):
+        self.markov = markov
+        # rows stored untrained before the snapshot are covered now
+        self._last_text_id = max(self._last_text_id, self._rebuild_upto)
+        hashed = self._rebuild_hash
+        self._fingerprint = hashed.result() if hashed.done() else corpus_fingerprint(self._rebuild_texts)
+        # plus the changes replayed onto the new model
+        for text, weight, sign in self._deltas or ():
+            self._count_text((text, weight), sign)
+        self._rebuild_texts = self._rebuild_hash = None
+        self._unsaved += 1
+
+    # ---------------- corpus limit ----------------
+    def _corpus_size(self) -> Tuple[int, int]:
+        return self.get_texts_length(), self._nbytes
+
+    def _count_seen(self, n: int):
+        self._raw["textsSeen"] = int(self._raw.get("textsSeen", 0) or 0) + n
+        # only reservoir sampling reads the counter back, so skip the write otherwise
+        if self.get_corpus_limit()[2] == "reservoir":
+            self._set("textsSeen", self._raw["textsSeen"])
+
+    def _evict_one(self, train: bool, record: bool) -> bool:
+        policy = self.get_corpus_limit()[2]
+        gid = self.guild_id
+        if policy == "reservoir":
+            # a uniformly random row other than the newest one
+            count = self.get_texts_length()
+            offset = random.randrange(count - 1) if count > 1 else 0
+            row_id = self._manager._query_one(
+                "SELECT id FROM texts WHERE guild_id = ? ORDER BY id LIMIT 1 OFFSET ?", (gid, offset))
+        elif policy == "fair":
+            row_id = self._manager._query_one(
+                "SELECT MIN(id) FROM texts WHERE guild_id = ? AND author_id IS ("
+                "SELECT author_id FROM texts WHERE guild_id = ? GROUP BY author_id "
+                "ORDER BY COUNT(*) DESC LIMIT 1)", (gid, gid))
+        else:
+            row_id = self._manager._query_one("SELECT MIN(id) FROM texts WHERE guild_id = ?", (gid,))
+        if row_id is None:
+            return False
+        row = next(self._manager._iter_rows(
+            "SELECT text, author_id, message_id, weight, source FROM texts WHERE id = ?", (row_id,)), None)
+        if row is None:
+            return False
+        self._manager._execute("DELETE FROM texts WHERE id = ?", (row_id,))
+        entry = _row_to_entry(row)
+        self._nbytes -= len((entry["text"] or "").encode("utf-8", "surrogatepass"))
+        if train and self._covers(row_id):
+            self._untrain(entry)
+            self._unsaved += 1
+        return True
+
+    # ---------------- internal helpers ----------------
+    def _set(self, key: str, value: Any):
+        with self._lock:
+            self._raw[key] = value
+            self._manager._execute(
+                "INSERT OR REPLACE INTO guild_config (guild_id, key, value) VALUES (?, ?, ?)",
+                (self.guild_id, key, json.dumps(value))
+            )
+
+class SQLiteDBManager(_GuildCache):
+    def __init__(self, path: str = SQLITE_PATH):
+        fresh = not os.path.exists(path)
+        self._conn = _connect(path)
+        # memory-mapped models (see mapped_chains) live next to the database
+        self._maps_dir = os.path.join(os.path.dirname(os.path.abspath(path)), "maps")
+        self._db_lock = threading.RLock()
+        self._init_cache()
+        self._compact_requested = set()
+        if fresh:
+            import_json(self._conn)
+        self._writer = _Writer(self)
+
+    def fetch(self, guild_id: str) -> SQLiteGuildDB:
+        gid = str(guild_id)
+        guild_db = self._cached(gid)
+        if guild_db is None:
+            config = {k: json.loads(json.dumps(DEFAULT_GUILD[k])) for k in _CONFIG_KEYS}
+            rows = list(self._iter_rows("SELECT key, value FROM guild_config WHERE guild_id = ?", (gid,)))
+            for key, value in rows:
+                try:
+                    config[key] = json.loads(value)
+                except Exception:
+                    continue
+            if not rows:
+                with self._db_lock, self._conn:
+                    self._conn.executemany(
+                        "INSERT OR IGNORE INTO guild_config (guild_id, key, value) VALUES (?, ?, ?)",
+                        ((gid, k, json.dumps(config[k])) for k in _CONFIG_KEYS)
+                    )
+            guild_db = SQLiteGuildDB(gid, config, self)
+            self._admit(gid, guild_db)
+        self._evict_guilds()
+        return guild_db
+
+    def is_banned(self, guild_id: str) -> bool:
+        value = self._query_one("SELECT value FROM guild_config WHERE guild_id = ? AND key = 'banned'",
+                                (str(guild_id),))
+        try:
+            return bool(json.loads(value)) if value is not None else False
+        except Exception:
+            return False
+
+    def markov_channel(self, guild_id: str) -> Optional[int]:
+        value = self._query_one("SELECT value FROM guild_config WHERE guild_id = ? AND key = 'channelId'",
+                                (str(guild_id),))
+        try:
+            return json.loads(value) if value is not None else None
+        except Exception:
+            return None
+
+    def guild_ids(self) -> List[str]:
+        return [row[0] for row in self._iter_rows("SELECT DISTINCT guild_id FROM guild_config", ())]
+
+    def dm_learn_guilds(self, user_id: str) -> List[Tuple[str, int]]:
+        uid = str(user_id)
+        out = []
+        for gid, value in self._iter_rows("SELECT guild_id, value FROM guild_config WHERE key = 'dm_learn_users'", ()):
+            try:
+                users = json.loads(value) or {}
+            except Exception:
+                continue
+            if uid in users:
+                try:
+                    out.append((gid, int(users[uid])))
+                except Exception:
+                    out.append((gid, 1))
+        return out
+
+    def compact(self, guild_id: str):
+        """Ask the writer to persist the guild's model on its next batch."""
+        gid = str(guild_id)
+        self._compact_requested.add(gid)
+        self._writer.mark(gid)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        for gid, guild_db in list(self._cache.items()):
+            if guild_db._unsaved or gid in self._compact_requested:
+                self._compact_requested.add(gid)
+                self._writer.mark(gid)
+        return self._writer.flush(timeout)
+
+    # ---------------- internals ----------------
+    def _execute(self, sql: str, params: Tuple):
+        with self._db_lock, self._conn:
+            return self._conn.execute(sql, params)
+
+    def _query_one(self, sql: str, params: Tuple) -> Any:
+        with self._db_lock:
+            row = self._conn.execute(sql, params).fetchone()
+        return row[0] if row else None
+
+    def _iter_rows(self, sql: str, params: Tuple, batch: int = 1000) -> Iterator[Tuple]:
+        # a separate cursor per query; rows are fetched in batches under the lock
+        with self._db_lock:
+            cur = self._conn.cursor()
+            cur.execute(sql, params)
+        while True:
+            with self._db_lock:
+                rows = cur.fetchmany(batch)
+            if not rows:
+                return
+            yield from rows
+
+    def _insert_texts(self, gid: str, entries: List[Dict[str, Any]]) -> int:
+        """Insert entries and return the id of the last inserted row."""
+        with self._db_lock, self._conn:
+            cur = None
+            for entry in entries:
+                cur = self._conn.execute(
+                    "INSERT INTO texts (guild_id, text, author_id, message_id, weight, source, content_hash) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    _entry_to_row(gid, entry)
+                )
+            return cur.lastrowid if cur is not None else self._last_text_id(gid)
+
+    def _last_text_id(self, gid: str) -> int:
+        return self._query_one("SELECT COALESCE(MAX(id), 0) FROM texts WHERE guild_id = ?", (gid,)) or 0
+
+    def _load_model(self, gid: str, order: Optional[int] = None
+                    ) -> Tuple[Optional[MarkovChains], int, Tuple[int, int]]:
+        """Load the saved model and train it on texts added after it was saved. Returns (model, last
+        row id it covers, corpus fingerprint of the rows it covers).
+        The snapshot records the fingerprint of the rows up to last_text_id; if they were evicted,
+        edited or replaced since, the model is stale and is rebuilt from scratch. Inside a running
+        event loop that rebuild is left to the caller: (None, 0, (0, 0)) is returned.
+        """
+        with self._db_lock:
+            row = self._conn.execute("SELECT last_text_id, data FROM models WHERE guild_id = ?", (gid,)).fetchone()
+        markov, last, fingerprint = MarkovChains({}, order), 0, (0, 0)
+        if row:
+            try:
+                markov, saved = MarkovChains.loads(row[1])
+                last = int(row[0])
+                fingerprint = self._fingerprint_upto(gid, last)
+                if fingerprint != saved:
+                    markov, last, fingerprint = MarkovChains({}, order), 0, (0, 0)
+            except Exception:
+                try:
+                    # rows written before the binary snapshot format held JSON
+                    markov, last = MarkovChains(json.loads(row[1])), int(row[0])
+                    fingerprint = self._fingerprint_upto(gid, last)
+                except Exception:
+                    markov, last, fingerprint = MarkovChains({}, order), 0, (0, 0)
+        rows = self._iter_rows(
+            "SELECT text, weight, id FROM texts WHERE guild_id = ? AND id > ? ORDER BY id", (gid, last))
+        if not last and not len(markov):
+            # full rebuild; large corpora are built in parallel
+            if _in_event_loop() and self._query_one("SELECT 1 FROM texts WHERE guild_id = ? LIMIT 1", (gid,)):
+                return None, 0, (0, 0)
+            texts, rows = [], list(rows)
+            if rows:
+                texts = [(row[0], row[1] or 1) for row in rows]
+                markov, last = rebuild(texts, order), rows[-1][2]
+                markov = maybe_map(markov, self._model_dir(gid))
+                # replace the outdated saved model so the next load can skip this
+                self._compact_requested.add(gid)
+            return markov, last, corpus_fingerprint(texts)
+        count, total = fingerprint
+        for row in rows:
+            markov.add_text(row[0], row[1] or 1)
+            n, h = corpus_fingerprint(((row[0], row[1] or 1),))
+            count, total, last = count + n, (total + h) & _FINGERPRINT_MASK, row[2]
+        mapped = maybe_map(markov, self._model_dir(gid))
+        if mapped is not markov:
+            # the saved row holds the full model; the next write replaces it by a delta snapshot
+            self._compact_requested.add(gid)
+        return mapped, last, (count, total)
+
+    def _fingerprint_upto(self, gid: str, last: int) -> Tuple[int, int]:
+        return corpus_fingerprint(self._iter_rows(
+            "SELECT text, weight FROM texts WHERE guild_id = ? AND id <= ?", (gid, last)))
+
+    def _model_dir(self, gid: str) -> str:
+        return os.path.join(self._maps_dir, gid)
+
+    def _release(self, gid: str, guild_db: SQLiteGuildDB):
+        if guild_db._unsaved:
+            self._compact_requested.add(gid)
+
+    def _flush_guild(self, gid: str):
+        """Writer thread: write the guild's model when requested or when enough texts are unsaved."""
+        guild_db = self._cache.get(gid) or self._unloading.get(gid)
+        if guild_db is None:
+            return
+        # a stale model is left unsaved; the saved one is caught up or rebuilt on load
+        if guild_db._model_stale or (gid not in self._compact_requested and guild_db._unsaved < MODEL_SAVE_EVERY):
+            if self._unloading.get(gid) is guild_db:
+                self._finish_unload(gid, guild_db)
+            return
+        self._compact_requested.discard(gid)
+        with guild_db._lock:
+            last = guild_db._last_text_id
+            data = guild_db.markov.dumps(guild_db._fingerprint)
+            guild_db._unsaved = 0
+        self._execute("INSERT OR REPLACE INTO models (guild_id, last_text_id, data) VALUES (?, ?, ?)",
+                      (gid, last, data))
+        if self._unloading.get(gid) is guild_db:
+            self._finish_unload(gid, guild_db)
+
+    def _write_index(self):
+        # config rows are written directly; there is no separate index file
+        pass
+
+if __name__ == "__main__":
+    # python db_sqlite.py import  -> (re)import the JSON store into SQLITE_PATH
+    if sys.argv[1:] != ["import"]:
+        print("usage: python db_sqlite.py import")
+        raise SystemExit(2)
+    conn = _connect(SQLITE_PATH)
+    print(f"Imported {import_json(conn)} guild(s) into {SQLITE_PATH}")
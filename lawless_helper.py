@@ -2,11 +2,13 @@
 # bot.py
 import os
 import sys
+import asyncio
 import discord
 from discord.ext import commands
 from dotenv import load_dotenv
 load_dotenv()
 sys.stdout.reconfigure(encoding="utf-8")
+from db_json import db
 
 INTENTS = discord.Intents.all()
 BOT_PREFIX = "?"
@@ -49,6 +51,11 @@ bot = MyBot()
 @commands.is_owner()
 async def boot(ctx):
     print("Booting the Systum.")
+    try:
+        # persist buffered guild changes before the process goes away
+        await asyncio.to_thread(db.flush, 10.0)
+    except Exception as e:
+        print(e)
     try:
         await bot.close()
     except Exception as e: 
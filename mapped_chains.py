@@ -0,0 +1,386 @@
+# mapped_chains.py
+import os
+import sys
+import glob
+import mmap
+import time
+import random
+import struct
+from array import array
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+from markov_chains import (MarkovChains, SENTENCE_STARTS, TOKEN_CACHE_SIZE, _ID_MASK, _FINGERPRINT_MASK,
+                           _filter_generated_text, _le_bytes)
+
+# guilds whose strict 2-gram model reaches this many keys are served from a memory-mapped file (0 = never)
+MMAP_MIN_KEYS = int(os.getenv("MARKOV_MMAP_MIN_KEYS", "0"))
+# texts added/removed on top of the mapped file before it is rebuilt with them merged in
+MMAP_MERGE_TEXTS = int(os.getenv("MARKOV_MMAP_MERGE_TEXTS", "2000"))
+# map files kept per guild directory (the current one, plus the previous one a saved snapshot may still name)
+MMAP_KEEP_FILES = 2
+
+# map file: header, then 8-byte aligned little-endian sections
+#   vocab_offsets Q[n_vocab + 1]  byte offsets into the vocab blob
+#   vocab_sorted  I[n_vocab]      token ids ordered by their UTF-8 bytes, for lookups by string
+#   keys          Q[n_keys]       sorted (k1 << 32 | k2) pair keys
+#   origs         I[n_keys]       original first token per key
+#   row_offsets   Q[n_keys + 1]   row r spans transitions row_offsets[r]:row_offsets[r + 1]
+#   nexts         I[n_trans]      next token ids
+#   cum           Q[n_trans]      cumulative counts within each row
+#   start_rows    I[n_starts]     rows that began a sentence
+#   start_cum     Q[n_starts]     cumulative sentence-start counts
+#   vocab blob
+MAP_MAGIC = b"MKMP"
+MAP_VERSION = 1
+_MAP_HEADER = struct.Struct("<4sHHIIQQQQ")
+# delta snapshot: header, map path, then the added and removed models as regular snapshots
+DELTA_MAGIC = b"MKDL"
+DELTA_VERSION = 1
+_DELTA_HEADER = struct.Struct("<4sHHQQQQI")
+
+def _aligned(data: bytes) -> bytes:
+    return data + b"\0" * (-len(data) % 8)
+
+def export_map(markov: MarkovChains, directory: str, fingerprint: Tuple[int, int] = (0, 0)) -> str:
+    """Write markov (strict 2-gram) as a new map file in directory and prune older ones; returns its path."""
+    if markov.order is not None:
+        raise ValueError("only strict 2-gram models can be mapped")
+    vocab = markov._vocab
+    encoded = [t.encode("utf-8", "surrogatepass") for t in vocab]
+    vocab_offsets = array("Q", [0])
+    for b in encoded:
+        vocab_offsets.append(vocab_offsets[-1] + len(b))
+    vocab_sorted = array("I", sorted(range(len(vocab)), key=encoded.__getitem__))
+    keys = array("Q", sorted(markov._table))
+    origs, row_offsets, nexts, cum = array("I"), array("Q", [0]), array("I"), array("Q")
+    start_rows, start_cum = array("I"), array("Q")
+    starts_total = 0
+    for r, key in enumerate(keys):
+        orig, row_nexts, row_counts = markov._table[key]
+        origs.append(orig)
+        nexts.extend(row_nexts)
+        total = 0
+        for c in row_counts:
+            total += c
+            cum.append(total)
+        row_offsets.append(len(nexts))
+        weight = markov._starts.get(key)
+        if weight:
+            starts_total += weight
+            start_rows.append(r)
+            start_cum.append(starts_total)
+    count, fp_total = fingerprint
+    header = _MAP_HEADER.pack(MAP_MAGIC, MAP_VERSION, 0, len(vocab), len(keys), len(nexts), len(start_rows),
+                              count, fp_total & _FINGERPRINT_MASK)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"model-{time.time_ns()}.map")
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(header)
+        for section in (vocab_offsets, vocab_sorted, keys, origs, row_offsets, nexts, cum, start_rows, start_cum):
+            f.write(_aligned(_le_bytes(section)))
+        f.write(b"".join(encoded))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    for old in sorted(glob.glob(os.path.join(directory, "model-*.map")))[:-MMAP_KEEP_FILES]:
+        try:
+            # a process still mapping the file keeps its pages; only the name goes
+            os.remove(old)
+        except OSError:
+            pass
+    return path
+
+def wants_map(order: Optional[int], keys: int) -> bool:
+    return MMAP_MIN_KEYS > 0 and order is None and keys >= MMAP_MIN_KEYS
+
+def maybe_map(markov: MarkovChains, directory: str, fingerprint: Tuple[int, int] = (0, 0)):
+    """markov itself, or for a model past MMAP_MIN_KEYS a MappedChains over a freshly exported file."""
+    if getattr(markov, "mapped", False) or not wants_map(markov.order, len(markov)):
+        return markov
+    mapped = MappedChains(export_map(markov, directory, fingerprint))
+    mapped.version = markov.version
+    return mapped
+
+class MappedChains:
+    """Read-only strict 2-gram model served from a memory-mapped map file, plus a small in-memory delta.
+    Lookups and sampling read the file through zero-copy memoryviews, so pages load on demand and are
+    shared by every process mapping the same file. Texts added or removed since the file was written
+    go into two regular MarkovChains and are combined with the file's counts per key while sampling;
+    rebuilding into a new file (GuildDB.rebuild_markov) merges them. Used wherever MarkovChains is.
+    """
+    mapped = True
+
+    def __init__(self, path: str):
+        if sys.byteorder != "little":
+            raise ValueError("map files are little-endian")
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, _flags, n_vocab, n_keys, n_trans, n_starts,
+         count, total) = _MAP_HEADER.unpack_from(self._mm)
+        if magic != MAP_MAGIC or version != MAP_VERSION:
+            raise ValueError("not a map file")
+        self.base_fingerprint = (count, total)
+        view = memoryview(self._mm)
+        pos = _MAP_HEADER.size
+        def take(typecode: str, n: int) -> memoryview:
+            nonlocal pos
+            size = n * (8 if typecode == "Q" else 4)
+            section = view[pos:pos + size].cast(typecode)
+            pos += size + (-size % 8)
+            return section
+        self._vocab_offsets = take("Q", n_vocab + 1)
+        self._vocab_sorted = take("I", n_vocab)
+        self._keys = take("Q", n_keys)
+        self._origs = take("I", n_keys)
+        self._row_offsets = take("Q", n_keys + 1)
+        self._nexts = take("I", n_trans)
+        self._cum = take("Q", n_trans)
+        self._start_rows = take("I", n_starts)
+        self._start_cum = take("Q", n_starts)
+        self._blob = view[pos:]
+        if len(self._blob) < self._vocab_offsets[-1]:
+            raise ValueError("truncated map file")
+        self.order: Optional[int] = None
+        self._trie = None
+        self.version = 0
+        # texts trained in / removed since the file was written
+        self._added = MarkovChains()
+        self._removed = MarkovChains()
+        self.delta_texts = 0
+        self._token = lru_cache(maxsize=TOKEN_CACHE_SIZE or None)(self._decode)
+        self._token_id = lru_cache(maxsize=TOKEN_CACHE_SIZE or None)(self._lookup)
+
+    def __len__(self) -> int:
+        # keys only in the delta are counted once more per overlap; close enough for stats and thresholds
+        return len(self._keys) + len(self._added)
+
+    def approx_nbytes(self) -> int:
+        """Resident size: the delta models; mapped pages are shared and reclaimable."""
+        return 4096 + self._added.approx_nbytes() + self._removed.approx_nbytes()
+
+    @property
+    def word_list(self) -> Dict[str, Dict[str, Any]]:
+        return self.to_chains().word_list
+
+    def set_order(self, order: Optional[int], texts: Iterable[Any] = ()) -> None:
+        if order is not None:
+            raise ValueError("mapped models are strict 2-gram; use to_chains() first")
+
+    # ---------------- training (delta) ----------------
+    def add_text(self, text: str, weight: int = 1) -> None:
+        self._added.add_text(text, weight)
+        self.version += 1
+        self.delta_texts += 1
+
+    def remove_text(self, text: str, weight: int = 1) -> None:
+        self._removed.add_text(text, weight)
+        self.version += 1
+        self.delta_texts += 1
+
+    def ingest(self, texts: Iterable[Any]) -> int:
+        n = self._added.ingest(texts)
+        self.version += n
+        self.delta_texts += n
+        return n
+
+    # ---------------- generation ----------------
+    def generate_chain(self, max_words: int, sentence_starts: Optional[bool] = None) -> str:
+        if sentence_starts is None:
+            sentence_starts = SENTENCE_STARTS
+        return self._walk(max_words, sentence_starts, random)
+
+    def generate_many(self, n: int, max_words: Union[int, Sequence[int]], seed: Optional[int] = None,
+                      sentence_starts: Optional[bool] = None, vectorized: Optional[bool] = None) -> List[str]:
+        """As MarkovChains.generate_many; chains are always walked one by one."""
+        limits = [int(max_words)] * n if isinstance(max_words, int) else [int(m) for m in max_words]
+        if len(limits) != n:
+            raise ValueError("max_words must be an int or have n entries")
+        if sentence_starts is None:
+            sentence_starts = SENTENCE_STARTS
+        rng = random.Random(seed)
+        return [self._walk(limit, sentence_starts, rng) for limit in limits]
+
+    # ---------------- snapshots ----------------
+    def dumps(self, fingerprint: Tuple[int, int] = (0, 0)) -> bytes:
+        """Delta snapshot: the map file's path and identity plus the added/removed models (not the file)."""
+        path = self.path.encode("utf-8", "surrogatepass")
+        added, removed = self._added.dumps(), self._removed.dumps()
+        count, total = fingerprint
+        base_count, base_total = self.base_fingerprint
+        header = _DELTA_HEADER.pack(DELTA_MAGIC, DELTA_VERSION, 0, count, total & _FINGERPRINT_MASK,
+                                    base_count, base_total, self.delta_texts)
+        return b"".join([header, struct.pack("<IQQ", len(path), len(added), len(removed)), path, added, removed])
+
+    @classmethod
+    def loads(cls, data: bytes) -> Tuple["MappedChains", Tuple[int, int]]:
+        """Parse a delta snapshot and map the file it names; raises ValueError if either is unusable."""
+        try:
+            magic, version, _flags, count, total, base_count, base_total, delta_texts = \
+                _DELTA_HEADER.unpack_from(data)
+            path_len, added_len, removed_len = struct.unpack_from("<IQQ", data, _DELTA_HEADER.size)
+        except struct.error:
+            raise ValueError("truncated delta snapshot")
+        if magic != DELTA_MAGIC or version != DELTA_VERSION:
+            raise ValueError("not a delta snapshot")
+        pos = _DELTA_HEADER.size + struct.calcsize("<IQQ")
+        path = data[pos:pos + path_len].decode("utf-8", "surrogatepass")
+        pos += path_len
+        try:
+            model = cls(path)
+        except OSError as e:
+            raise ValueError(f"map file unavailable: {e}")
+        if model.base_fingerprint != (base_count, base_total):
+            raise ValueError("map file does not match the snapshot")
+        model._added, _ = MarkovChains.loads(data[pos:pos + added_len])
+        model._removed, _ = MarkovChains.loads(data[pos + added_len:pos + added_len + removed_len])
+        model.delta_texts = delta_texts
+        return model, (count, total)
+
+    def to_chains(self) -> MarkovChains:
+        """Materialize file and delta as a regular in-memory MarkovChains."""
+        markov = MarkovChains()
+        token, keys, cum, nexts, offsets = self._token, self._keys, self._cum, self._nexts, self._row_offsets
+        for r in range(len(keys)):
+            key = keys[r]
+            k1, k2, orig = token(key >> 32), token(key & _ID_MASK), token(self._origs[r])
+            prev = 0
+            for j in range(offsets[r], offsets[r + 1]):
+                markov._count(k1, k2, orig, token(nexts[j]), cum[j] - prev)
+                prev = cum[j]
+        prev = 0
+        for i in range(len(self._start_rows)):
+            key = keys[self._start_rows[i]]
+            markov._starts.add((markov._intern(token(key >> 32)) << 32) | markov._intern(token(key & _ID_MASK)),
+                               self._start_cum[i] - prev)
+            prev = self._start_cum[i]
+        markov.merge(self._added)
+        removed = self._removed
+        for key, (_orig, row_nexts, row_counts) in removed._table.items():
+            k1, k2 = removed._vocab[key >> 32], removed._vocab[key & _ID_MASK]
+            for n, c in zip(row_nexts, row_counts):
+                markov._uncount(k1, k2, removed._vocab[n], c)
+        for key, c in zip(removed._starts.keys, removed._starts.counts):
+            mine = markov._key_id(removed._vocab[key >> 32], removed._vocab[key & _ID_MASK])
+            if mine is not None:
+                markov._starts.add(mine, -c)
+        markov.version = self.version
+        return markov
+
+    # ---------------- internal helpers ----------------
+    def _decode(self, token_id: int) -> str:
+        return str(self._blob[self._vocab_offsets[token_id]:self._vocab_offsets[token_id + 1]],
+                   "utf-8", "surrogatepass")
+
+    def _lookup(self, token: str) -> int:
+        """File token id of token (binary search over the sorted vocab), or -1."""
+        target = token.encode("utf-8", "surrogatepass")
+        ids, offsets, blob = self._vocab_sorted, self._vocab_offsets, self._blob
+        lo, hi = 0, len(ids)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            i = ids[mid]
+            if bytes(blob[offsets[i]:offsets[i + 1]]) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(ids):
+            i = ids[lo]
+            if bytes(blob[offsets[i]:offsets[i + 1]]) == target:
+                return i
+        return -1
+
+    def _row(self, k1: str, k2: str) -> int:
+        a, b = self._token_id(k1), self._token_id(k2)
+        if a < 0 or b < 0:
+            return -1
+        key = (a << 32) | b
+        r = bisect_left(self._keys, key)
+        return r if r < len(self._keys) and self._keys[r] == key else -1
+
+    def _pick_start(self, sentence_starts: bool, rng) -> Optional[Tuple[str, str, str]]:
+        """(k1, k2, displayed first token) of a start state from the file or the added delta, or None."""
+        added = self._added
+        base_total = self._start_cum[-1] if len(self._start_cum) else 0
+        if sentence_starts and base_total + added._starts.total:
+            x = rng.randrange(base_total + added._starts.total)
+            if x < base_total:
+                i = bisect_right(self._start_cum, x)
+                r = self._start_rows[i]
+                key = self._keys[r]
+                k1, k2 = self._token(key >> 32), self._token(key & _ID_MASK)
+                removed = self._removed._key_id(k1, k2)
+                if removed is not None and self._removed._starts.get(removed):
+                    # thin the file's weight by the removed starts (rejection; the caller retries)
+                    weight = self._start_cum[i] - (self._start_cum[i - 1] if i else 0)
+                    if rng.randrange(weight) < self._removed._starts.get(removed):
+                        return None
+                return k1, k2, self._token(self._origs[r])
+            key = added._starts.choice(rng)
+            k1 = added._vocab[key >> 32]
+            return k1, added._vocab[key & _ID_MASK], added._vocab[added._table[key][0]]
+        x = rng.randrange(len(self._keys) + len(added._keys))
+        if x < len(self._keys):
+            key = self._keys[x]
+            k1 = self._token(key >> 32)
+            return k1, self._token(key & _ID_MASK), k1
+        key = added._keys.choice(rng)
+        k1 = added._vocab[key >> 32]
+        return k1, added._vocab[key & _ID_MASK], k1
+
+    def _next(self, k1: str, k2: str, rng) -> Optional[str]:
+        """Next token after (k1, k2), drawn from file counts + added - removed; None at a dead end."""
+        r = self._row(k1, k2)
+        plus = self._added._row_for(k1, k2)
+        minus = self._removed._row_for(k1, k2)
+        if plus is None and minus is None:
+            if r < 0:
+                return None
+            lo, hi = self._row_offsets[r], self._row_offsets[r + 1]
+            j = bisect_right(self._cum, rng.randrange(self._cum[hi - 1]), lo, hi)
+            return self._token(self._nexts[j])
+        counts: Dict[str, int] = {}
+        if r >= 0:
+            prev = 0
+            for j in range(self._row_offsets[r], self._row_offsets[r + 1]):
+                counts[self._token(self._nexts[j])] = self._cum[j] - prev
+                prev = self._cum[j]
+        for row, model, sign in ((plus, self._added, 1), (minus, self._removed, -1)):
+            if row is not None:
+                for n, c in zip(row[1], row[2]):
+                    tok = model._vocab[n]
+                    counts[tok] = counts.get(tok, 0) + sign * c
+        choices = [(tok, c) for tok, c in counts.items() if c > 0]
+        if not choices:
+            return None
+        x = rng.randrange(sum(c for _, c in choices))
+        for tok, c in choices:
+            x -= c
+            if x < 0:
+                return tok
+        return choices[-1][0]
+
+    def _walk(self, max_words: int, sentence_starts: bool, rng) -> str:
+        if not len(self._keys) and not len(self._added):
+            return ""
+        # a start whose transitions were all removed ends at once; retry a few times first
+        start, nxt = None, None
+        for _ in range(8):
+            start = self._pick_start(sentence_starts, rng) or start
+            if start is not None:
+                nxt = self._next(start[0], start[1], rng)
+                if nxt is not None:
+                    break
+        if start is None:
+            return ""
+        k1, k2, first = start
+        generated = [first, k2]
+        for _ in range(max(0, int(max_words) - 2)):
+            if nxt is None:
+                break
+            generated.append(nxt)
+            k1, k2 = k2, nxt
+            nxt = self._next(k1, k2, rng)
+        return _filter_generated_text(" ".join(generated))
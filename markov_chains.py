@@ -1,231 +1,1004 @@
 # markov_chains.py
+import os
 import re
+import sys
+import zlib
+import struct
 import random
-from typing import List, Dict, Any, Optional
+from array import array
+from bisect import bisect_right
+from functools import lru_cache
+from itertools import accumulate
+from typing import List, Dict, Any, Optional, Iterable, Iterator, Tuple, Sequence, Union
+
+try:
+    import numpy as np
+except ImportError:
+    # optional: generate_many walks chains one by one without it
+    np = None
 
-_word_split_re = re.compile(r"\s+")
 _sentence_split_re = re.compile(r"[.!?]+\s*")
 
+# binary model snapshot: header, then a zlib-compressed body (string table + transition arrays)
+MODEL_MAGIC = b"MKCH"
+MODEL_VERSION = 4
+# magic, version, flags, corpus fingerprint (count, sum), crc32 of the compressed body
+_MODEL_HEADER = struct.Struct("<4sHHQQI")
+_FINGERPRINT_MASK = (1 << 64) - 1
+# transition keys pack two 32-bit token ids
+_ID_MASK = (1 << 32) - 1
+# n-gram orders the trie store supports (MarkovChains(order=...)); None keeps the strict 2-gram table only
+MAX_ORDER = 4
+# snapshot header flags
+_FLAG_TRIE = 1
+# generate_chain default: start from keys that opened real sentences, weighted by how often
+SENTENCE_STARTS = os.getenv("MARKOV_SENTENCE_STARTS", "0") == "1"
+# generate_many switches to NumPy lockstep sampling from this many chains on
+VECTORIZE_MIN_CHAINS = int(os.getenv("MARKOV_VECTORIZE_MIN_CHAINS", "128"))
+
+def text_fingerprint(text: str, weight: int = 1) -> int:
+    """Hash of one stored entry, as it contributes to corpus_fingerprint."""
+    return zlib.crc32(f"{weight}\x00{text}".encode("utf-8", "surrogatepass"))
+
+def _text_and_weight(item: Any) -> Optional[Tuple[str, int]]:
+    """Normalize a training item: str, (text, weight) tuple, or entry dict / row with .get()."""
+    if isinstance(item, str):
+        return item, 1
+    if isinstance(item, tuple):
+        text, weight = item[0], item[1] if len(item) > 1 else 1
+    elif hasattr(item, "get"):
+        text, weight = item.get("text", ""), item.get("weight", 1)
+    else:
+        try:
+            return str(item), 1
+        except Exception:
+            return None
+    try:
+        weight = max(1, int(weight))
+    except Exception:
+        weight = 1
+    return text or "", weight
+
+def corpus_fingerprint(texts: Iterable[Any]) -> Tuple[int, int]:
+    """Order-independent (count, sum of entry hashes) identifying the corpus a model was trained on.
+    Entries can be added or removed incrementally by adjusting both numbers.
+    """
+    count, total = 0, 0
+    for item in texts:
+        tw = _text_and_weight(item)
+        if tw is None:
+            continue
+        text, weight = tw
+        count += 1
+        total = (total + text_fingerprint(text, weight)) & _FINGERPRINT_MASK
+    return count, total
+
+def _le_bytes(values: array) -> bytes:
+    if sys.byteorder != "little":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+def _le_array(typecode: str, data: bytes) -> array:
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values
+
+# Discord custom emoji tokens like <:name:123456789> or <a:name:123...> are kept whole
+_emoji_token_re = re.compile(r"<a?:[A-Za-z0-9_~]+:\d+>")
+_word_char_re = re.compile(r"\w")
+# surrounding punctuation stripped from key tokens; internal punctuation like apostrophes stays
+_TOKEN_STRIP_CHARS = "<>()[]{}:;,.\""
+# cleaned forms of recent tokens; chat vocabulary is highly repetitive (0 disables the cache)
+TOKEN_CACHE_SIZE = int(os.getenv("MARKOV_TOKEN_CACHE", "65536"))
+
 def _clean_token(tok: str) -> str:
     """Normalize token for keys: preserve custom emoji tokens, otherwise strip surrounding punctuation."""
     if not tok:
         return ""
     tok = tok.strip()
-    # Preserve Discord custom emoji tokens like <:name:123456789> or <a:name:123...>
-    if re.match(r"^<a?:[A-Za-z0-9_~]+:\d+>$", tok):
-        return tok  # keep full emoji token unchanged
-    # Otherwise only strip surrounding punctuation but keep internal punctuation like apostrophes
-    if re.search(r"\w", tok):
-        tok = re.sub(r"^[<>()[\]{}:;,\.\"]+|[<>()[\]{}:;,\.\"]+$", "", tok)
+    if tok[:1] == "<" and _emoji_token_re.fullmatch(tok):
+        return tok
+    if _word_char_re.search(tok):
+        return tok.strip(_TOKEN_STRIP_CHARS)
     return tok
 
-class MarkovChains:
-    def _filter_generated_text(self, text: str) -> str:
-        """
-        Clean generated text:
-         - trim whitespace
-         - remove/unwind unmatched parentheses/brackets/braces
-         - remove unmatched quotes and markdown markers
-         - trim leading/trailing punctuation
-        """
-        if not isinstance(text, str):
-            return ""
+_clean_token_cached = lru_cache(maxsize=TOKEN_CACHE_SIZE)(_clean_token) if TOKEN_CACHE_SIZE > 0 else _clean_token
 
-        text = text.strip()
+def _sentences(text: str) -> Iterator[str]:
+    """Non-empty sentences of a text (naive split, but effective for chat-like data)."""
+    if not text:
+        return
+    for s in _sentence_split_re.split(text):
+        s = s.strip()
+        if s:
+            yield s
 
-        # remove unmatched pairs like (), [], {}
-        for a, b in [("(", ")"), ("[", "]"), ("{", "}")]:
-            text = self._remove_unclosed_pairs(text, a, b)
+def _token_transitions(raw_tokens: List[str], cleaned: List[str]):
+    """Yield (position, cleaned k1, cleaned k2, raw first token, raw next token) for every 2-gram -> next
+    mapping of a tokenized sentence; position 0 is the sentence start. Keys use cleaned tokens (positions
+    whose key tokens clean to "" are skipped); next tokens stay raw to preserve formatting.
+    """
+    for i in range(len(raw_tokens) - 2):
+        k1 = cleaned[i]
+        k2 = cleaned[i + 1]
+        if k1 and k2:
+            yield i, k1, k2, raw_tokens[i], raw_tokens[i + 2]
 
-        # remove unmatched quotes / markdown markers
-        for ch in ('"', "'", "`", "*"):
-            text = self._remove_unclosed_quotes(text, ch)
+# generated-text cleanup: bracket kinds, and quote-like markers that must come in pairs
+_BRACKETS = {"(": 0, ")": 0, "[": 1, "]": 1, "{": 2, "}": 2}
+_QUOTES = "\"'`*"
+_LEADING_PUNCT = ".,;: "
+_TRAILING_PUNCT = ", "
 
-        # remove stray punctuation at start/end while preserving words
-        import re
-        if re.search(r"\w", text):
-            text = re.sub(r'^[\.,;: ]+', '', text)
-            text = re.sub(r'[, ]+$', '', text)
+def _filter_generated_text(text: str) -> str:
+    """Clean generated text in linear time: trim whitespace, drop unbalanced brackets, an odd quote,
+    backtick or * marker, and leading/trailing punctuation around words.
+    For each bracket kind, closers without an opener are dropped; if openers stay unclosed, every
+    bracket of that kind up to the last unclosed opener goes. For each quote char with an odd count
+    the last one goes.
+    """
+    if not isinstance(text, str):
+        return ""
+    text = text.strip()
+    drop = set()
+    # per bracket kind: positions of open brackets still unmatched, and every position of the kind
+    stacks: Tuple[List[int], ...] = ([], [], [])
+    seen: Tuple[List[int], ...] = ([], [], [])
+    quote_counts = dict.fromkeys(_QUOTES, 0)
+    quote_last = {}
+    for i, ch in enumerate(text):
+        kind = _BRACKETS.get(ch)
+        if kind is not None:
+            if ch in "([{":
+                stacks[kind].append(i)
+                seen[kind].append(i)
+            elif stacks[kind]:
+                stacks[kind].pop()
+                seen[kind].append(i)
+            else:
+                drop.add(i)
+        elif ch in quote_counts:
+            quote_counts[ch] += 1
+            quote_last[ch] = i
+    for kind, stack in enumerate(stacks):
+        if stack:
+            cutoff = stack[-1]
+            drop.update(i for i in seen[kind] if i <= cutoff)
+    drop.update(quote_last[ch] for ch, n in quote_counts.items() if n % 2)
+    if drop:
+        text = "".join([ch for i, ch in enumerate(text) if i not in drop])
+    # trim stray punctuation at start/end while preserving words
+    if _word_char_re.search(text):
+        text = text.lstrip(_LEADING_PUNCT)
+        if text[-1:] == "\n":
+            # as with a "[, ]+$" pattern, the run before a final newline is trimmed
+            text = text[:-1].rstrip(_TRAILING_PUNCT) + "\n"
+        else:
+            text = text.rstrip(_TRAILING_PUNCT)
+    return text
 
-        return text
+class _KeyIndex:
+    """Set of keys kept in an array with positions: O(1) add, remove (swap with last) and uniform pick."""
+    __slots__ = ("keys", "pos")
 
-    def _remove_unclosed_quotes(self, text: str, char: str) -> str:
-        """Remove the last unmatched quote-like char if count is odd."""
-        if not isinstance(text, str) or not char:
-            return text
-        count = text.count(char)
-        if count % 2 != 0:
-            idx = text.rfind(char)
-            if idx != -1:
-                text = text[:idx] + text[idx+1:]
-        return text
+    def __init__(self):
+        self.keys = array("Q")
+        self.pos: Dict[int, int] = {}
 
-    def _remove_unclosed_pairs(self, text: str, open_ch: str, close_ch: str) -> str:
-        """
-        Remove unmatched closing/opening characters by deleting the offending one
-        and re-checking until balanced.
-        """
-        if not isinstance(text, str):
-            return text
-
-        count = 0
-        for i, ch in enumerate(text):
-            if ch == open_ch:
-                count += 1
-            elif ch == close_ch:
-                count -= 1
-            if count < 0:
-                # remove unmatched closing char and re-run
-                text = text[:i] + text[i+1:]
-                return self._remove_unclosed_pairs(text, open_ch, close_ch)
-
-        if count > 0:
-            # remove the first unmatched opening char and re-run
-            for i, ch in enumerate(text):
-                if ch == open_ch:
-                    text = text[:i] + text[i+1:]
-                    return self._remove_unclosed_pairs(text, open_ch, close_ch)
-
-        return text
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def add(self, key: int) -> None:
+        if key not in self.pos:
+            self.pos[key] = len(self.keys)
+            self.keys.append(key)
+
+    def discard(self, key: int) -> None:
+        i = self.pos.pop(key, None)
+        if i is None:
+            return
+        last = self.keys.pop()
+        if i < len(self.keys):
+            self.keys[i] = last
+            self.pos[last] = i
+
+    def choice(self, rng=random) -> int:
+        return self.keys[rng.randrange(len(self.keys))]
+
+class _WeightedKeys:
+    """Keys with positive counts; a Fenwick tree over the counts gives O(log n) updates and weighted picks."""
+    __slots__ = ("keys", "pos", "counts", "tree", "total")
+
+    def __init__(self):
+        self.keys: List[int] = []
+        self.pos: Dict[int, int] = {}
+        self.counts: List[int] = []
+        # 1-based Fenwick tree; tree[0] is unused
+        self.tree: List[int] = [0]
+        self.total = 0
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def get(self, key: int) -> int:
+        i = self.pos.get(key)
+        return 0 if i is None else self.counts[i]
+
+    def add(self, key: int, delta: int) -> None:
+        """Add delta to key's count; keys whose count drops to zero are removed."""
+        i = self.pos.get(key)
+        if i is None:
+            if delta <= 0:
+                return
+            i = self.pos[key] = len(self.keys)
+            self.keys.append(key)
+            self.counts.append(0)
+            n = i + 1
+            # new node covers (n - lowbit(n), n - 1] before its own count is added
+            self.tree.append(self._prefix(n - 1) - self._prefix(n - (n & -n)))
+        delta = max(delta, -self.counts[i])
+        self.counts[i] += delta
+        self.total += delta
+        self._update(i + 1, delta)
+        if not self.counts[i]:
+            self._remove(i)
 
+    def choice(self, rng=random) -> int:
+        """Key drawn in proportion to its count (total must be > 0)."""
+        r = rng.randrange(self.total)
+        idx, step = 0, 1 << (len(self.tree) - 1).bit_length()
+        while step:
+            nxt = idx + step
+            if nxt < len(self.tree) and self.tree[nxt] <= r:
+                idx = nxt
+                r -= self.tree[nxt]
+            step >>= 1
+        return self.keys[idx]
+
+    def _prefix(self, n: int) -> int:
+        total = 0
+        while n > 0:
+            total += self.tree[n]
+            n -= n & -n
+        return total
+
+    def _update(self, n: int, delta: int) -> None:
+        while n < len(self.tree):
+            self.tree[n] += delta
+            n += n & -n
+
+    def _remove(self, i: int) -> None:
+        # zero the last slot, drop it, then move its key and count into slot i
+        key = self.keys[i]
+        last = len(self.keys) - 1
+        last_key, last_count = self.keys[last], self.counts[last]
+        self._update(last + 1, -last_count)
+        self.keys.pop()
+        self.counts.pop()
+        self.tree.pop()
+        del self.pos[key]
+        if i < last:
+            self._update(i + 1, last_count)
+            self.keys[i] = last_key
+            self.counts[i] = last_count
+            self.pos[last_key] = i
+
+class _TrieNode:
+    """One context of the n-gram trie: next-token counts plus children keyed by the token before it."""
+    __slots__ = ("children", "nexts", "counts", "cum")
+
+    def __init__(self):
+        self.children: Optional[Dict[int, "_TrieNode"]] = None
+        self.nexts = array("I")
+        self.counts = array("I")
+        # cumulative counts for sampling; dropped whenever the node changes
+        self.cum: Optional[array] = None
+
+    def bump(self, nxt: int, weight: int) -> None:
+        try:
+            j = self.nexts.index(nxt)
+        except ValueError:
+            if weight > 0:
+                self.nexts.append(nxt)
+                self.counts.append(weight)
+                self.cum = None
+            return
+        if self.counts[j] + weight > 0:
+            self.counts[j] += weight
+        else:
+            del self.nexts[j]
+            del self.counts[j]
+        self.cum = None
+
+    def sample(self, rng=random) -> int:
+        if self.cum is None:
+            self.cum = array("Q", accumulate(self.counts))
+        return self.nexts[bisect_right(self.cum, rng.randrange(self.cum[-1]))]
+
+class _NgramTrie:
+    """Contexts of 1..order preceding tokens stored as a suffix trie: the path root -> t[-1] -> t[-2] -> ...
+    so each longer context extends the node of the shorter one instead of repeating it as a separate key.
+    Context tokens are cleaned token ids; next tokens are raw token ids.
+    """
+    __slots__ = ("order", "root", "nodes")
+
+    def __init__(self, order: int):
+        self.order = order
+        self.root = _TrieNode()
+        self.nodes = 1
+
+    def add(self, context: List[int], nxt: int, weight: int) -> None:
+        """context: cleaned ids of the preceding tokens, most recent first."""
+        node = self.root
+        for tok in context[:self.order]:
+            if node.children is None:
+                node.children = {}
+            child = node.children.get(tok)
+            if child is None:
+                child = node.children[tok] = _TrieNode()
+                self.nodes += 1
+            child.bump(nxt, weight)
+            node = child
+
+    def remove(self, context: List[int], nxt: int, weight: int) -> None:
+        path = [self.root]
+        for tok in context[:self.order]:
+            child = path[-1].children.get(tok) if path[-1].children else None
+            if child is None:
+                break
+            child.bump(nxt, -weight)
+            path.append(child)
+        # prune emptied nodes bottom-up
+        for depth in range(len(path) - 1, 0, -1):
+            node = path[depth]
+            if node.nexts or node.children:
+                break
+            parent = path[depth - 1]
+            del parent.children[context[depth - 1]]
+            if not parent.children:
+                parent.children = None
+            self.nodes -= 1
+
+    def merge(self, other: "_NgramTrie", remap: array) -> None:
+        """Add other's counts node by node; remap translates other's token ids into ours."""
+        stack = [(self.root, other.root)]
+        while stack:
+            node, src = stack.pop()
+            if node.nexts:
+                for n, c in zip(src.nexts, src.counts):
+                    node.bump(remap[n], c)
+            else:
+                node.nexts = array("I", [remap[n] for n in src.nexts])
+                node.counts = array("I", src.counts)
+                node.cum = None
+            if not src.children:
+                continue
+            if node.children is None:
+                node.children = {}
+            for tok, child in src.children.items():
+                mine = node.children.get(remap[tok])
+                if mine is None:
+                    mine = node.children[remap[tok]] = _TrieNode()
+                    self.nodes += 1
+                stack.append((mine, child))
+
+    def deepest(self, context: Iterable[int]) -> Optional[_TrieNode]:
+        """Longest stored context matching the most-recent-first ids (backoff to shorter ones)."""
+        node, best = self.root, None
+        for tok in context:
+            if tok < 0 or node.children is None:
+                break
+            node = node.children.get(tok)
+            if node is None:
+                break
+            if node.nexts:
+                best = node
+        return best
+
+class MarkovChains:
     """
     2-gram strict Markov chain (keys are pairs of consecutive words).
-    word_list: Dict[key: str -> {"original": "<first token of key>", "list": [next_word, ...]}]
+    Tokens are interned in a per-model vocabulary; transitions are keyed by (k1 << 32 | k2) id pairs
+    and hold the original first token id plus parallel arrays of next token ids and counts.
+    word_list exports the dict shape {"w1 w2": {"original": w1, "counts": {next_word: count}}};
+    older {"list": [next_word, ...]} dicts are accepted on construction.
+    With order (1..MAX_ORDER) an n-gram trie is kept as well and generation backs off from the longest
+    matching context; the 2-gram table still provides start states.
     """
-    def __init__(self, word_list: Optional[Dict[str, Dict[str, List[str]]]] = None):
-        self.word_list: Dict[str, Dict[str, List[str]]] = word_list if isinstance(word_list, dict) else {}
+    def __init__(self, word_list: Optional[Dict[str, Dict[str, Any]]] = None, order: Optional[int] = None):
+        # texts trained in or removed so far; kept across in-place rebuilds so it only grows
+        self.version: int = getattr(self, "version", 0)
+        # cleaned key tokens and raw next tokens share one vocabulary
+        self._vocab: List[str] = []
+        self._token_ids: Dict[str, int] = {}
+        # pair key -> [original token id, next token ids, counts]
+        self._table: Dict[int, list] = {}
+        # pair key -> cumulative counts for sampling; dropped whenever the key changes
+        self._cumulative: Dict[int, array] = {}
+        # flat arrays for generate_many; dropped whenever the table changes
+        self._batch: Optional[dict] = None
+        # start-state indexes: every key (uniform picks) and keys that began a sentence, by count
+        self._keys = _KeyIndex()
+        self._starts = _WeightedKeys()
+        self.order: Optional[int] = None
+        self._trie: Optional[_NgramTrie] = None
+        # raw token id -> cleaned token id, for walking the trie during generation
+        self._clean_ids: Dict[int, int] = {}
+        self.set_order(order)
+        if isinstance(word_list, dict):
+            self._import_word_list(word_list)
+
+    def __len__(self) -> int:
+        return len(self._table)
+
+    def approx_nbytes(self) -> int:
+        """Rough resident size of the model, for memory budgets."""
+        return 400 * len(self._table) + (160 * self._trie.nodes if self._trie is not None else 0)
+
+    @property
+    def word_list(self) -> Dict[str, Dict[str, Any]]:
+        """Dict-shaped copy of the model, built on each access (use len(model) for the key count)."""
+        vocab = self._vocab
+        return {
+            f"{vocab[key >> 32]} {vocab[key & _ID_MASK]}": {
+                "original": vocab[orig],
+                "counts": {vocab[n]: c for n, c in zip(nexts, counts)}
+            }
+            for key, (orig, nexts, counts) in self._table.items()
+        }
+
+    @word_list.setter
+    def word_list(self, word_list: Dict[str, Dict[str, Any]]):
+        self.__init__(word_list, self.order)
+
+    def set_order(self, order: Optional[int], texts: Iterable[Any] = ()) -> None:
+        """Switch the n-gram order (None = strict 2-gram table only); the trie is retrained on texts.
+        Raises ValueError for an order outside 1..MAX_ORDER.
+        """
+        if order is not None and not 1 <= int(order) <= MAX_ORDER:
+            raise ValueError(f"order must be between 1 and {MAX_ORDER}")
+        self.order = int(order) if order is not None else None
+        self._trie = _NgramTrie(self.order) if self.order else None
+        if self._trie is None:
+            return
+        for item in texts:
+            tw = _text_and_weight(item)
+            if tw is None:
+                continue
+            text, weight = tw
+            for sentence in _sentences(text):
+                raw_tokens = sentence.split()
+                self._trie_update(raw_tokens, [_clean_token_cached(t) for t in raw_tokens], weight)
 
-    def generate_dictionary(self, texts: List[Any]) -> None:
+    # ---------------- snapshots ----------------
+    def dumps(self, fingerprint: Tuple[int, int] = (0, 0)) -> bytes:
+        """Serialize the model to the versioned binary snapshot format.
+        fingerprint is the corpus_fingerprint of the texts the model was trained on.
+        """
+        return self._seal(*self._dump_body(), fingerprint)
+
+    def _dump_body(self) -> Tuple[bytes, int]:
+        """Uncompressed snapshot body and flags: the part of dumps() that reads the model."""
+        # only tokens still referenced are written, in first-use order
+        remap: Dict[int, int] = {}
+        def sid(i: int) -> int:
+            j = remap.get(i)
+            if j is None:
+                j = remap[i] = len(remap)
+            return j
+
+        k1s, k2s, originals, lengths = array("I"), array("I"), array("I"), array("I")
+        nexts, counts, starts = array("I"), array("I"), array("I")
+        for key, (orig, row_nexts, row_counts) in self._table.items():
+            starts.append(self._starts.get(key))
+            k1s.append(sid(key >> 32))
+            k2s.append(sid(key & _ID_MASK))
+            originals.append(sid(orig))
+            lengths.append(len(row_nexts))
+            nexts.extend(sid(n) for n in row_nexts)
+            counts.extend(row_counts)
+        # the trie section goes last but must be built before the string table is final
+        flags, trie = 0, b""
+        if self._trie is not None:
+            flags |= _FLAG_TRIE
+            trie = self._dump_trie(sid)
+
+        encoded = [self._vocab[i].encode("utf-8", "surrogatepass") for i in remap]
+        str_lens = array("I", (len(b) for b in encoded))
+        body = b"".join([
+            struct.pack("<II", len(encoded), len(k1s)),
+            _le_bytes(str_lens), b"".join(encoded),
+            _le_bytes(k1s), _le_bytes(k2s), _le_bytes(originals), _le_bytes(lengths),
+            _le_bytes(nexts), _le_bytes(counts), _le_bytes(starts), trie,
+        ])
+        return body, flags
+
+    @staticmethod
+    def _seal(body: bytes, flags: int, fingerprint: Tuple[int, int]) -> bytes:
+        """Compress a _dump_body() result into a snapshot; touches no model state."""
+        body = zlib.compress(body, 6)
+        count, total = fingerprint
+        header = _MODEL_HEADER.pack(MODEL_MAGIC, MODEL_VERSION, flags, count, total & _FINGERPRINT_MASK,
+                                    zlib.crc32(body))
+        return header + body
+
+    @classmethod
+    def loads(cls, data: bytes) -> Tuple["MarkovChains", Tuple[int, int]]:
+        """Parse a binary snapshot. Returns (model, corpus fingerprint); raises ValueError if unusable."""
+        if data[:4] == b"MKDL":
+            # delta snapshot of a memory-mapped model
+            from mapped_chains import MappedChains
+            return MappedChains.loads(data)
+        if len(data) < _MODEL_HEADER.size:
+            raise ValueError("truncated model snapshot")
+        magic, version, flags, count, total, crc = _MODEL_HEADER.unpack_from(data)
+        if magic != MODEL_MAGIC:
+            raise ValueError("not a model snapshot")
+        if version not in (1, 2, 3, MODEL_VERSION):
+            raise ValueError(f"unsupported model snapshot version {version}")
+        body = data[_MODEL_HEADER.size:]
+        if zlib.crc32(body) != crc:
+            raise ValueError("model snapshot checksum mismatch")
+        body = zlib.decompress(body)
+
+        n_strings, n_keys = struct.unpack_from("<II", body)
+        pos = 8
+        str_lens = _le_array("I", body[pos:pos + 4 * n_strings])
+        pos += 4 * n_strings
+        strings = []
+        for n in str_lens:
+            strings.append(body[pos:pos + n].decode("utf-8", "surrogatepass"))
+            pos += n
+
+        def take(n: int) -> array:
+            nonlocal pos
+            values = _le_array("I", body[pos:pos + 4 * n])
+            pos += 4 * n
+            return values
+
+        if version < 3:
+            return cls._loads_string_keys(version, strings, take, n_keys), (count, total)
+
+        k1s, k2s, originals, lengths = take(n_keys), take(n_keys), take(n_keys), take(n_keys)
+        n_nexts = sum(lengths)
+        nexts, counts = take(n_nexts), take(n_nexts)
+        # version 3 did not record sentence starts
+        starts = take(n_keys) if version >= 4 else None
+        model = cls()
+        model._vocab = strings
+        model._token_ids = {s: i for i, s in enumerate(strings)}
+        table = model._table
+        off = 0
+        for j, (k1, k2, orig, n) in enumerate(zip(k1s, k2s, originals, lengths)):
+            key = (k1 << 32) | k2
+            table[key] = [orig, nexts[off:off + n], counts[off:off + n]]
+            model._keys.add(key)
+            if starts is not None and starts[j]:
+                model._starts.add(key, starts[j])
+            off += n
+        if flags & _FLAG_TRIE:
+            model._load_trie(body, pos)
+        return model, (count, total)
+
+    @classmethod
+    def _loads_string_keys(cls, version: int, strings: List[str], take, n_keys: int) -> "MarkovChains":
+        """Versions 1-2 keyed transitions by "w1 w2" strings; version 1 stored every occurrence."""
+        keys, originals, lengths = take(n_keys), take(n_keys), take(n_keys)
+        n_nexts = sum(lengths)
+        nexts = take(n_nexts)
+        counts = take(n_nexts) if version >= 2 else None
+        word_list: Dict[str, Dict[str, Any]] = {}
+        off = 0
+        for k, o, n in zip(keys, originals, lengths):
+            table: Dict[str, int] = {}
+            for j in range(off, off + n):
+                w = strings[nexts[j]]
+                table[w] = table.get(w, 0) + (counts[j] if counts is not None else 1)
+            word_list[strings[k]] = {"original": strings[o], "counts": table}
+            off += n
+        return cls(word_list)
+
+    @classmethod
+    def load(cls, path: str) -> Tuple["MarkovChains", Tuple[int, int]]:
+        """Read a snapshot file written from dumps(); raises OSError/ValueError if missing or corrupt."""
+        with open(path, "rb") as f:
+            return cls.loads(f.read())
+
+    def generate_dictionary(self, texts: Iterable[Any]) -> None:
         """
         Build dictionary from texts.
-        Accepts list[str] (legacy) or list[dict] entries like {"text": "...", "weight": N}.
+        Accepts list[str] (legacy), list[dict] entries like {"text": "...", "weight": N},
+        or any iterable of (text, weight) pairs such as TextStore.iter_weighted().
         For strict 2-gram: keys are "word1 word2" and next is word3.
         """
-        self.word_list = {}
-        if not texts:
-            return
+        self.__init__(order=self.order)
+        if texts:
+            self.ingest(texts)
 
+    def ingest(self, texts: Iterable[Any]) -> int:
+        """Train on a batch of texts (same item forms as generate_dictionary) on top of the current model.
+        Returns the number of texts ingested.
+        """
+        n = 0
         for item in texts:
-            if isinstance(item, str):
-                text = item
-                weight = 1
-            elif isinstance(item, dict):
-                text = item.get("text", "") or ""
-                try:
-                    weight = max(1, int(item.get("weight", 1)))
-                except Exception:
-                    weight = 1
-            else:
-                try:
-                    text = str(item)
-                    weight = 1
-                except Exception:
-                    continue
+            tw = _text_and_weight(item)
+            if tw is None:
+                continue
+            text, weight = tw
+            # weight is added to the transition counts in a single pass
+            self._pick_sentence_words(text, weight)
+            n += 1
+        return n
 
-            # apply weight by repeating _pick_sentence_words; simple and effective
-            for _ in range(weight):
-                self._pick_sentence_words(text)
+    def add_text(self, text: str, weight: int = 1) -> None:
+        """Train on one text, counting its transitions weight times."""
+        self._pick_sentence_words(text, max(1, int(weight)))
 
-    def generate_chain(self, max_words: int) -> str:
+    def remove_text(self, text: str, weight: int = 1) -> None:
+        """Undo add_text(text, weight) in O(tokens), dropping keys that end up with no transitions."""
+        self._unpick_sentence_words(text, max(1, int(weight)))
+
+    def merge(self, other: "MarkovChains") -> None:
+        """Add another model's counts to this one, e.g. partial models built over chunks of a corpus.
+        Merging the partials of consecutive chunks in corpus order gives exactly the serial build:
+        the same counts, sentence starts and n-gram trie, and each key keeps its first original token.
+        Raises ValueError when the orders differ.
         """
-        Generate text up to max_words tokens using strict 2-gram model.
+        if other.order != self.order:
+            raise ValueError("cannot merge models of different orders")
+        remap = array("I", [self._intern(token) for token in other._vocab])
+        table = self._table
+        for key, (orig, nexts, counts) in other._table.items():
+            key = (remap[key >> 32] << 32) | remap[key & _ID_MASK]
+            row = table.get(key)
+            if row is None:
+                table[key] = [remap[orig], array("I", [remap[n] for n in nexts]), array("I", counts)]
+                self._keys.add(key)
+                continue
+            mine, mine_counts = row[1], row[2]
+            for n, c in zip(nexts, counts):
+                n = remap[n]
+                try:
+                    mine_counts[mine.index(n)] += c
+                except ValueError:
+                    mine.append(n)
+                    mine_counts.append(c)
+            self._cumulative.pop(key, None)
+        for key, c in zip(other._starts.keys, other._starts.counts):
+            self._starts.add((remap[key >> 32] << 32) | remap[key & _ID_MASK], c)
+        if self._trie is not None:
+            self._trie.merge(other._trie, remap)
+        self._batch = None
+        self.version += other.version
+
+    def generate_chain(self, max_words: int, sentence_starts: Optional[bool] = None) -> str:
+        """
+        Generate text up to max_words tokens using strict 2-gram model, or with an order set,
+        from the longest context in the n-gram trie that matches the last tokens.
+        The starting key is uniform over all keys, or with sentence_starts (default SENTENCE_STARTS)
+        drawn from keys that began a sentence, weighted by how often, and shown with its original token.
         If model has no keys, returns empty string.
         """
-        if not self.word_list:
-            return ""
-
-        keys = list(self.word_list.keys())
-        if not keys:
+        if not self._table:
             return ""
+        if sentence_starts is None:
+            sentence_starts = SENTENCE_STARTS
+        return self._walk(max_words, sentence_starts, random)
 
-        # pick a starting key that has an 'original' token
-        key = random.choice(keys)
-        parts = key.split(" ", 1)
-        if len(parts) != 2:
-            return ""
+    def generate_many(self, n: int, max_words: Union[int, Sequence[int]], seed: Optional[int] = None,
+                      sentence_starts: Optional[bool] = None, vectorized: Optional[bool] = None) -> List[str]:
+        """Generate n filtered sentences like generate_chain; max_words is one limit or one per sentence.
+        With NumPy installed (and n >= VECTORIZE_MIN_CHAINS, or vectorized=True) the 2-gram chains advance
+        in lockstep over flat transition arrays, one vectorized draw per step for all of them; otherwise,
+        and when an order is set (trie backoff), each chain is walked in Python.
+        The same seed gives the same sentences for the same model and path; seed=None is unseeded.
+        """
+        limits = [int(max_words)] * n if isinstance(max_words, int) else [int(m) for m in max_words]
+        if len(limits) != n:
+            raise ValueError("max_words must be an int or have n entries")
+        if not self._table or n <= 0:
+            return [""] * max(0, n)
+        if sentence_starts is None:
+            sentence_starts = SENTENCE_STARTS
+        if vectorized is None:
+            vectorized = np is not None and n >= VECTORIZE_MIN_CHAINS
+        if vectorized and np is not None and self._trie is None:
+            return self._generate_vectorized(limits, seed, sentence_starts)
+        rng = random.Random(seed)
+        return [self._walk(limit, sentence_starts, rng) for limit in limits]
 
-        w1, w2 = parts[0], parts[1]
-        generated = [w1, w2]
+    # ---------------- internal helpers ----------------
+    def _walk(self, max_words: int, sentence_starts: bool, rng) -> str:
+        """One chain (the model must have keys); rng is the random module or a random.Random."""
+        if sentence_starts and self._starts.total:
+            key = self._starts.choice(rng)
+            first = self._table[key][0]
+        else:
+            key = self._keys.choice(rng)
+            first = key >> 32
+        # generation walks token ids; the displayed first token is swapped in at the end
+        generated = [key >> 32, key & _ID_MASK]
 
+        trie = self._trie
         for _ in range(max(0, int(max_words) - 2)):
-            cur_key = f"{generated[-2]} {generated[-1]}"
-            entry = self.word_list.get(cur_key)
-            if not entry or not entry.get("list"):
+            if trie is None:
+                nxt = self._sample_next((generated[-2] << 32) | generated[-1], rng)
+            else:
+                node = trie.deepest(self._clean_id(generated[-d]) for d in range(1, min(trie.order, len(generated)) + 1))
+                nxt = node.sample(rng) if node is not None else -1
+            if nxt < 0:
                 break
-            next_word = random.choice(entry["list"])
-            generated.append(next_word)
+            generated.append(nxt)
 
-        return self._filter_generated_text(" ".join(generated))
+        generated[0] = first
+        vocab = self._vocab
+        return self._filter_generated_text(" ".join([vocab[i] for i in generated]))
 
-    # ---------------- internal helpers ----------------
-    def _pick_sentence_words(self, text: str) -> None:
-        """Split text into sentences and feed each sentence to _pick_words_sentence."""
-        if not text:
+    def _batch_tables(self) -> dict:
+        """The 2-gram table as flat NumPy arrays (CSR: one row per key), cached until the model changes."""
+        if self._batch is not None:
+            return self._batch
+        rows = list(self._table.values())
+        keys = np.fromiter(self._table.keys(), dtype=np.uint64, count=len(rows))
+        lengths = np.fromiter((len(row[1]) for row in rows), dtype=np.int64, count=len(rows))
+        nexts = np.concatenate([np.frombuffer(row[1], dtype=np.uint32) for row in rows]).astype(np.int64)
+        counts = np.concatenate([np.frombuffer(row[2], dtype=np.uint32) for row in rows])
+        # running count total over all transitions, with a leading 0: row r spans cum[offsets[r]:offsets[r + 1]]
+        cum = np.concatenate(([0], np.cumsum(counts, dtype=np.int64)))
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+        # row reached by each transition: key (k2, next), or -1 where the chain ends
+        follow = ((np.repeat(keys, lengths) & _ID_MASK) << np.uint64(32)) | nexts.astype(np.uint64)
+        order = np.argsort(keys)
+        sorted_keys = keys[order]
+        pos = np.minimum(np.searchsorted(sorted_keys, follow), len(keys) - 1)
+        next_rows = np.where(sorted_keys[pos] == follow, order[pos], -1)
+        starts = np.fromiter((self._starts.get(int(k)) for k in keys), dtype=np.int64, count=len(rows))
+        self._batch = {
+            "k1": (keys >> np.uint64(32)).astype(np.int64),
+            "k2": (keys & _ID_MASK).astype(np.int64),
+            "orig": np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows)),
+            "offsets": offsets, "cum": cum, "nexts": nexts, "next_rows": next_rows,
+            "starts_cum": np.cumsum(starts),
+        }
+        return self._batch
+
+    def _generate_vectorized(self, limits: List[int], seed: Optional[int], sentence_starts: bool) -> List[str]:
+        t = self._batch_tables()
+        rng = np.random.default_rng(seed)
+        n, width = len(limits), max(2, max(limits))
+        limit = np.asarray(limits, dtype=np.int64)
+        if sentence_starts and t["starts_cum"][-1] > 0:
+            rows = np.searchsorted(t["starts_cum"], rng.integers(0, t["starts_cum"][-1], n), side="right")
+            first = t["orig"][rows]
+        else:
+            rows = rng.integers(0, len(t["k1"]), n)
+            first = t["k1"][rows]
+        out = np.full((n, width), -1, dtype=np.int64)
+        out[:, 0] = first
+        out[:, 1] = t["k2"][rows]
+        live = np.arange(n)
+        cum, offsets = t["cum"], t["offsets"]
+        for step in range(2, width):
+            live = live[limit[live] > step]
+            if not len(live):
+                break
+            r = rows[live]
+            lo, hi = cum[offsets[r]], cum[offsets[r + 1]]
+            # one draw per live chain, located among all transitions at once
+            j = np.searchsorted(cum, lo + rng.integers(0, hi - lo), side="right") - 1
+            out[live, step] = t["nexts"][j]
+            rows[live] = t["next_rows"][j]
+            live = live[rows[live] >= 0]
+        vocab = self._vocab
+        return [self._filter_generated_text(" ".join([vocab[i] for i in chain if i >= 0])) for chain in out.tolist()]
+
+    def _intern(self, token: str) -> int:
+        i = self._token_ids.get(token)
+        if i is None:
+            i = self._token_ids[token] = len(self._vocab)
+            self._vocab.append(token)
+        return i
+
+    def _import_word_list(self, word_list: Dict[str, Dict[str, Any]]) -> None:
+        for key, entry in word_list.items():
+            parts = key.split(" ", 1) if isinstance(key, str) else []
+            if len(parts) != 2 or not isinstance(entry, dict):
+                continue
+            counts = entry.get("counts")
+            if not isinstance(counts, dict):
+                counts = {}
+                for w in entry.get("list", []) or []:
+                    counts[w] = counts.get(w, 0) + 1
+            original = entry.get("original", "")
+            for w, n in counts.items():
+                if n > 0:
+                    self._count(parts[0], parts[1], original, w, n)
+
+    def _count(self, k1: str, k2: str, first_raw: str, nxt_raw: str, weight: int, start: bool = False) -> None:
+        """Add weight to the (k1, k2) -> nxt_raw transition (and to the key's sentence starts)."""
+        key = (self._intern(k1) << 32) | self._intern(k2)
+        nxt = self._intern(nxt_raw)
+        row = self._table.get(key)
+        if row is None:
+            # store original as the raw first token (so starts look natural)
+            row = self._table[key] = [self._intern(first_raw), array("I"), array("I")]
+            self._keys.add(key)
+        if start:
+            self._starts.add(key, weight)
+        nexts, counts = row[1], row[2]
+        try:
+            counts[nexts.index(nxt)] += weight
+        except ValueError:
+            nexts.append(nxt)
+            counts.append(weight)
+        self._cumulative.pop(key, None)
+        self._batch = None
+
+    def _uncount(self, k1: str, k2: str, nxt_raw: str, weight: int, start: bool = False) -> None:
+        """Subtract weight from the (k1, k2) -> nxt_raw transition; unknown tokens are ignored."""
+        ids = self._token_ids
+        a, b, nxt = ids.get(k1), ids.get(k2), ids.get(nxt_raw)
+        if a is None or b is None or nxt is None:
+            return
+        key = (a << 32) | b
+        row = self._table.get(key)
+        if row is None:
+            return
+        self._batch = None
+        if start:
+            self._starts.add(key, -weight)
+        nexts, counts = row[1], row[2]
+        try:
+            j = nexts.index(nxt)
+        except ValueError:
             return
-        # naive sentence split but effective for chat-like data
-        sentences = _sentence_split_re.split(text)
-        for s in sentences:
-            s = s.strip()
-            if not s:
+        if counts[j] > weight:
+            counts[j] -= weight
+        else:
+            del nexts[j]
+            del counts[j]
+        self._cumulative.pop(key, None)
+        if not nexts:
+            del self._table[key]
+            self._keys.discard(key)
+            self._starts.add(key, -self._starts.get(key))
+
+    def _filter_generated_text(self, text: str) -> str:
+        return _filter_generated_text(text)
+
+    def _key_id(self, k1: str, k2: str) -> Optional[int]:
+        """Pair key of (k1, k2) if both tokens are known (the key may have no row)."""
+        a, b = self._token_ids.get(k1), self._token_ids.get(k2)
+        return None if a is None or b is None else (a << 32) | b
+
+    def _row_for(self, k1: str, k2: str) -> Optional[list]:
+        key = self._key_id(k1, k2)
+        return None if key is None else self._table.get(key)
+
+    def _sample_next(self, key: int, rng=random) -> int:
+        """Draw a next token id for key in proportion to its count, or -1 if key has no transitions."""
+        row = self._table.get(key)
+        if row is None:
+            return -1
+        cum = self._cumulative.get(key)
+        if cum is None:
+            cum = self._cumulative[key] = array("Q", accumulate(row[2]))
+        return row[1][bisect_right(cum, rng.randrange(cum[-1]))]
+
+    def _clean_id(self, token_id: int) -> int:
+        """Id of the cleaned form of a (raw) token id, or -1 if that form never keyed a context."""
+        cid = self._clean_ids.get(token_id)
+        if cid is None:
+            cid = self._token_ids.get(_clean_token_cached(self._vocab[token_id]), -1)
+            if cid >= 0:
+                self._clean_ids[token_id] = cid
+        return cid
+
+    def _trie_update(self, raw_tokens: List[str], cleaned: List[str], weight: int) -> None:
+        """Add (weight > 0) or subtract every context -> next transition of one sentence in the trie."""
+        trie = self._trie
+        ids = self._token_ids
+        if weight > 0:
+            context_ids = [self._intern(c) if c else -1 for c in cleaned]
+        else:
+            context_ids = [ids.get(c, -1) if c else -1 for c in cleaned]
+        for j in range(1, len(raw_tokens)):
+            context = []
+            for k in range(j - 1, max(-1, j - 1 - trie.order), -1):
+                if context_ids[k] < 0:
+                    break
+                context.append(context_ids[k])
+            if not context:
                 continue
-            self._pick_words_sentence(s)
+            if weight > 0:
+                trie.add(context, self._intern(raw_tokens[j]), weight)
+            else:
+                nxt = ids.get(raw_tokens[j])
+                if nxt is not None:
+                    trie.remove(context, nxt, -weight)
+
+    def _dump_trie(self, sid) -> bytes:
+        """Trie section of a snapshot: order, node count, then nodes in preorder
+        (context token, child count, next count) followed by the flattened next ids and counts."""
+        toks, n_children, lengths, nexts, counts = array("I"), array("I"), array("I"), array("I"), array("I")
+        stack = [(0, self._trie.root)]
+        while stack:
+            tok, node = stack.pop()
+            toks.append(tok)
+            children = node.children or {}
+            n_children.append(len(children))
+            lengths.append(len(node.nexts))
+            nexts.extend(sid(n) for n in node.nexts)
+            counts.extend(node.counts)
+            stack.extend((sid(t), child) for t, child in reversed(list(children.items())))
+        return b"".join([
+            struct.pack("<II", self._trie.order, len(toks)),
+            _le_bytes(toks), _le_bytes(n_children), _le_bytes(lengths), _le_bytes(nexts), _le_bytes(counts),
+        ])
 
-    def _pick_words_sentence(self, sentence: str) -> None:
-        """Tokenize a sentence and record 2-gram->next_word transitions.
-        Uses cleaned tokens for keys but stores original token strings in value lists
+    def _load_trie(self, body: bytes, pos: int) -> None:
+        order, n_nodes = struct.unpack_from("<II", body, pos)
+        pos += 8
+        def take(n: int) -> array:
+            nonlocal pos
+            values = _le_array("I", body[pos:pos + 4 * n])
+            pos += 4 * n
+            return values
+        toks, n_children, lengths = take(n_nodes), take(n_nodes), take(n_nodes)
+        n_nexts = sum(lengths)
+        nexts, counts = take(n_nexts), take(n_nexts)
+        trie = _NgramTrie(order)
+        # rebuild from preorder: the stack holds (node, children still to attach)
+        off = 0
+        stack: List[list] = []
+        for j in range(n_nodes):
+            node = trie.root if j == 0 else _TrieNode()
+            node.nexts = nexts[off:off + lengths[j]]
+            node.counts = counts[off:off + lengths[j]]
+            off += lengths[j]
+            if stack:
+                parent = stack[-1]
+                if parent[0].children is None:
+                    parent[0].children = {}
+                parent[0].children[toks[j]] = node
+                parent[1] -= 1
+                if not parent[1]:
+                    stack.pop()
+            if n_children[j]:
+                stack.append([node, n_children[j]])
+        trie.nodes = n_nodes
+        self.order = order
+        self._trie = trie
+
+    def _pick_sentence_words(self, text: str, weight: int = 1) -> None:
+        """Split text into sentences and feed each sentence to _pick_words_sentence."""
+        self.version += 1
+        for s in _sentences(text):
+            self._pick_words_sentence(s, weight)
+
+    def _pick_words_sentence(self, sentence: str, weight: int = 1) -> None:
+        """Tokenize a sentence and add weight to each 2-gram->next_word transition count
+        (and to the n-gram trie when an order is set).
+        Uses cleaned tokens for keys but counts original token strings
         so generated output preserves emojis and original formatting.
         """
-        # split into raw tokens first
-        raw_tokens = [t for t in _word_split_re.split(sentence.strip()) if t != ""]
-        if len(raw_tokens) < 3:
-            return  # need at least 3 tokens for a single 2-gram -> next mapping
-
-        # produce cleaned tokens for keying
-        cleaned = [_clean_token(t) for t in raw_tokens]
-        # filter paired positions where cleaned tokens are empty
-        # we still need length >=3 in cleaned to form at least one mapping
-        # construct indices of usable tokens (non-empty cleaned)
-        usable_indices = [i for i, c in enumerate(cleaned) if c != ""]
-
-        # We require at least 3 usable cleaned tokens sequentially to map k1 k2 -> next
-        # Iterate original indices but skip if cleaning removed tokens in between
-        for i in range(len(raw_tokens) - 2):
-            k1_clean = _clean_token(raw_tokens[i])
-            k2_clean = _clean_token(raw_tokens[i + 1])
-            nxt_raw = raw_tokens[i + 2]  # preserve raw token (with angle brackets if emoji)
-            # must have non-empty cleaned keys to be useful
-            if not k1_clean or not k2_clean:
-                continue
-            key = f"{k1_clean} {k2_clean}"
-            if key not in self.word_list:
-                # store original as the raw first token (so starts look natural)
-                self.word_list[key] = {"original": raw_tokens[i], "list": []}
-            # append the raw next-token, not the cleaned one, to preserve emoji and formatting
-            self.word_list[key]["list"].append(nxt_raw)
-    def _remove_unclosed_quotes(self, text: str, char: str) -> str:
-        c = text.count(char)
-        if c % 2 != 0:
-            # remove last unmatched
-            idx = text.rfind(char)
-            if idx >= 0:
-                text = text[:idx] + text[idx+1:]
-        return text
-
-    def _remove_unclosed_pairs(self, text: str, open_ch: str, close_ch: str) -> str:
-        count = 0
-        for i, ch in enumerate(text):
-            if ch == open_ch:
-                count += 1
-            elif ch == close_ch:
-                count -= 1
-            if count < 0:
-                # remove this unmatched close and restart
-                text = text[:i] + text[i+1:]
-                return self._remove_unclosed_pairs(text, open_ch, close_ch)
-        if count > 0:
-            # remove first unmatched open and restart
-            for i, ch in enumerate(text):
-                if ch == open_ch:
-                    text = text[:i] + text[i+1:]
-                    return self._remove_unclosed_pairs(text, open_ch, close_ch)
-        return text
+        raw_tokens = sentence.split()
+        cleaned = [_clean_token_cached(t) for t in raw_tokens]
+        for i, k1, k2, first_raw, nxt_raw in _token_transitions(raw_tokens, cleaned):
+            self._count(k1, k2, first_raw, nxt_raw, weight, i == 0)
+        if self._trie is not None:
+            self._trie_update(raw_tokens, cleaned, weight)
+
+    def _unpick_sentence_words(self, text: str, weight: int = 1) -> None:
+        """Inverse of _pick_sentence_words: subtract weight from each transition of text."""
+        self.version += 1
+        for s in _sentences(text):
+            raw_tokens = s.split()
+            cleaned = [_clean_token_cached(t) for t in raw_tokens]
+            for i, k1, k2, _first_raw, nxt_raw in _token_transitions(raw_tokens, cleaned):
+                self._uncount(k1, k2, nxt_raw, weight, i == 0)
+            if self._trie is not None:
+                self._trie_update(raw_tokens, cleaned, -weight)
@@ -0,0 +1,98 @@
+# model_builder.py
+import os
+import sys
+import time
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Iterable, List, Optional, Tuple
+from markov_chains import MarkovChains, corpus_fingerprint
+from mapped_chains import MappedChains, export_map, maybe_map
+
+# worker processes for model builds (kept alive between builds)
+TRAIN_WORKERS = max(1, int(os.getenv("MARKOV_TRAIN_WORKERS", "2")))
+# corpora smaller than this are built in one piece; shipping chunks and partial models costs more than it saves
+PARALLEL_MIN_TEXTS = int(os.getenv("MARKOV_PARALLEL_MIN_TEXTS", "20000"))
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+def executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=TRAIN_WORKERS)
+    return _executor
+
+def _build(texts: List[Tuple[str, int]], order: Optional[int]) -> MarkovChains:
+    # runs in a worker process; the model is pickled back to the parent
+    markov = MarkovChains({}, order)
+    markov.generate_dictionary(texts)
+    return markov
+
+def _build_mapped(texts: List[Tuple[str, int]], directory: str) -> str:
+    # runs in a worker process; only the path of the written map file comes back
+    return export_map(_build(texts, None), directory, corpus_fingerprint(texts))
+
+def _chunks(texts: List[Tuple[str, int]], parts: int) -> List[List[Tuple[str, int]]]:
+    """Split into consecutive chunks, so merging the partial models in order matches a serial build."""
+    if parts <= 1 or len(texts) < PARALLEL_MIN_TEXTS:
+        return [texts]
+    size = -(-len(texts) // parts)
+    return [texts[i:i + size] for i in range(0, len(texts), size)]
+
+def merge_models(parts: List[MarkovChains]) -> MarkovChains:
+    """Reduce step: fold the partial models, in chunk order, into the first."""
+    markov = parts[0]
+    for part in parts[1:]:
+        markov.merge(part)
+    return markov
+
+def rebuild(texts: Iterable[Tuple[str, int]], order: Optional[int] = None,
+            workers: Optional[int] = None, pool: Optional[Executor] = None) -> MarkovChains:
+    """Blocking map-reduce build: partial models over corpus chunks on the worker processes, merged here.
+    Small corpora (or workers=1) are built in this process.
+    """
+    texts = list(texts)
+    workers = TRAIN_WORKERS if workers is None else max(1, workers)
+    chunks = _chunks(texts, workers)
+    if len(chunks) == 1:
+        return _build(texts, order)
+    pool = pool or executor()
+    return merge_models(list(pool.map(_build, chunks, [order] * len(chunks))))
+
+async def build_model(texts: List[Tuple[str, int]], order: Optional[int] = None) -> MarkovChains:
+    """Train a fresh model on (text, weight) pairs in worker processes without blocking the event loop.
+    Large corpora are split over TRAIN_WORKERS and the partial models merged in a thread.
+    """
+    loop = asyncio.get_running_loop()
+    chunks = _chunks(texts, TRAIN_WORKERS)
+    parts = await asyncio.gather(*(loop.run_in_executor(executor(), _build, chunk, order) for chunk in chunks))
+    if len(parts) == 1:
+        return parts[0]
+    return await asyncio.to_thread(merge_models, list(parts))
+
+async def build_mapped(texts: List[Tuple[str, int]], directory: str) -> MappedChains:
+    """Train a strict 2-gram model in a worker process and write it as a map file in directory;
+    the model never crosses the process boundary, the returned MappedChains maps the file.
+    """
+    loop = asyncio.get_running_loop()
+    return MappedChains(await loop.run_in_executor(executor(), _build_mapped, texts, directory))
+
+if __name__ == "__main__":
+    # python model_builder.py [--workers N] [guild_id ...]  -> rebuild and save the models of the
+    # given guilds (default: all stored guilds); run it while the bot is stopped
+    args = sys.argv[1:]
+    workers = None
+    if args[:1] == ["--workers"] and len(args) > 1 and args[1].isdigit():
+        workers, args = int(args[1]), args[2:]
+    if any(not a.isdigit() for a in args):
+        print("usage: python model_builder.py [--workers N] [guild_id ...]")
+        raise SystemExit(2)
+    from db_json import db
+    for gid in args or db.guild_ids():
+        guild_db = db.fetch(gid)
+        started = time.perf_counter()
+        with guild_db._lock:
+            markov = rebuild(guild_db._training_texts(), guild_db.get_markov_order(), workers)
+            guild_db._swap_model(maybe_map(markov, db._model_dir(gid)))
+        guild_db.save_markov()
+        print(f"{gid}: {len(guild_db.markov)} keys in {time.perf_counter() - started:.1f}s")
+    db.flush()
@@ -0,0 +1,141 @@
+# sentence_pool.py
+import os
+import random
+import asyncio
+import logging
+import weakref
+from collections import deque
+from typing import Dict, Optional, Set
+
+# ready sentences kept per guild, and how many are generated per worker-thread batch
+POOL_SIZE = int(os.getenv("MARKOV_POOL_SIZE", "32"))
+POOL_BATCH = 8
+# seconds before a refill that found the guild lock busy is retried
+POOL_RETRY_DELAY = 0.05
+# a pool is dropped once this many texts were trained into / evicted from the model since it was filled
+POOL_MAX_STALENESS = int(os.getenv("MARKOV_POOL_MAX_STALENESS", "100"))
+# reply length range used by the chatbot cog
+MIN_WORDS, MAX_WORDS = 5, 40
+
+logger = logging.getLogger("sentence_pool")
+
+class _Pool:
+    __slots__ = ("guild_db", "model", "version", "order", "unlearned", "sentences")
+
+    def __init__(self, guild_db, model, on_dead=None):
+        self.guild_db = weakref.ref(guild_db, on_dead)
+        self.model = weakref.ref(model)
+        self.version = model.version
+        self.order = model.order
+        self.unlearned = guild_db.unlearn_generation
+        self.sentences = deque()
+
+    def is_stale(self, guild_db) -> bool:
+        model = guild_db.markov
+        return (self.model() is not model or self.order != model.order
+                or self.unlearned != guild_db.unlearn_generation
+                or model.version - self.version > POOL_MAX_STALENESS)
+
+class SentencePool:
+    """Per-guild pools of pre-generated, already filtered sentences.
+    pop() is called on the reply path; a background task refills pools off the event loop. Each walk
+    holds the guild lock so the model is not changed mid-walk, but the lock is only taken when free
+    and released between sentences, so event-loop writers wait for one walk at most.
+    A pool is discarded when the guild's model is replaced, changes order, unlearns a message or
+    author, or has drifted by POOL_MAX_STALENESS texts.
+    """
+    def __init__(self, size: int = POOL_SIZE):
+        self.size = size
+        self._pools: Dict[str, _Pool] = {}
+        self._wanted: Set[str] = set()
+        self._event = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None and self.size > 0:
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def pop(self, guild_db) -> Optional[str]:
+        """A ready sentence for the guild, or None if its pool is empty (a refill is scheduled either way)."""
+        if self.size <= 0:
+            return None
+        pool = self._current(guild_db)
+        sentence = pool.sentences.popleft() if pool.sentences else None
+        if len(pool.sentences) < self.size:
+            self._want(guild_db.guild_id)
+        return sentence
+
+    # ---------------- internals ----------------
+    def _current(self, guild_db) -> _Pool:
+        pool = self._pools.get(guild_db.guild_id)
+        model = guild_db.markov
+        if pool is None or pool.guild_db() is not guild_db or pool.is_stale(guild_db):
+            gid = guild_db.guild_id
+            # an unloaded or removed guild takes its pool with it
+            pool = self._pools[gid] = _Pool(guild_db, model, lambda ref: self._drop(gid, ref))
+        return pool
+
+    def _drop(self, gid: str, ref):
+        pool = self._pools.get(gid)
+        if pool is not None and pool.guild_db is ref:
+            del self._pools[gid]
+
+    def _want(self, gid: str):
+        self._wanted.add(gid)
+        self._event.set()
+
+    async def _run(self):
+        while True:
+            await self._event.wait()
+            self._event.clear()
+            while self._wanted:
+                await self._refill(self._wanted.pop())
+
+    async def _refill(self, gid: str):
+        pool = self._pools.get(gid)
+        guild_db = pool.guild_db() if pool else None
+        if guild_db is None:
+            if pool is not None:
+                self._drop(gid, pool.guild_db)
+            return
+        try:
+            while len(pool.sentences) < self.size and self._pools.get(gid) is pool:
+                batch = await asyncio.to_thread(self._generate, guild_db, pool)
+                if batch is None:
+                    break
+                if not batch:
+                    # the guild lock was busy; come back once the writer is done
+                    asyncio.get_running_loop().call_later(POOL_RETRY_DELAY, self._want, gid)
+                    break
+                pool.sentences.extend(batch)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception(f"[{gid}] sentence pool refill failed")
+
+    @staticmethod
+    def _generate(guild_db, pool: _Pool) -> Optional[list]:
+        """Worker thread: up to POOL_BATCH sentences, [] if the guild lock was busy before the first one,
+        or None if the pool went stale or the model generates nothing.
+        """
+        out, busy = [], False
+        lock = guild_db._lock
+        for _ in range(POOL_BATCH):
+            if not lock.acquire(blocking=False):
+                busy = True
+                break
+            try:
+                model = guild_db.markov
+                if pool.is_stale(guild_db) or not len(model):
+                    return None
+                sentence = model.generate_many(1, [random.randint(MIN_WORDS, MAX_WORDS)])[0]
+            finally:
+                lock.release()
+            if sentence.strip():
+                out.append(sentence)
+        return out if out or busy else None
@@ -0,0 +1,351 @@
+# text_store.py
+import hashlib
+from array import array
+from bisect import bisect_left
+from typing import Dict, Any, List, Optional, Iterable, Iterator, Tuple
+
+# sources are interned as small ints; unknown ones are added on first use
+DEFAULT_SOURCES = ("channel", "dm", "scan")
+_ID_FIELDS = ("authorId", "messageId")
+
+def _id_to_int(value: Any) -> Optional[int]:
+    """Snowflake string -> int, or None when the value would not round-trip exactly."""
+    if isinstance(value, int) and 0 < value < (1 << 64):
+        return value
+    if isinstance(value, str) and value.isdigit() and not value.startswith("0"):
+        n = int(value)
+        if n < (1 << 64):
+            return n
+    return None
+
+def content_key(text: str) -> int:
+    """Stable 63-bit hash of a text, ignoring case and runs of whitespace, for duplicate detection."""
+    norm = " ".join((text or "").casefold().split()).encode("utf-8", "surrogatepass")
+    return int.from_bytes(hashlib.blake2b(norm, digest_size=8).digest(), "little") >> 1
+
+class TextRow:
+    """Read-only view of one stored entry. Supports the entry-dict style
+    row["text"] / row.get("weight") access as well as attributes."""
+    __slots__ = ("_store", "_i")
+
+    def __init__(self, store: "TextStore", i: int):
+        self._store = store
+        self._i = i
+
+    @property
+    def text(self) -> str:
+        return self._store._texts[self._i]
+
+    @property
+    def author_id(self) -> Optional[str]:
+        return self._store._get_id(0, self._i)
+
+    @property
+    def message_id(self) -> Optional[str]:
+        return self._store._get_id(1, self._i)
+
+    @property
+    def weight(self) -> int:
+        return self._store._weights[self._i]
+
+    @property
+    def source(self) -> str:
+        return self._store._source_names[self._store._sources[self._i]]
+
+    def __getitem__(self, key: str) -> Any:
+        if key == "text":
+            return self.text
+        if key == "authorId":
+            return self.author_id
+        if key == "messageId":
+            return self.message_id
+        if key == "weight":
+            return self.weight
+        if key == "source":
+            return self.source
+        raise KeyError(key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "text": self.text,
+            "authorId": self.author_id,
+            "messageId": self.message_id,
+            "weight": self.weight,
+            "source": self.source
+        }
+
+class TextStore:
+    """Columnar storage for a guild's stored texts.
+    Parallel arrays hold the text, author/message ids as 64-bit ints, weight and an interned source,
+    so an entry costs one str plus ~155 bytes (~40 in the columns, the rest in the messageId index)
+    instead of ~330 bytes for a five-key dict of strings.
+    """
+    def __init__(self, entries: Optional[Iterable[Dict[str, Any]]] = None):
+        self._texts: List[str] = []
+        # author and message ids; 0 marks an id kept verbatim in _odd_ids
+        self._ids = (array("Q"), array("Q"))
+        self._odd_ids: Tuple[Dict[int, Any], Dict[int, Any]] = ({}, {})
+        self._weights = array("I")
+        self._sources = array("B")
+        self._source_names: List[str] = list(DEFAULT_SOURCES)
+        self._source_ids: Dict[str, int] = {s: i for i, s in enumerate(self._source_names)}
+        # ascending sequence number per entry; the message index maps ids to these, so pops need no reindexing
+        self._seqs = array("Q")
+        self._next_seq = 0
+        # messageId -> seq of its first entry, and seqs of any further entries with the same id
+        self._by_message: Dict[int, int] = {}
+        self._more_messages: Dict[int, List[int]] = {}
+        # content_key -> number of entries with that content; built on the first has_content() call
+        self._content: Optional[Dict[int, int]] = None
+        # running totals for corpus limits
+        self.nbytes = 0
+        self._author_counts: Dict[Any, int] = {}
+        if entries:
+            self.extend(entries)
+
+    def __len__(self) -> int:
+        return len(self._texts)
+
+    def __iter__(self) -> Iterator[TextRow]:
+        for i in range(len(self._texts)):
+            yield TextRow(self, i)
+
+    def __getitem__(self, i: int) -> TextRow:
+        if i < 0:
+            i += len(self._texts)
+        if not 0 <= i < len(self._texts):
+            raise IndexError(i)
+        return TextRow(self, i)
+
+    def append(self, entry: Dict[str, Any]):
+        i = len(self._texts)
+        text = entry.get("text", "") or ""
+        self._texts.append(text)
+        self.nbytes += len(text.encode("utf-8", "surrogatepass"))
+        for col, field in enumerate(_ID_FIELDS):
+            value = entry.get(field)
+            n = _id_to_int(value)
+            if n is None:
+                self._odd_ids[col][i] = value
+                n = 0
+            self._ids[col].append(n)
+        try:
+            weight = max(0, int(entry.get("weight", 1)))
+        except Exception:
+            weight = 1
+        self._weights.append(weight)
+        self._sources.append(self._source_id(entry.get("source", "channel") or "channel"))
+        seq = self._next_seq
+        self._next_seq += 1
+        self._seqs.append(seq)
+        mid = self._ids[1][i]
+        if mid:
+            if mid in self._by_message:
+                self._more_messages.setdefault(mid, []).append(seq)
+            else:
+                self._by_message[mid] = seq
+        author = self._author_key(i)
+        self._author_counts[author] = self._author_counts.get(author, 0) + 1
+        if self._content is not None:
+            k = content_key(text)
+            self._content[k] = self._content.get(k, 0) + 1
+
+    def extend(self, entries: Iterable[Dict[str, Any]]):
+        for entry in entries:
+            if isinstance(entry, dict):
+                self.append(entry)
+
+    def clear(self):
+        self.__init__()
+
+    def copy(self) -> "TextStore":
+        """Column copy sharing the text strings (a few ms for 200k entries), for serializing off-lock.
+        The copy has no message or content index.
+        """
+        other = TextStore.__new__(TextStore)
+        other._texts = list(self._texts)
+        other._ids = (self._ids[0][:], self._ids[1][:])
+        other._odd_ids = (dict(self._odd_ids[0]), dict(self._odd_ids[1]))
+        other._weights = self._weights[:]
+        other._sources = self._sources[:]
+        other._source_names = list(self._source_names)
+        other._source_ids = dict(self._source_ids)
+        other._seqs = self._seqs[:]
+        other._next_seq = self._next_seq
+        other._by_message, other._more_messages, other._content = {}, {}, None
+        other.nbytes = self.nbytes
+        other._author_counts = {}
+        return other
+
+    def pop(self, i: int) -> Dict[str, Any]:
+        """Remove entry i and return it as a dict. O(n) memmove of the columns."""
+        if i < 0:
+            i += len(self._texts)
+        entry = self[i].to_dict()
+        self._unindex(i)
+        del self._texts[i]
+        for col in (0, 1):
+            del self._ids[col][i]
+            odd = self._odd_ids[col]
+            if odd:
+                odd.pop(i, None)
+                shifted = {(k - 1 if k > i else k): v for k, v in odd.items()}
+                odd.clear()
+                odd.update(shifted)
+        del self._weights[i]
+        del self._sources[i]
+        del self._seqs[i]
+        return entry
+
+    def pop_many(self, indexes: Iterable[int]) -> List[Dict[str, Any]]:
+        """Remove several entries in one O(n) pass over the columns; returns them as dicts in order."""
+        drop = sorted({i for i in indexes if 0 <= i < len(self._texts)})
+        if not drop:
+            return []
+        removed = [self[i].to_dict() for i in drop]
+        for i in drop:
+            self._unindex(i)
+        dropped = set(drop)
+        keep = [i for i in range(len(self._texts)) if i not in dropped]
+        self._texts = [self._texts[i] for i in keep]
+        self._ids = tuple(array("Q", [col[i] for i in keep]) for col in self._ids)
+        # odd ids shift down by the number of dropped entries before them
+        self._odd_ids = tuple({k - bisect_left(drop, k): v for k, v in odd.items() if k not in dropped}
+                              for odd in self._odd_ids)
+        self._weights = array("I", [self._weights[i] for i in keep])
+        self._sources = array("B", [self._sources[i] for i in keep])
+        self._seqs = array("Q", [self._seqs[i] for i in keep])
+        return removed
+
+    def set_text(self, i: int, text: str):
+        """Replace the text of entry i, keeping its ids, weight, source and position."""
+        old = self._texts[i]
+        self.nbytes += len(text.encode("utf-8", "surrogatepass")) - len(old.encode("utf-8", "surrogatepass"))
+        self._texts[i] = text
+        if self._content is not None:
+            self._uncount_content(old)
+            k = content_key(text)
+            self._content[k] = self._content.get(k, 0) + 1
+
+    def has_message(self, message_id: Any) -> bool:
+        """Whether an entry with this messageId is stored. O(1) for snowflake ids."""
+        n = _id_to_int(message_id)
+        if n is None:
+            return message_id is not None and message_id in self._odd_ids[1].values()
+        return n in self._by_message
+
+    def has_content(self, text: str) -> bool:
+        """Whether an entry with the same content (see content_key) is stored. O(1) once the index exists."""
+        if self._content is None:
+            self._content = {}
+            for t in self._texts:
+                k = content_key(t)
+                self._content[k] = self._content.get(k, 0) + 1
+        return content_key(text) in self._content
+
+    def index_of_message(self, message_id: Any) -> int:
+        """Position of the first entry with this messageId, or -1. O(log n) for snowflake ids."""
+        hits = self.indexes_of_message(message_id)
+        return hits[0] if hits else -1
+
+    def indexes_of_message(self, message_id: Any) -> List[int]:
+        """Positions of every entry with this messageId, ascending."""
+        n = _id_to_int(message_id)
+        if n is None:
+            return sorted(i for i, v in self._odd_ids[1].items() if v == message_id)
+        first = self._by_message.get(n)
+        if first is None:
+            return []
+        seqs = [first] + self._more_messages.get(n, [])
+        return [bisect_left(self._seqs, seq) for seq in seqs]
+
+    def indexes_of_author(self, author_id: Any) -> List[int]:
+        """Positions of every entry by author_id (a snowflake string/int or a raw odd value)."""
+        n = _id_to_int(author_id)
+        if n is None:
+            return sorted(i for i, v in self._odd_ids[0].items() if v == author_id)
+        return [i for i, v in enumerate(self._ids[0]) if v == n]
+
+    def top_author(self) -> Optional[Any]:
+        """Author (int id, or the raw value for odd ids) with the most stored entries."""
+        if not self._author_counts:
+            return None
+        return max(self._author_counts.items(), key=lambda kv: kv[1])[0]
+
+    def first_index_of_author(self, author: Any) -> int:
+        """Position of the oldest entry by author (as returned by top_author), or -1."""
+        if isinstance(author, int):
+            try:
+                return self._ids[0].index(author)
+            except ValueError:
+                return -1
+        hits = [i for i, v in self._odd_ids[0].items() if v == author]
+        return min(hits) if hits else -1
+
+    def iter_weighted(self, start: int = 0) -> Iterator[Tuple[str, int]]:
+        """(text, weight) pairs from position start on, for training, without building per-row objects."""
+        if start > 0:
+            return zip(self._texts[start:], self._weights[start:])
+        return zip(self._texts, self._weights)
+
+    def to_list(self) -> List[Dict[str, Any]]:
+        """Entry dicts in the stored-entry format used on disk and by older callers."""
+        return [TextRow(self, i).to_dict() for i in range(len(self._texts))]
+
+    # ---------------- internal helpers ----------------
+    def _unindex(self, i: int):
+        """Drop entry i from the running totals and the message index (before it is removed)."""
+        author = self._author_key(i)
+        self._author_counts[author] -= 1
+        if not self._author_counts[author]:
+            del self._author_counts[author]
+        self.nbytes -= len(self._texts[i].encode("utf-8", "surrogatepass"))
+        if self._content is not None:
+            self._uncount_content(self._texts[i])
+        mid, seq = self._ids[1][i], self._seqs[i]
+        if not mid:
+            return
+        more = self._more_messages.get(mid)
+        if self._by_message.get(mid) == seq:
+            if more:
+                self._by_message[mid] = more.pop(0)
+            else:
+                del self._by_message[mid]
+        elif more and seq in more:
+            more.remove(seq)
+        if more is not None and not more:
+            del self._more_messages[mid]
+
+    def _uncount_content(self, text: str):
+        k = content_key(text)
+        n = self._content.get(k, 0) - 1
+        if n > 0:
+            self._content[k] = n
+        else:
+            self._content.pop(k, None)
+
+    def _get_id(self, col: int, i: int) -> Optional[str]:
+        n = self._ids[col][i]
+        if n == 0:
+            return self._odd_ids[col].get(i)
+        return str(n)
+
+    def _author_key(self, i: int) -> Any:
+        n = self._ids[0][i]
+        return n if n else self._odd_ids[0].get(i)
+
+    def _source_id(self, source: str) -> int:
+        sid = self._source_ids.get(source)
+        if sid is None:
+            if len(self._source_names) >= 256:
+                source = "channel"
+                return self._source_ids[source]
+            sid = self._source_ids[source] = len(self._source_names)
+            self._source_names.append(source)
+        return sid